@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+import httpx
+from fastapi import UploadFile
+from sqlmodel import Session
+
+from http_client import async_http_client
+from models import Run
+from mcp_client import call_mcp_async, call_mcp_batch_async, split_result_and_trace
+from pdf import extract_document_async, file_sha256, spool_upload
+from repository import RunWriteBuffer, create_runs
+
+logger = logging.getLogger("invoice-api")
+
+# max invoices in flight at once for a single batch request
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+# invoices per MCP /process/batch request; 1 = one /process request per invoice
+MCP_BATCH_CHUNK = int(os.getenv("MCP_BATCH_CHUNK", "8"))
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, int]:
+    return {
+        "total_files": len(results),
+        "ok": sum(1 for it in results if it["status"] == "ok"),
+        "warning": sum(1 for it in results if it["status"] == "warning"),
+        "error": sum(1 for it in results if it["status"] == "error"),
+    }
+
+
+async def analyze_pdf_file(client: httpx.AsyncClient, path: str, pdf_hash: Optional[str] = None) -> tuple[Any, Any]:
+    """
+    PDF file -> text + layout (process pool, sharded for large documents) -> MCP (async HTTP).
+    Returns (result, trace).
+    """
+    content = await extract_document_async(path)
+    mcp_payload = await call_mcp_async(
+        client, content.text, pdf_hash=pdf_hash or file_sha256(path), layout=content.layout
+    )
+    return split_result_and_trace(mcp_payload)
+
+
+def _new_item(f: UploadFile, run: Run) -> Dict[str, Any]:
+    return {
+        "run_id": run.id,
+        "filename": f.filename,
+        "status": "running",
+        "result": None,
+        "trace": None,
+        "error": None,
+    }
+
+
+def _persist_ok(writes: RunWriteBuffer, item: Dict[str, Any], run: Run, result: Any, trace: Any) -> None:
+    # Persist (the session is only touched from the event loop thread); commits are grouped
+    payload = writes.ok(run, result=result if isinstance(result, dict) else {"result": result}, trace=trace)
+
+    item["result"] = payload.result_json
+    item["trace"] = payload.trace_json
+    item["status"] = "warning" if run.warning_count else "ok"
+
+
+def _persist_error(writes: RunWriteBuffer, item: Dict[str, Any], run: Run, e: BaseException) -> None:
+    writes.error(run, str(e))
+    item["status"] = "error"
+    item["error"] = {"message": str(e)}
+
+
+async def _process_one(
+    client: httpx.AsyncClient,
+    sem: asyncio.Semaphore,
+    writes: RunWriteBuffer,
+    f: UploadFile,
+    run: Run,
+) -> Dict[str, Any]:
+    item = _new_item(f, run)
+
+    try:
+        async with sem:
+            upload = await spool_upload(f)
+            try:
+                result, trace = await analyze_pdf_file(client, upload.path, upload.sha256)
+            finally:
+                os.unlink(upload.path)
+
+        _persist_ok(writes, item, run, result, trace)
+
+    except Exception as e:
+        _persist_error(writes, item, run, e)
+
+    return item
+
+
+async def _pdf_content(sem: asyncio.Semaphore, f: UploadFile) -> tuple[str, str, Optional[Dict[str, Any]]]:
+    async with sem:
+        upload = await spool_upload(f)
+        try:
+            content = await extract_document_async(upload.path)
+            return content.text, upload.sha256, content.layout
+        finally:
+            os.unlink(upload.path)
+
+
+async def _process_chunk(
+    client: httpx.AsyncClient,
+    sem: asyncio.Semaphore,
+    writes: RunWriteBuffer,
+    chunk: List[tuple[UploadFile, Run]],
+) -> List[Dict[str, Any]]:
+    """
+    PDF -> text + layout for every file of the chunk (at most `sem` at a time), then one MCP
+    /process/batch request for all of them. Failures stay per invoice.
+    """
+    items = [_new_item(f, run) for f, run in chunk]
+    contents = await asyncio.gather(*(_pdf_content(sem, f) for f, _ in chunk), return_exceptions=True)
+
+    ready = []
+    for i, content in enumerate(contents):
+        if isinstance(content, BaseException):
+            _persist_error(writes, items[i], chunk[i][1], content)
+        else:
+            ready.append(i)
+    if not ready:
+        return items
+
+    try:
+        answers = await call_mcp_batch_async(client, [contents[i] for i in ready])
+    except Exception as e:
+        answers = [e] * len(ready)
+
+    for i, answer in zip(ready, answers):
+        run = chunk[i][1]
+        if isinstance(answer, BaseException):
+            _persist_error(writes, items[i], run, answer)
+        else:
+            result, trace = split_result_and_trace(answer)
+            _persist_ok(writes, items[i], run, result, trace)
+    return items
+
+
+async def run_batch(
+    session: Session,
+    files: List[UploadFile],
+    workers: Optional[int] = None,
+    client: Optional[httpx.AsyncClient] = None,
+    chunk_size: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Processes a batch with bounded concurrency.
+    - at most `workers` invoices are parsed at the same time
+    - invoices go to MCP in chunks of `chunk_size` (MCP_BATCH_CHUNK), one request per chunk
+    - results are returned in upload order
+    - one failing invoice never fails the batch
+    """
+    # create runs upfront (one transaction) so run ids follow upload order
+    runs = create_runs(session, [f.filename for f in files])
+    sem = asyncio.Semaphore(max(1, workers or BATCH_WORKERS))
+    writes = RunWriteBuffer(session)
+    size = MCP_BATCH_CHUNK if chunk_size is None else chunk_size
+
+    client = client or async_http_client()
+    try:
+        if size <= 1:
+            return await asyncio.gather(
+                *(_process_one(client, sem, writes, f, run) for f, run in zip(files, runs))
+            )
+        pairs = list(zip(files, runs))
+        chunks = await asyncio.gather(
+            *(_process_chunk(client, sem, writes, pairs[i:i + size]) for i in range(0, len(pairs), size))
+        )
+        return [item for chunk in chunks for item in chunk]
+    finally:
+        writes.flush()
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import zlib
+import asyncio
+import hashlib
+import tempfile
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("invoice-api")
+
+# How much trace is persisted with a run:
+# - off: nothing
+# - summary: small values inline, large ones moved to the blob store (hash+length refs)
+# - full: everything inline in runs.trace_json
+TRACE_LEVELS = ("off", "summary", "full")
+TRACE_LEVEL = os.getenv("TRACE_LEVEL", "summary").lower()
+TRACE_INLINE_MAX_CHARS = int(os.getenv("TRACE_INLINE_MAX_CHARS", "256"))
+BLOB_DIR = Path(os.getenv("BLOB_DIR", "./data/blobs"))
+# blobs not written or referenced again for this long are deleted (0 = keep forever);
+# older runs then show the hash+length reference instead of the value
+BLOB_RETENTION_DAYS = float(os.getenv("BLOB_RETENTION_DAYS", "90"))
+BLOB_SWEEP_INTERVAL_S = float(os.getenv("BLOB_SWEEP_INTERVAL_S", str(6 * 3600)))
+
+_sweeper: Optional[asyncio.Task] = None
+
+
+def trace_level() -> str:
+    return TRACE_LEVEL if TRACE_LEVEL in TRACE_LEVELS else "summary"
+
+
+def _encode(value: Any) -> tuple[str, bytes]:
+    # same encoding as mcp/tracing.py: its previews report the same len / sha256 as these refs
+    if isinstance(value, str):
+        return "text", value.encode("utf-8")
+    return "json", json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+
+
+def _blob_path(digest: str) -> Path:
+    return BLOB_DIR / digest[:2] / f"{digest}.z"
+
+
+def put_blob(raw: bytes) -> str:
+    """
+    Content-addressed, zlib-compressed write. Identical payloads are stored once.
+    """
+    digest = hashlib.sha256(raw).hexdigest()
+    path = _blob_path(digest)
+    if path.exists():
+        try:
+            os.utime(path)  # referenced again: mtime is the last use, see sweep_blobs
+            return digest
+        except FileNotFoundError:
+            pass  # swept meanwhile: write it again
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent)
+    with os.fdopen(fd, "wb") as out:
+        out.write(zlib.compress(raw))
+    os.replace(tmp, path)
+    return digest
+
+
+def get_blob(digest: str) -> Optional[bytes]:
+    try:
+        return zlib.decompress(_blob_path(digest).read_bytes())
+    except (FileNotFoundError, zlib.error):
+        return None
+
+
+def _is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and "$blob" in value and "len" in value
+
+
+def _externalize_value(value: Any, max_chars: int) -> Any:
+    if value is None or isinstance(value, (bool, int, float)) or _is_ref(value):
+        return value
+    kind, raw = _encode(value)
+    if len(raw) <= max_chars:
+        return value
+    return {"$blob": put_blob(raw), "type": kind, "len": len(raw)}
+
+
+def _resolve_value(value: Any) -> Any:
+    if not _is_ref(value):
+        return value
+    raw = get_blob(value["$blob"])
+    if raw is None:
+        return value  # blob swept (BLOB_RETENTION_DAYS): keep the reference
+    text = raw.decode("utf-8")
+    return text if value.get("type") == "text" else json.loads(text)
+
+
+def _map_events(trace_json: Dict[str, Any], fn) -> Dict[str, Any]:
+    events = trace_json.get("trace")
+    if not isinstance(events, list):
+        return trace_json
+    out = []
+    for ev in events:
+        if isinstance(ev, dict) and isinstance(ev.get("data"), dict):
+            ev = {**ev, "data": {k: fn(v) for k, v in ev["data"].items()}}
+        out.append(ev)
+    return {**trace_json, "trace": out}
+
+
+def trace_for_storage(trace_json: Dict[str, Any], level: Optional[str] = None) -> Dict[str, Any]:
+    """
+    What goes into runs.trace_json for the configured TRACE_LEVEL.
+    """
+    level = level or trace_level()
+    if level == "off":
+        return {}
+    if level == "full":
+        return trace_json
+    return _map_events(trace_json, lambda v: _externalize_value(v, TRACE_INLINE_MAX_CHARS))
+
+
+def resolve_trace(trace_json: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Loads externalized values back (for /runs/{id}?trace=full).
+    """
+    return _map_events(trace_json or {}, _resolve_value)
+
+
+def sweep_blobs(max_age_s: Optional[float] = None) -> int:
+    """
+    Retention: deletes blobs (and leftover temp files of interrupted writes) last written or
+    referenced more than max_age_s ago (default BLOB_RETENTION_DAYS). Returns the count.
+    """
+    age = BLOB_RETENTION_DAYS * 86400 if max_age_s is None else max_age_s
+    if age <= 0 or not BLOB_DIR.exists():
+        return 0
+    cutoff = time.time() - age
+    removed = 0
+    for path in BLOB_DIR.glob("*/*"):
+        try:
+            if path.is_file() and path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            continue
+    if removed:
+        logger.info("blob store: %s blobs past retention removed", removed)
+    return removed
+
+
+async def _sweep_loop() -> None:
+    while True:
+        try:
+            await asyncio.to_thread(sweep_blobs)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("blob store sweep failed")
+        await asyncio.sleep(BLOB_SWEEP_INTERVAL_S)
+
+
+def start_blob_sweeper() -> None:
+    global _sweeper
+    if _sweeper is None and BLOB_RETENTION_DAYS > 0:
+        _sweeper = asyncio.create_task(_sweep_loop())
+
+
+async def stop_blob_sweeper() -> None:
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        await asyncio.gather(_sweeper, return_exceptions=True)
+        _sweeper = None
@@ -1,20 +1,61 @@
 from __future__ import annotations
 
 import os
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlmodel import SQLModel, create_engine, Session
 
+# SQLite tuning: WAL lets readers run during writes, synchronous=NORMAL fsyncs at
+# checkpoints instead of on every commit (still crash-safe in WAL mode)
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# client/server databases (e.g. Postgres, shared by several API processes): connection pool per process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "30"))
+DB_POOL_RECYCLE_S = int(os.getenv("DB_POOL_RECYCLE_S", "1800"))
+
 def get_database_url() -> str:
     # default local path; override with DATABASE_URL if needed
     return os.getenv("DATABASE_URL", "sqlite:///./data/app.db")
 
-engine = create_engine(
-    get_database_url(),
-    echo=False,
-    connect_args={"check_same_thread": False} if get_database_url().startswith("sqlite") else {},
-)
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    cur.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.close()
+
+def make_engine(url: str) -> Engine:
+    """
+    SQLite (default): file database tuned for one API node.
+    Anything else (postgresql+psycopg://...): pooled connections, checked before use.
+    """
+    if url.startswith("sqlite"):
+        eng = create_engine(url, echo=False, connect_args={"check_same_thread": False})
+        event.listen(eng, "connect", _sqlite_pragmas)
+        return eng
+    return create_engine(
+        url,
+        echo=False,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT_S,
+        pool_recycle=DB_POOL_RECYCLE_S,
+        pool_pre_ping=True,
+    )
+
+engine = make_engine(get_database_url())
 
 def init_db() -> None:
+    # import here: migrations pull in the repository layer
+    from migrations import migrate
+
     SQLModel.metadata.create_all(engine)
+    migrate(engine)
 
 def get_session() -> Session:
-    return Session(engine)
+    # objects stay usable after commit without a refresh round trip
+    return Session(engine, expire_on_commit=False)
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import io
+import os
+import csv
+import json
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List
+
+# rows fetched from the database / written to the response per chunk
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "500"))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# flat export: run index columns first, then the main result fields
+EXPORT_COLUMNS = [
+    "id", "created_at", "status", "error_message", "source_filename",
+    "vendor", "invoice_number", "invoice_date", "due_date", "currency",
+    "subtotal", "amount_tax", "amount_total", "warning_count", "warnings",
+]
+_RUN_COLUMNS = {"id", "created_at", "status", "error_message", "source_filename",
+                "vendor", "invoice_date", "amount_total", "currency", "warning_count"}
+_NUMERIC = {"subtotal", "amount_tax", "amount_total"}
+
+
+class ExportUnavailable(RuntimeError):
+    pass
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _result(row: Any) -> Dict[str, Any]:
+    raw = row.result_json
+    if isinstance(raw, str):  # plain JSON text on some drivers
+        raw = json.loads(raw)
+    return raw if isinstance(raw, dict) else {}
+
+
+def flat_record(row: Any) -> Dict[str, Any]:
+    """
+    One export record: typed run columns win over the (raw) result values.
+    """
+    result = _result(row)
+    out: Dict[str, Any] = {}
+    for col in EXPORT_COLUMNS:
+        value = getattr(row, col) if col in _RUN_COLUMNS else result.get(col)
+        if col in _NUMERIC and value is not None and not isinstance(value, (int, float)):
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                value = None
+        out[col] = _plain(value)
+    warnings = result.get("warnings") or result.get("validation_warnings")
+    out["warnings"] = "; ".join(map(str, warnings)) if isinstance(warnings, list) else (warnings or None)
+    return out
+
+
+def _chunks(rows: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    chunk: List[Any] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def csv_chunks(rows: Iterable[Any], chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for chunk in _chunks(rows, chunk_rows):
+        writer.writerows(flat_record(row) for row in chunk)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")  # header only: no runs
+
+
+def jsonl_chunks(rows: Iterable[Any], chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    One JSON object per run: the index columns plus the full result.
+    """
+    for chunk in _chunks(rows, chunk_rows):
+        lines = []
+        for row in chunk:
+            record = {col: _plain(getattr(row, col)) for col in sorted(_RUN_COLUMNS)}
+            record["result"] = _result(row)
+            lines.append(json.dumps(record, ensure_ascii=False, default=str))
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _Sink(io.RawIOBase):
+    # write-only stream whose bytes are handed out after every row group
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        out, self._parts = b"".join(self._parts), []
+        return out
+
+
+def parquet_schema():
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise ExportUnavailable("parquet export needs pyarrow (pip install pyarrow)") from e
+    return pa.schema([
+        (col, pa.float64() if col in _NUMERIC else pa.int64() if col == "warning_count" else pa.string())
+        for col in EXPORT_COLUMNS
+    ])
+
+
+def parquet_chunks(rows: Iterable[Any], chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    One Parquet row group per chunk. Call parquet_schema() first to fail early without pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for chunk in _chunks(rows, chunk_rows):
+            writer.write_table(pa.Table.from_pylist([flat_record(row) for row in chunk], schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()  # footer
+
+
+WRITERS = {"csv": csv_chunks, "jsonl": jsonl_chunks, "parquet": parquet_chunks}
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import os
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict
+
+import yaml
+
+logger = logging.getLogger("invoice-api")
+
+# repo layout: <root>/config/features.yml ; in Docker mount it at /config/features.yml
+DEFAULT_FEATURES_PATH = Path(__file__).resolve().parents[1] / "config" / "features.yml"
+
+
+@lru_cache(maxsize=1)
+def load_features() -> Dict[str, Any]:
+    path = Path(os.getenv("FEATURES_CONFIG", str(DEFAULT_FEATURES_PATH)))
+    if not path.exists():
+        logger.warning("features config not found at %s, using defaults", path)
+        return {}
+    with path.open("r", encoding="utf-8") as fh:
+        return (yaml.safe_load(fh) or {}).get("features", {}) or {}
+
+
+def feature(dotted: str, default: Any = None) -> Any:
+    """
+    feature("pdf_extraction.max_file_size_mb", 10) -> value from config/features.yml or default.
+    """
+    node: Any = load_features()
+    for part in dotted.split("."):
+        if not isinstance(node, dict) or part not in node:
+            return default
+        node = node[part]
+    return node
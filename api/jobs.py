@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from batch import analyze_pdf_file
+from db import get_session
+from http_client import async_http_client
+from models import Job, Run
+from pdf import SpooledUpload
+from repository import create_run, update_run_ok, update_run_error, update_run_status
+
+logger = logging.getLogger("invoice-api")
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_SPOOL_DIR = Path(os.getenv("JOB_SPOOL_DIR", "./data/jobs"))
+JOB_POLL_S = float(os.getenv("JOB_POLL_S", "1.0"))
+# a "running" job whose worker has not finished within the lease is handed out again
+JOB_LEASE_S = int(os.getenv("JOB_LEASE_S", "600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+_wakeup: Optional[asyncio.Event] = None
+_tasks: List[asyncio.Task] = []
+
+
+def enqueue(session: Session, batch_id: str, filename: Optional[str], upload: SpooledUpload) -> Run:
+    """
+    Moves the spooled upload into the job spool dir and queues it. Returns the (queued) Run.
+    """
+    run = create_run(session, source_filename=filename, status="queued")
+
+    JOB_SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    path = JOB_SPOOL_DIR / f"{run.id}.pdf"
+    shutil.move(upload.path, path)
+
+    session.add(Job(batch_id=batch_id, run_id=run.id, file_path=str(path)))
+    session.commit()
+
+    if _wakeup is not None:
+        _wakeup.set()
+    return run
+
+
+def claim_next(session: Session) -> Optional[Job]:
+    """
+    Atomically moves the oldest queued (or lease-expired) job to running.
+    The conditional UPDATE makes this safe across workers and API processes.
+    """
+    now = datetime.utcnow()
+    expired = now - timedelta(seconds=JOB_LEASE_S)
+    stmt = (
+        select(Job)
+        .where((Job.status == "queued") | ((Job.status == "running") & (Job.locked_at < expired)))
+        .order_by(Job.created_at)
+        .limit(1)
+    )
+    job = session.exec(stmt).first()
+    if job is None:
+        return None
+
+    claimed = session.execute(
+        update(Job)
+        .where(Job.id == job.id, Job.status == job.status, Job.attempts == job.attempts)
+        .values(status="running", locked_at=now, attempts=job.attempts + 1)
+    )
+    session.commit()
+    if claimed.rowcount != 1:
+        return None  # another worker won the race
+    session.refresh(job)
+    return job
+
+
+def _finish(session: Session, job: Job) -> None:
+    job.status = "done"
+    session.add(job)
+    session.commit()
+    Path(job.file_path).unlink(missing_ok=True)
+
+
+async def process_job(session: Session, client: httpx.AsyncClient, job: Job) -> None:
+    run = session.get(Run, job.run_id)
+    if run is None:
+        _finish(session, job)
+        return
+
+    update_run_status(session, run, "running")
+    try:
+        result, trace = await analyze_pdf_file(client, job.file_path)
+        update_run_ok(session, run, result=result if isinstance(result, dict) else {"result": result}, trace=trace)
+    except Exception as e:
+        logger.warning("Job %s failed (attempt %s): %s", job.id, job.attempts, e)
+        if job.attempts < JOB_MAX_ATTEMPTS and isinstance(e, httpx.TransportError):
+            # MCP unreachable: give the job back to the queue
+            update_run_status(session, run, "queued")
+            job.status = "queued"
+            session.add(job)
+            session.commit()
+            return
+        update_run_error(session, run, str(e))
+    _finish(session, job)
+
+
+async def _worker_loop(worker_no: int) -> None:
+    logger.info("Job worker %s started", worker_no)
+    while True:
+        session = get_session()
+        try:
+            job = claim_next(session)
+            if job is not None:
+                await process_job(session, async_http_client(), job)
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Job worker %s crashed on a job", worker_no)
+        finally:
+            session.close()
+
+        # idle: wait for a new submission (same process) or poll (other processes)
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=JOB_POLL_S)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_workers(n: Optional[int] = None) -> None:
+    global _wakeup
+    if _tasks:
+        return
+    _wakeup = asyncio.Event()
+    for i in range(max(0, JOB_WORKERS if n is None else n)):
+        _tasks.append(asyncio.create_task(_worker_loop(i)))
+
+
+async def stop_workers() -> None:
+    for t in _tasks:
+        t.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+
+
+def batch_status(session: Session, batch_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Per-run progress of a submitted batch (same summary semantics as /analyze/batch).
+    """
+    stmt = (
+        select(Job, Run)
+        .where(Job.batch_id == batch_id, Job.run_id == Run.id)
+        .order_by(Job.created_at)
+    )
+    rows = session.exec(stmt).all()
+    if not rows:
+        return None
+
+    items: List[Dict[str, Any]] = []
+    for job, run in rows:
+        status = run.status
+        if status == "ok" and run.warning_count:
+            status = "warning"
+        items.append({
+            "run_id": run.id,
+            "filename": run.source_filename,
+            "status": status,
+            "attempts": job.attempts,
+            "error": {"message": run.error_message} if run.error_message else None,
+        })
+
+    counts = {s: sum(1 for it in items if it["status"] == s) for s in ("queued", "running", "ok", "warning", "error")}
+    return {
+        "batch_id": batch_id,
+        "done": counts["queued"] == 0 and counts["running"] == 0,
+        "summary": {"total_files": len(items), **counts},
+        "results": items,
+    }
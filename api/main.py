@@ -1,21 +1,35 @@
 import os
+import json
 import uuid
+import asyncio
 import logging
-from datetime import datetime
-from typing import Any, Dict, List, Optional
+from datetime import date, datetime
+from typing import Any, Dict, List, Literal, Optional
 
-import fitz
-import requests
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
+from batch import analyze_pdf_file, run_batch, summarize
+from blobs import resolve_trace, start_blob_sweeper, stop_blob_sweeper
 from db import init_db, get_session
+from export import EXPORT_CHUNK_ROWS, EXPORT_FORMATS, WRITERS, ExportUnavailable, parquet_schema
+from jobs import enqueue, start_workers, stop_workers, batch_status, JOB_POLL_S
+from http_client import async_http_client, close_http_clients
+from pdf import FileTooLarge, shutdown_pdf_pool, spool_upload
 from repository import (
     create_run,
     update_run_ok,
     update_run_error,
     list_runs,
+    next_cursor,
+    count_runs,
+    RunFilters,
     get_run,
+    get_run_payload,
+    iter_runs,
+    spend_summary,
+    warning_rates,
 )
 
 logger = logging.getLogger("invoice-api")
@@ -23,7 +37,6 @@ logging.basicConfig(level=logging.INFO)
 
 app = FastAPI(title="Invoice API", version="1.1")
 
-MCP_URL = os.getenv("MCP_URL", "http://mcp:8000/process")
 FRONTEND_ORIGIN = os.getenv("FRONTEND_ORIGIN", "*")
 
 app.add_middleware(
@@ -32,51 +45,56 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
 
-def extract_text_from_pdf(pdf_bytes: bytes) -> str:
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    return "\n".join(page.get_text() for page in doc)
+@app.on_event("startup")
+async def on_startup():
+    init_db()
+    start_workers()
+    start_blob_sweeper()
 
 
-def call_mcp(text: str, timeout_s: int = 120) -> Dict[str, Any]:
-    """
-    Calls the MCP server with extracted text and returns parsed JSON.
-    Raises an exception with helpful context if MCP is unreachable or returns invalid JSON.
-    """
-    logger.info("Calling MCP_URL=%s", MCP_URL)
-    resp = requests.post(MCP_URL, json={"text": text}, timeout=timeout_s)
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_workers()
+    await stop_blob_sweeper()
+    await close_http_clients()
+    shutdown_pdf_pool()
 
-    logger.info("MCP status=%s", resp.status_code)
-    preview = (resp.text or "")[:400]
-    logger.info("MCP response preview=%s", preview)
 
-    if resp.status_code >= 400:
-        # Preserve MCP error body for debugging
-        raise RuntimeError(f"MCP error {resp.status_code}: {preview}")
-
-    try:
-        return resp.json()
-    except Exception as e:
-        raise RuntimeError(f"MCP returned non-JSON response: {preview}") from e
+def new_batch_id() -> str:
+    return f"b_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
 
 
-def split_result_and_trace(mcp_payload: Any) -> tuple[Any, Any]:
+async def submit_files(files: List[UploadFile]) -> Dict[str, Any]:
     """
-    If MCP returns {"trace": [...], ...fields...} => separate trace and result.
-    Otherwise just return the payload as result with empty trace.
+    Submit-and-poll mode: queue every file for the background workers and return ids immediately.
     """
-    if isinstance(mcp_payload, dict):
-        trace = mcp_payload.get("trace", [])
-        result = {k: v for k, v in mcp_payload.items() if k != "trace"}
-        return result, trace
-    return mcp_payload, []
-
-
-@app.on_event("startup")
-def on_startup():
-    init_db()
+    batch_id = new_batch_id()
+    session = get_session()
+    try:
+        uploads = []
+        try:
+            for f in files:
+                uploads.append(await spool_upload(f))
+        except FileTooLarge as e:
+            for u in uploads:
+                os.unlink(u.path)
+            raise HTTPException(status_code=413, detail=str(e))
+        runs = [enqueue(session, batch_id, f.filename, u) for f, u in zip(files, uploads)]
+        return {
+            "batch_id": batch_id,
+            "created_at": datetime.utcnow().isoformat(),
+            "status_url": f"/jobs/{batch_id}",
+            "events_url": f"/jobs/{batch_id}/events",
+            "results": [
+                {"run_id": r.id, "filename": r.source_filename, "status": r.status} for r in runs
+            ],
+        }
+    finally:
+        session.close()
 
 
 @app.get("/")
@@ -85,29 +103,37 @@ def health():
 
 
 @app.post("/analyze")
-async def analyze(file: UploadFile = File(...)):
+async def analyze(file: UploadFile = File(...), wait: bool = Query(True)):
+    if not wait:
+        submitted = await submit_files([file])
+        return {**submitted, "run_id": submitted["results"][0]["run_id"], "status": "queued"}
+
     session = get_session()
     run = create_run(session, source_filename=file.filename)
 
     try:
-        pdf_bytes = await file.read()
-        text = extract_text_from_pdf(pdf_bytes)
-
-        logger.info("Received file: %s (%s)", file.filename, file.content_type)
-        logger.info("Extracted text length: %s", len(text))
+        upload = await spool_upload(file)
+        logger.info("Received file: %s (%s, %s bytes)", file.filename, file.content_type, upload.size)
 
-        mcp_payload = call_mcp(text)
-        result, trace = split_result_and_trace(mcp_payload)
+        # parsing runs in the PDF process pool and MCP is awaited: the event loop stays free
+        try:
+            result, trace = await analyze_pdf_file(async_http_client(), upload.path, upload.sha256)
+        finally:
+            os.unlink(upload.path)
 
         run = update_run_ok(session, run, result=result if isinstance(result, dict) else {"result": result}, trace=trace)
+        payload = get_run_payload(session, run.id)
 
         return {
             "run_id": run.id,
             "status": run.status,
-            "result": run.result_json,
-            "trace": run.trace_json,
+            "result": payload.result_json,
+            "trace": payload.trace_json,
         }
 
+    except FileTooLarge as e:
+        update_run_error(session, run, str(e))
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         update_run_error(session, run, str(e))
         raise HTTPException(status_code=500, detail=str(e))
@@ -116,75 +142,27 @@ async def analyze(file: UploadFile = File(...)):
 
 
 @app.post("/analyze/batch")
-async def analyze_batch(files: List[UploadFile] = File(...)):
+async def analyze_batch(files: List[UploadFile] = File(...), wait: bool = Query(True)):
     """
-    Upload multiple PDFs and process them invoice-by-invoice.
+    Upload multiple PDFs and process them concurrently (BATCH_WORKERS at a time),
+    sent to MCP in chunks of MCP_BATCH_CHUNK invoices. Results keep the upload order.
+    With wait=false the files are queued and the batch id is returned immediately (poll /jobs/{batch_id}).
     IMPORTANT: Batch never fails entirely because of one invoice.
     """
-    batch_id = f"b_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    if not wait:
+        return await submit_files(files)
+
+    batch_id = new_batch_id()
 
     session = get_session()
-    results: List[Dict[str, Any]] = []
-    ok = warn = err = 0
 
     try:
-        for f in files:
-            run = create_run(session, source_filename=f.filename)
-            item: Dict[str, Any] = {
-                "run_id": run.id,
-                "filename": f.filename,
-                "status": "running",
-                "result": None,
-                "trace": None,
-                "error": None,
-            }
-
-            try:
-                pdf_bytes = await f.read()
-                text = extract_text_from_pdf(pdf_bytes)
-
-                mcp_payload = call_mcp(text)
-                result, trace = split_result_and_trace(mcp_payload)
-
-                # Persist
-                run = update_run_ok(
-                    session,
-                    run,
-                    result=result if isinstance(result, dict) else {"result": result},
-                    trace=trace,
-                )
-
-                item["status"] = "ok"
-                item["result"] = run.result_json
-                item["trace"] = run.trace_json
-
-                # Simple warning heuristic (optional): if MCP/validator provides warnings, expose them
-                warnings = None
-                if isinstance(item["result"], dict):
-                    warnings = item["result"].get("warnings") or item["result"].get("validation_warnings")
-                if warnings:
-                    item["status"] = "warning"
-                    warn += 1
-                else:
-                    ok += 1
-
-            except Exception as e:
-                update_run_error(session, run, str(e))
-                item["status"] = "error"
-                item["error"] = {"message": str(e)}
-                err += 1
-
-            results.append(item)
+        results = await run_batch(session, files)
 
         return {
             "batch_id": batch_id,
             "created_at": datetime.utcnow().isoformat(),
-            "summary": {
-                "total_files": len(files),
-                "ok": ok,
-                "warning": warn,
-                "error": err,
-            },
+            "summary": summarize(results),
             "results": results,
         }
 
@@ -192,11 +170,82 @@ async def analyze_batch(files: List[UploadFile] = File(...)):
         session.close()
 
 
+@app.get("/jobs/{batch_id}")
+def job_status(batch_id: str):
+    session = get_session()
+    try:
+        status = batch_status(session, batch_id)
+        if status is None:
+            raise HTTPException(status_code=404, detail="Batch not found")
+        return status
+    finally:
+        session.close()
+
+
+@app.get("/jobs/{batch_id}/events")
+async def job_events(batch_id: str):
+    """
+    Server-Sent Events: one "run" event per status change, then a final "done" event.
+    """
+    session = get_session()
+    try:
+        if batch_status(session, batch_id) is None:
+            raise HTTPException(status_code=404, detail="Batch not found")
+    finally:
+        session.close()
+
+    async def stream():
+        seen: Dict[str, str] = {}
+        while True:
+            session = get_session()
+            try:
+                status = batch_status(session, batch_id)
+            finally:
+                session.close()
+
+            for item in status["results"]:
+                if seen.get(item["run_id"]) != item["status"]:
+                    seen[item["run_id"]] = item["status"]
+                    yield f"event: run\ndata: {json.dumps(item)}\n\n"
+
+            if status["done"]:
+                yield f"event: done\ndata: {json.dumps(status['summary'])}\n\n"
+                return
+            await asyncio.sleep(JOB_POLL_S)
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
 @app.get("/runs")
-def runs(limit: int = Query(50, ge=1, le=200), offset: int = Query(0, ge=0)):
+def runs(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    status: Optional[str] = Query(None),
+    vendor: Optional[str] = Query(None, description="vendor prefix"),
+    date_from: Optional[date] = Query(None, description="invoice_date >= (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="invoice_date <= (YYYY-MM-DD)"),
+    amount_min: Optional[float] = Query(None),
+    amount_max: Optional[float] = Query(None),
+    count: bool = Query(False, description="add X-Total-Count"),
+):
+    """
+    Newest runs first. The body stays a plain list: the next page cursor is returned in
+    the X-Next-Cursor header (absent on the last page), the total in X-Total-Count.
+    """
+    filters = RunFilters(status, vendor, date_from, date_to, amount_min, amount_max)
     session = get_session()
     try:
-        items = list_runs(session, limit=limit, offset=offset)
+        try:
+            items = list_runs(session, limit=limit, offset=offset, cursor=cursor, filters=filters)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        nxt = next_cursor(items, limit)
+        if nxt:
+            response.headers["X-Next-Cursor"] = nxt
+        if count:
+            response.headers["X-Total-Count"] = str(count_runs(session, filters))
         return [
             {
                 "id": r.id,
@@ -204,8 +253,9 @@ def runs(limit: int = Query(50, ge=1, le=200), offset: int = Query(0, ge=0)):
                 "status": r.status,
                 "source_filename": r.source_filename,
                 "vendor": r.vendor,
-                "invoice_date": r.invoice_date,
+                "invoice_date": r.invoice_date.isoformat() if r.invoice_date else None,
                 "amount_total": r.amount_total,
+                "currency": r.currency,
             }
             for r in items
         ]
@@ -213,21 +263,130 @@ def runs(limit: int = Query(50, ge=1, le=200), offset: int = Query(0, ge=0)):
         session.close()
 
 
+# declared before /runs/{run_id} so "export" is not taken for a run id
+@app.get("/runs/export")
+def runs_export(
+    format: Literal["csv", "jsonl", "parquet"] = Query("csv"),
+    status: Optional[str] = Query(None),
+    vendor: Optional[str] = Query(None, description="vendor prefix"),
+    date_from: Optional[date] = Query(None, description="invoice_date >= (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="invoice_date <= (YYYY-MM-DD)"),
+    amount_min: Optional[float] = Query(None),
+    amount_max: Optional[float] = Query(None),
+):
+    """
+    All runs matching the /runs filters, newest first, streamed in EXPORT_CHUNK_ROWS chunks
+    (constant memory whatever the number of runs).
+    """
+    if format == "parquet":
+        try:
+            parquet_schema()
+        except ExportUnavailable as e:
+            raise HTTPException(status_code=501, detail=str(e))
+    filters = RunFilters(status, vendor, date_from, date_to, amount_min, amount_max)
+
+    def stream():
+        # the session lives as long as the response
+        session = get_session()
+        try:
+            rows = iter_runs(session, filters, chunk_size=EXPORT_CHUNK_ROWS)
+            yield from WRITERS[format](rows, EXPORT_CHUNK_ROWS)
+        finally:
+            session.close()
+
+    filename = f"runs_{datetime.utcnow():%Y%m%d_%H%M%S}.{format}"
+    return StreamingResponse(
+        stream(),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @app.get("/runs/{run_id}")
-def run_details(run_id: str):
+def run_details(run_id: str, trace: Literal["off", "summary", "full"] = Query("summary")):
     session = get_session()
     try:
         r = get_run(session, run_id)
         if not r:
             raise HTTPException(status_code=404, detail="Run not found")
+        # payload is only read here, never for list pages
+        payload = get_run_payload(session, run_id)
+        result_json = payload.result_json if payload else {}
+        trace_json = payload.trace_json if payload else {}
         return {
             "id": r.id,
             "created_at": r.created_at.isoformat(),
             "status": r.status,
             "error_message": r.error_message,
             "source_filename": r.source_filename,
-            "result": r.result_json,
-            "trace": r.trace_json,
+            "result": result_json,
+            # summary: as stored (large values are blob refs); full: refs loaded back
+            "trace": None if trace == "off" else resolve_trace(trace_json) if trace == "full" else trace_json,
         }
     finally:
         session.close()
+
+
+MONTH_PATTERN = r"^\d{4}-\d{2}$"
+
+
+def _spend(group: str, currency, vendor, month_from, month_to, limit):
+    session = get_session()
+    try:
+        return spend_summary(
+            session, group, currency=currency, vendor_prefix=vendor,
+            month_from=month_from, month_to=month_to, limit=limit,
+        )
+    finally:
+        session.close()
+
+
+# Dashboard aggregates over successful runs, served from the runaggregate summary table
+# (maintained with every run write): cost is O(groups), not O(runs).
+
+@app.get("/analytics/vendors")
+def analytics_vendors(
+    currency: Optional[str] = Query(None),
+    vendor: Optional[str] = Query(None, description="vendor prefix"),
+    month_from: Optional[str] = Query(None, pattern=MONTH_PATTERN, description="invoice month >= (YYYY-MM)"),
+    month_to: Optional[str] = Query(None, pattern=MONTH_PATTERN, description="invoice month <= (YYYY-MM)"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Spend per vendor and currency, largest first."""
+    return _spend("vendor", currency, vendor, month_from, month_to, limit)
+
+
+@app.get("/analytics/currencies")
+def analytics_currencies(
+    vendor: Optional[str] = Query(None, description="vendor prefix"),
+    month_from: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    month_to: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Spend per currency."""
+    return _spend("currency", None, vendor, month_from, month_to, limit)
+
+
+@app.get("/analytics/months")
+def analytics_months(
+    currency: Optional[str] = Query(None),
+    vendor: Optional[str] = Query(None, description="vendor prefix"),
+    month_from: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    month_to: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    limit: int = Query(240, ge=1, le=1000),
+):
+    """Spend per invoice month (YYYY-MM) and currency, oldest first; month null = no invoice date."""
+    return _spend("month", currency, vendor, month_from, month_to, limit)
+
+
+@app.get("/analytics/warnings")
+def analytics_warnings(
+    min_runs: int = Query(1, ge=1, description="skip vendors with fewer successful runs"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Warning rate per vendor (share of successful runs with validation warnings), highest first."""
+    session = get_session()
+    try:
+        return warning_rates(session, min_runs=min_runs, limit=limit)
+    finally:
+        session.close()
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import os
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import httpx
+
+from blobs import trace_level
+from http_client import apost
+
+logger = logging.getLogger("invoice-api")
+
+MCP_URL = os.getenv("MCP_URL", "http://mcp:8000/process")
+MCP_BATCH_URL = os.getenv("MCP_BATCH_URL", MCP_URL.rstrip("/") + "/batch")
+# a chunk waits for its slowest invoice (and the MCP-side queue)
+MCP_BATCH_TIMEOUT_S = int(os.getenv("MCP_BATCH_TIMEOUT_S", "600"))
+
+
+def _parse_mcp_response(status_code: int, body: str, payload_fn) -> Dict[str, Any]:
+    logger.info("MCP status=%s", status_code)
+    preview = (body or "")[:400]
+    logger.info("MCP response preview=%s", preview)
+
+    if status_code >= 400:
+        # Preserve MCP error body for debugging
+        raise RuntimeError(f"MCP error {status_code}: {preview}")
+
+    try:
+        return payload_fn()
+    except Exception as e:
+        raise RuntimeError(f"MCP returned non-JSON response: {preview}") from e
+
+
+def content_hash(pdf_bytes: bytes) -> str:
+    """
+    sha256 of the uploaded bytes: lets MCP answer re-uploads from its extraction cache.
+    """
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def _mcp_payload(text: str, pdf_hash: Optional[str], layout: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # "summary" is applied here when persisting (blob store), so MCP sends the full trace
+    level = trace_level()
+    payload: Dict[str, Any] = {
+        "text": text,
+        "include_trace": level != "off",
+        "trace_level": "off" if level == "off" else "full",
+    }
+    if pdf_hash:
+        payload["content_hash"] = pdf_hash
+    if layout:
+        payload["layout"] = layout
+    return payload
+
+
+async def call_mcp_async(
+    client: httpx.AsyncClient,
+    text: str,
+    timeout_s: int = 120,
+    pdf_hash: Optional[str] = None,
+    layout: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Calls MCP /process with extracted text (without blocking the event loop while MCP/LLM
+    is working) and returns parsed JSON. Raises with helpful context if MCP is unreachable
+    or returns invalid JSON.
+    """
+    logger.info("Calling MCP_URL=%s", MCP_URL)
+    resp = await apost(client, MCP_URL, read_timeout_s=timeout_s, json=_mcp_payload(text, pdf_hash, layout))
+    return _parse_mcp_response(resp.status_code, resp.text, resp.json)
+
+
+async def call_mcp_batch_async(
+    client: httpx.AsyncClient,
+    items: List[Tuple[str, Optional[str], Optional[Dict[str, Any]]]],
+    timeout_s: int = MCP_BATCH_TIMEOUT_S,
+) -> List[Union[Dict[str, Any], RuntimeError]]:
+    """
+    One MCP /process/batch call for several (text, pdf_hash, layout) items.
+    Returns per item, in input order, the MCP payload or a RuntimeError for a failed item.
+    A failing request (MCP down, HTTP error) raises like call_mcp_async.
+    """
+    logger.info("Calling MCP_BATCH_URL=%s (%s items)", MCP_BATCH_URL, len(items))
+    body = {"items": [_mcp_payload(text, pdf_hash, layout) for text, pdf_hash, layout in items]}
+    resp = await apost(client, MCP_BATCH_URL, read_timeout_s=timeout_s, json=body)
+    data = _parse_mcp_response(resp.status_code, resp.text, resp.json)
+
+    out: List[Union[Dict[str, Any], RuntimeError]] = [RuntimeError("MCP batch: no answer for this item")] * len(items)
+    for entry in data.get("items", []) if isinstance(data, dict) else []:
+        i = entry.get("index") if isinstance(entry, dict) else None
+        if not isinstance(i, int) or not 0 <= i < len(items):
+            continue
+        if entry.get("status") == "ok":
+            out[i] = entry.get("result") or {}
+        else:
+            out[i] = RuntimeError(f"MCP error: {entry.get('error') or 'unknown'}")
+    return out
+
+
+def split_result_and_trace(mcp_payload: Any) -> tuple[Any, Any]:
+    """
+    If MCP returns {"trace": [...], ...fields...} => separate trace and result.
+    Otherwise just return the payload as result with empty trace.
+    """
+    if isinstance(mcp_payload, dict):
+        trace = mcp_payload.get("trace", [])
+        result = {k: v for k, v in mcp_payload.items() if k != "trace"}
+        return result, trace
+    return mcp_payload, []
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import json
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlmodel import Session, select
+
+from models import Run, RunPayload
+from repository import RunDeltas, to_amount, to_currency, to_date, warning_count
+
+logger = logging.getLogger("invoice-api")
+
+# In-place upgrades of existing databases (e.g. data/app.db created by older versions).
+# create_all() only adds missing tables; column moves and backfills live here.
+# Every step must be a no-op on a database created from the current models.
+
+
+def _columns(conn: Connection, table: str) -> set:
+    insp = inspect(conn)
+    if not insp.has_table(table):
+        return set()
+    return {c["name"] for c in insp.get_columns(table)}
+
+
+def _split_run_payload(conn: Connection) -> None:
+    """
+    v1: result_json / trace_json moved from run to runpayload, run.warning_count added.
+    """
+    cols = _columns(conn, "run")
+    if "warning_count" not in cols:
+        conn.execute(text("ALTER TABLE run ADD COLUMN warning_count INTEGER NOT NULL DEFAULT 0"))
+    if "result_json" not in cols:
+        return
+
+    conn.execute(text(
+        "INSERT INTO runpayload (run_id, result_json, trace_json) "
+        "SELECT id, result_json, trace_json FROM run "
+        "WHERE status = 'ok' AND id NOT IN (SELECT run_id FROM runpayload)"
+    ))
+
+    rows = conn.execute(text("SELECT id, result_json FROM run WHERE status = 'ok'")).all()
+    for run_id, raw in rows:
+        result = json.loads(raw) if isinstance(raw, str) else raw
+        n = warning_count(result)
+        if n:
+            conn.execute(text("UPDATE run SET warning_count = :n WHERE id = :id"), {"n": n, "id": run_id})
+
+    for col in ("result_json", "trace_json"):
+        try:
+            conn.execute(text(f"ALTER TABLE run DROP COLUMN {col}"))
+        except Exception:
+            # old SQLite without DROP COLUMN: at least release the payload bytes
+            conn.execute(text(f"UPDATE run SET {col} = NULL"))
+    logger.info("migrated %s run payloads to runpayload", len(rows))
+
+
+def _create_run_indexes(conn: Connection) -> None:
+    # indexes on columns added by a later step are created by that step
+    cols = _columns(conn, "run")
+    for index in Run.__table__.indexes:
+        if all(c.name in cols for c in index.columns):
+            index.create(conn, checkfirst=True)
+
+
+def _run_indexes_and_counters(conn: Connection) -> None:
+    """
+    v2: composite (keyset pagination) indexes on run, runcounter backfilled from run.
+    """
+    _create_run_indexes(conn)
+    conn.execute(text("DELETE FROM runcounter"))
+    conn.execute(text("INSERT INTO runcounter (status, count) SELECT status, COUNT(*) FROM run GROUP BY status"))
+
+
+def _sqlite_rebuild_run(conn: Connection) -> None:
+    """
+    Replaces run.amount_total by run.amount_total_num without DROP COLUMN (SQLite < 3.35):
+    new table, copy, drop, rename; the indexes are recreated from their stored DDL.
+    """
+    defs, names = [], []
+    for col in inspect(conn).get_columns("run"):
+        name = col["name"]
+        if name == "amount_total":
+            continue
+        if name == "amount_total_num":
+            defs.append("amount_total NUMERIC(14, 2)")
+            names.append(("amount_total_num", "amount_total"))
+            continue
+        ddl = f"{name} {col['type']}"
+        if not col["nullable"]:
+            ddl += " NOT NULL"
+        if col["default"] is not None:
+            ddl += f" DEFAULT {col['default']}"
+        if col["primary_key"]:
+            ddl += " PRIMARY KEY"
+        defs.append(ddl)
+        names.append((name, name))
+
+    indexes = conn.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'run' AND sql IS NOT NULL"
+    )).scalars().all()
+    conn.execute(text(f"CREATE TABLE run_new ({', '.join(defs)})"))
+    conn.execute(text(
+        f"INSERT INTO run_new ({', '.join(new for _, new in names)}) "
+        f"SELECT {', '.join(old for old, _ in names)} FROM run"
+    ))
+    conn.execute(text("DROP TABLE run"))
+    conn.execute(text("ALTER TABLE run_new RENAME TO run"))
+    for ddl in indexes:
+        conn.execute(text(ddl))
+
+
+def _typed_run_columns(conn: Connection) -> None:
+    """
+    v3: run.invoice_date DATE and run.amount_total NUMERIC(14,2) (were strings);
+    on Postgres also JSONB payload columns with a GIN index on result_json.
+    Values that are not an ISO date / a number become NULL (the payload keeps the original).
+    """
+    if conn.dialect.name == "postgresql":
+        insp = inspect(conn)
+        run_types = {c["name"]: type(c["type"]).__name__ for c in insp.get_columns("run")}
+        if run_types.get("invoice_date") != "DATE":
+            conn.execute(text(
+                "ALTER TABLE run ALTER COLUMN invoice_date TYPE DATE USING CASE "
+                "WHEN invoice_date ~ '^\\d{4}-\\d{2}-\\d{2}' THEN substr(invoice_date, 1, 10)::date END"
+            ))
+        if run_types.get("amount_total") != "NUMERIC":
+            conn.execute(text(
+                "ALTER TABLE run ALTER COLUMN amount_total TYPE NUMERIC(14, 2) USING CASE "
+                "WHEN amount_total ~ '^-?\\d+(\\.\\d+)?$' THEN amount_total::numeric END"
+            ))
+        payload_types = {c["name"]: type(c["type"]).__name__ for c in insp.get_columns("runpayload")}
+        for col in ("result_json", "trace_json"):
+            if payload_types.get(col) != "JSONB":
+                conn.execute(text(f"ALTER TABLE runpayload ALTER COLUMN {col} TYPE JSONB USING {col}::jsonb"))
+        for index in RunPayload.__table__.indexes:
+            index.create(conn, checkfirst=True)
+        return
+
+    # SQLite: a VARCHAR column keeps text affinity (amounts would compare as strings),
+    # so amount_total is rebuilt as NUMERIC; dates only need ISO values
+    declared = {c["name"]: str(c["type"]).upper() for c in inspect(conn).get_columns("run")}
+    if not declared.get("amount_total", "").startswith("NUMERIC"):
+        conn.execute(text("DROP INDEX IF EXISTS ix_run_amount_total"))
+        conn.execute(text("ALTER TABLE run ADD COLUMN amount_total_num NUMERIC(14, 2)"))
+        for run_id, raw in conn.execute(text("SELECT id, amount_total FROM run WHERE amount_total IS NOT NULL")).all():
+            conn.execute(text("UPDATE run SET amount_total_num = :a WHERE id = :id"), {"a": to_amount(raw), "id": run_id})
+        try:
+            conn.execute(text("ALTER TABLE run DROP COLUMN amount_total"))
+            conn.execute(text("ALTER TABLE run RENAME COLUMN amount_total_num TO amount_total"))
+        except Exception:
+            # old SQLite without DROP COLUMN: copy into a new table and swap it in
+            _sqlite_rebuild_run(conn)
+        conn.execute(text("CREATE INDEX ix_run_amount_total ON run (amount_total)"))
+
+    for run_id, raw in conn.execute(text("SELECT id, invoice_date FROM run WHERE invoice_date IS NOT NULL")).all():
+        parsed = to_date(raw)
+        if (parsed.isoformat() if parsed else None) != raw:
+            conn.execute(
+                text("UPDATE run SET invoice_date = :d WHERE id = :id"),
+                {"d": parsed.isoformat() if parsed else None, "id": run_id},
+            )
+
+
+def _run_aggregates(conn: Connection) -> None:
+    """
+    v4: run.currency (from the payload) and the runaggregate summary table rebuilt from run.
+    """
+    if "currency" not in _columns(conn, "run"):
+        conn.execute(text("ALTER TABLE run ADD COLUMN currency VARCHAR"))
+    _create_run_indexes(conn)
+
+    rows = conn.execute(text(
+        "SELECT p.run_id, p.result_json FROM runpayload p JOIN run r ON r.id = p.run_id "
+        "WHERE r.currency IS NULL"
+    )).all()
+    for run_id, raw in rows:
+        result = json.loads(raw) if isinstance(raw, str) else raw
+        code = to_currency(result.get("currency")) if isinstance(result, dict) else None
+        if code:
+            conn.execute(text("UPDATE run SET currency = :c WHERE id = :id"), {"c": code, "id": run_id})
+
+    conn.execute(text("DELETE FROM runaggregate"))
+    with Session(bind=conn) as session:
+        deltas = RunDeltas()
+        for run in session.exec(select(Run).where(Run.status == "ok")):
+            deltas.add_run(run)
+        deltas.apply(session)
+        session.flush()
+
+
+MIGRATIONS: List[Tuple[int, Callable[[Connection], None]]] = [
+    (1, _split_run_payload),
+    (2, _run_indexes_and_counters),
+    (3, _typed_run_columns),
+    (4, _run_aggregates),
+]
+
+
+def migrate(engine: Engine) -> int:
+    """
+    Applies pending migrations in order; returns the resulting schema version.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        current = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        with engine.begin() as conn:
+            step(conn)
+            conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {"v": version})
+        logger.info("database schema migrated to v%s", version)
+        current = version
+    return current
@@ -1,27 +1,93 @@
 from __future__ import annotations
 
 from typing import Optional, Any, Dict, List
-from datetime import datetime
+from datetime import date, datetime
 from sqlmodel import SQLModel, Field
-from sqlalchemy import Column
+from sqlalchemy import Column, Date, Index, Numeric
 from sqlalchemy import JSON
+from sqlalchemy.dialects.postgresql import JSONB
 import uuid
 
+# JSON on SQLite, JSONB (indexable, binary) on Postgres
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 class Run(SQLModel, table=True):
+    """
+    Narrow run index: everything the history list shows and filters on.
+    The (large) result and trace live in RunPayload and are loaded on demand.
+    """
+    # keyset pagination walks (created_at, id) newest first, optionally within one status / vendor
+    __table_args__ = (
+        Index("ix_run_created_id", "created_at", "id"),
+        Index("ix_run_status_created_id", "status", "created_at", "id"),
+        Index("ix_run_vendor_created", "vendor", "created_at"),
+    )
+
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True, index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
 
-    status: str = Field(default="running", index=True)  # running | ok | error
+    status: str = Field(default="running", index=True)  # queued | running | ok | error
     error_message: Optional[str] = Field(default=None)
 
     source_filename: Optional[str] = Field(default=None, index=True)
 
     # denormalized “list view” fields
     vendor: Optional[str] = Field(default=None, index=True)
-    invoice_date: Optional[str] = Field(default=None, index=True)
-    amount_total: Optional[str] = Field(default=None, index=True)
+    invoice_date: Optional[date] = Field(default=None, sa_column=Column(Date, index=True))
+    amount_total: Optional[float] = Field(default=None, sa_column=Column(Numeric(14, 2, asdecimal=False), index=True))
+    currency: Optional[str] = Field(default=None, index=True)
+    warning_count: int = Field(default=0)
+
+
+class RunCounter(SQLModel, table=True):
+    """
+    Number of runs per status, maintained with every run write (constant-time totals for /runs).
+    """
+    status: str = Field(primary_key=True)
+    count: int = Field(default=0)
+
+
+class RunAggregate(SQLModel, table=True):
+    """
+    Incrementally maintained totals of successful runs per (vendor, currency, invoice month),
+    written in the same transaction as the run itself. "" stands for unknown.
+    """
+    vendor: str = Field(default="", primary_key=True)
+    currency: str = Field(default="", primary_key=True)
+    month: str = Field(default="", primary_key=True)  # YYYY-MM of invoice_date
+
+    run_count: int = Field(default=0)
+    amount_total: float = Field(default=0.0, sa_column=Column(Numeric(18, 2, asdecimal=False), nullable=False, default=0))
+    warning_runs: int = Field(default=0)  # runs with at least one warning
+
+
+class RunPayload(SQLModel, table=True):
+    """
+    Full payloads of a run (one row per finished run), fetched only for /runs/{run_id}.
+    """
+    # containment queries on results (result_json @> '{"currency": "EUR"}') on Postgres
+    __table_args__ = (
+        Index("ix_runpayload_result_gin", "result_json", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+
+    run_id: str = Field(primary_key=True, foreign_key="run.id")
+
+    result_json: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSONType, nullable=True))
+    trace_json: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSONType, nullable=True))
+
+
+class Job(SQLModel, table=True):
+    """
+    SQLite-backed work queue for submit-and-poll mode (one row per uploaded file).
+    Rows are kept after completion: they record batch membership for /jobs/{batch_id}.
+    """
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
 
-    # full payloads
-    result_json: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON, nullable=True))
-    trace_json: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON, nullable=True))
+    batch_id: str = Field(index=True)
+    run_id: str = Field(index=True)
+    file_path: str
 
+    status: str = Field(default="queued", index=True)  # queued | running | done
+    attempts: int = Field(default=0)
+    locked_at: Optional[datetime] = Field(default=None)
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import fitz
+from fastapi import UploadFile
+
+from features import feature
+
+# PyMuPDF parsing is CPU bound: run it in worker processes so the event loop stays free
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 2)))
+
+# budgets: stop reading a document once enough text was collected
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "50"))
+PDF_MAX_CHARS = int(os.getenv("PDF_MAX_CHARS", "200000"))
+# stop after the page where the invoice total appears (statements carry pages of annexes)
+PDF_STOP_AT_TOTALS = os.getenv("PDF_STOP_AT_TOTALS", "1") == "1"
+PDF_SPOOL_DIR = os.getenv("PDF_SPOOL_DIR") or None
+# large documents are split into page shards parsed by several pool workers
+# (counted within PDF_MAX_PAGES; shards are read in page order, PDF_WORKERS at a time, and
+# no new shard is started once the page with the totals was read)
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+PDF_PAGES_PER_SHARD = int(os.getenv("PDF_PAGES_PER_SHARD", "8"))
+# send line boxes and font sizes along with the text (read in the same PyMuPDF pass)
+PDF_LAYOUT = os.getenv("PDF_LAYOUT", "1") == "1"
+LAYOUT_COLUMNS = ("page", "block", "line", "x0", "y0", "x1", "y1", "size")
+
+CHUNK_SIZE = 1024 * 1024
+
+TOTALS_RE = re.compile(
+    r"^[ \t]*(?:grand[ \t]+total|total(?![ \t]*tax)|amount[ \t]+due|balance[ \t]+due|"
+    r"montant[ \t]+total|net[ \t]+[àa][ \t]+payer)\b[^\n\d]*\n?[^\n\d]*\d",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class FileTooLarge(ValueError):
+    pass
+
+
+@dataclass
+class PdfContent:
+    text: str
+    layout: Optional[Dict[str, List[Any]]] = None  # columnar, see mcp schemas.DocumentLayout
+
+
+# (text, layout columns of the page or None)
+PageContent = Tuple[str, Optional[Dict[str, List[Any]]]]
+
+
+@dataclass
+class SpooledUpload:
+    path: str
+    size: int
+    sha256: str
+
+
+def max_file_size_bytes() -> int:
+    return int(float(feature("pdf_extraction.max_file_size_mb", 10)) * 1024 * 1024)
+
+
+async def spool_upload(file: UploadFile, max_bytes: Optional[int] = None) -> SpooledUpload:
+    """
+    Streams an upload to a temp file (never holding the whole PDF in RAM),
+    hashing it on the way and enforcing pdf_extraction.max_file_size_mb.
+    The caller owns the returned file and must delete it.
+    """
+    limit = max_file_size_bytes() if max_bytes is None else max_bytes
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=PDF_SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > limit:
+                    raise FileTooLarge(
+                        f"{file.filename}: file exceeds max_file_size_mb ({limit // (1024 * 1024)} MB)"
+                    )
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return SpooledUpload(path=path, size=size, sha256=digest.hexdigest())
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def page_content(page: fitz.Page, with_layout: bool) -> PageContent:
+    """
+    Text of a page and, with_layout, its lines as columns: one get_text("dict") call gives
+    both (the text is rebuilt from the lines exactly as get_text() writes it). Lines carry
+    their line number in the text instead of their text, which MCP reads from the request.
+    """
+    if not with_layout:
+        return page.get_text(), None
+    cols: Dict[str, List[Any]] = {k: [] for k in LAYOUT_COLUMNS}
+    parts: List[str] = []
+    line_no = 0
+    for b, block in enumerate(page.get_text("dict")["blocks"]):
+        if block.get("type") != 0:
+            continue
+        for line in block["lines"]:
+            text = "".join(span["text"] for span in line["spans"])
+            parts.append(text + "\n")
+            x0, y0, x1, y1 = line["bbox"]
+            for key, value in zip(LAYOUT_COLUMNS, (page.number, b, line_no, x0, y0, x1, y1,
+                                                   max((span["size"] for span in line["spans"]), default=0.0))):
+                cols[key].append(round(value, 1) if isinstance(value, float) else value)
+            line_no += text.count("\n") + 1
+    cols["pages"] = [(round(page.rect.width, 1), round(page.rect.height, 1))]
+    return "".join(parts), cols
+
+
+def iter_pages(path: str, with_layout: bool = False) -> Iterator[PageContent]:
+    """
+    Yields page contents lazily: pages after an early stop are never parsed.
+    """
+    with fitz.open(path) as doc:
+        for page in doc:
+            yield page_content(page, with_layout)
+
+
+def _merge_layout(into: Dict[str, List[Any]], page: Dict[str, List[Any]], text: str, first_line: int) -> None:
+    """
+    Appends the page lines complete in `text` (the page text kept by the budget),
+    numbered from `first_line`, the line of the document text where the page starts.
+    """
+    complete = text.count("\n")
+    n = sum(1 for line in page["line"] if line < complete)
+    for key in LAYOUT_COLUMNS:
+        values = page[key][:n]
+        into[key] += [first_line + line for line in values] if key == "line" else values
+    into["pages"] += page["pages"]
+
+
+class _Assembler:
+    """
+    Joins page texts (and layouts) in page order, applying the page/char budgets and the
+    stop-at-totals rule; `done` tells when later pages are no longer needed.
+    """
+
+    def __init__(self, max_pages: Optional[int], max_chars: Optional[int], stop_at_totals: Optional[bool]):
+        self.max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+        self.max_chars = PDF_MAX_CHARS if max_chars is None else max_chars
+        self.stop_at_totals = PDF_STOP_AT_TOTALS if stop_at_totals is None else stop_at_totals
+        self.texts: List[str] = []
+        self.layout: Optional[Dict[str, List[Any]]] = None
+        self.chars = 0
+        self.first_line = 0  # line of the joined text where the next page starts
+        self.done = False
+
+    def add(self, content: PageContent) -> bool:
+        """
+        Adds the next page; False once the document is complete.
+        """
+        if self.done or len(self.texts) >= self.max_pages or self.chars >= self.max_chars:
+            self.done = True
+            return False
+        text, page_layout = content
+        text = text[: self.max_chars - self.chars]
+        self.texts.append(text)
+        self.chars += len(text)
+        if page_layout is not None:
+            if self.layout is None:
+                self.layout = {k: [] for k in ("pages",) + LAYOUT_COLUMNS}
+            _merge_layout(self.layout, page_layout, text, self.first_line)
+        self.first_line += text.count("\n") + 1
+        self.done = (
+            (self.stop_at_totals and bool(TOTALS_RE.search(text)))
+            or len(self.texts) >= self.max_pages or self.chars >= self.max_chars
+        )
+        return not self.done
+
+    def content(self) -> PdfContent:
+        return PdfContent(text="\n".join(self.texts), layout=self.layout)
+
+
+def _assemble(
+    pages: Iterable[PageContent],
+    max_pages: Optional[int],
+    max_chars: Optional[int],
+    stop_at_totals: Optional[bool],
+) -> PdfContent:
+    """
+    Joins page texts (and layouts) in order, applying the page/char budgets and the stop-at-totals rule.
+    """
+    assembler = _Assembler(max_pages, max_chars, stop_at_totals)
+    for content in pages:
+        if not assembler.add(content):
+            break
+    return assembler.content()
+
+
+def extract_document_from_path(
+    path: str,
+    max_pages: Optional[int] = None,
+    max_chars: Optional[int] = None,
+    stop_at_totals: Optional[bool] = None,
+    layout: Optional[bool] = None,
+) -> PdfContent:
+    with_layout = PDF_LAYOUT if layout is None else layout
+    return _assemble(iter_pages(path, with_layout), max_pages, max_chars, stop_at_totals)
+
+
+def extract_text_from_path(
+    path: str,
+    max_pages: Optional[int] = None,
+    max_chars: Optional[int] = None,
+    stop_at_totals: Optional[bool] = None,
+) -> str:
+    return extract_document_from_path(path, max_pages, max_chars, stop_at_totals, layout=False).text
+
+
+def page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def extract_page_range(path: str, start: int, stop: int, with_layout: bool = False) -> List[PageContent]:
+    """
+    Pool worker: opens the shared file itself and returns the contents of pages [start, stop).
+    """
+    with fitz.open(path) as doc:
+        return [page_content(doc[i], with_layout) for i in range(start, min(stop, doc.page_count))]
+
+
+async def extract_document_async(path: str, layout: Optional[bool] = None) -> PdfContent:
+    """
+    Picks the strategy from the page count:
+    - small documents: one worker, page-lazy with early stop
+    - large documents: page shards parsed in parallel (PDF_WORKERS ahead), reassembled in
+      page order; once the page with the totals is read no new shard is started
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_pdf_pool()
+    with_layout = PDF_LAYOUT if layout is None else layout
+    n = min(await asyncio.to_thread(page_count, path), PDF_MAX_PAGES)
+
+    if n < PDF_PARALLEL_MIN_PAGES:
+        return await loop.run_in_executor(pool, extract_document_from_path, path, None, None, None, with_layout)
+
+    step = max(1, PDF_PAGES_PER_SHARD)
+    starts = deque(range(0, n, step))
+    running: deque = deque()
+    assembler = _Assembler(None, None, None)
+    try:
+        while starts or running:
+            # PDF_WORKERS shards ahead of the page being assembled
+            while starts and len(running) < max(1, PDF_WORKERS):
+                start = starts.popleft()
+                running.append(loop.run_in_executor(pool, extract_page_range, path, start, min(start + step, n), with_layout))
+            for content in await running.popleft():
+                if not assembler.add(content):
+                    break
+            if assembler.done:
+                break
+    finally:
+        for fut in running:  # totals found: shards not started yet are dropped
+            fut.cancel()
+    return assembler.content()
+
+
+async def extract_text_async(path: str) -> str:
+    return (await extract_document_async(path, layout=False)).text
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """
+    Lazily created process pool shared by all requests.
+    Uses 'spawn' so workers never inherit the server's threads or open DB handles.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=max(1, PDF_WORKERS),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_pdf_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -1,19 +1,229 @@
 from __future__ import annotations
 
-from typing import Optional, Any, Dict, List
+import os
+import time
+import base64
+from dataclasses import dataclass, astuple
+from datetime import date, datetime
+from typing import Optional, Any, Dict, Iterator, List, Tuple
+from sqlalchemy import func, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlmodel import select
 from sqlmodel import Session
-from models import Run
+from models import Run, RunAggregate, RunCounter, RunPayload
+from blobs import trace_for_storage
 import logging
 logger = logging.getLogger("invoice-api")
 logging.basicConfig(level=logging.INFO)
 
-def create_run(session: Session, source_filename: Optional[str]) -> Run:
-    run = Run(source_filename=source_filename, status="running", result_json={}, trace_json={})
+# filtered totals (no counter available) are recomputed at most this often
+RUNS_COUNT_CACHE_S = float(os.getenv("RUNS_COUNT_CACHE_S", "30"))
+_count_cache: Dict[tuple, Tuple[float, int]] = {}
+# batch writes: grouped commits (see RunWriteBuffer)
+RUN_COMMIT_BATCH_SIZE = int(os.getenv("RUN_COMMIT_BATCH_SIZE", "32"))
+RUN_COMMIT_INTERVAL_S = float(os.getenv("RUN_COMMIT_INTERVAL_S", "0.5"))
+
+
+@dataclass(frozen=True)
+class RunFilters:
+    status: Optional[str] = None
+    vendor_prefix: Optional[str] = None
+    date_from: Optional[date] = None    # invoice_date, inclusive
+    date_to: Optional[date] = None
+    amount_min: Optional[float] = None  # amount_total, inclusive
+    amount_max: Optional[float] = None
+
+    def only_status(self) -> bool:
+        return not any(astuple(self)[1:])
+
+def result_warnings(result: Any) -> Any:
+    """
+    Simple warning heuristic: if MCP/validator provides warnings, expose them.
+    """
+    if isinstance(result, dict):
+        return result.get("warnings") or result.get("validation_warnings")
+    return None
+
+
+def warning_count(result: Any) -> int:
+    warnings = result_warnings(result)
+    if isinstance(warnings, list):
+        return len(warnings)
+    return 1 if warnings else 0
+
+
+def _bump_counter(session: Session, status: str, delta: int) -> None:
+    """
+    Adjusts the per-status run counter inside the caller's transaction.
+    """
+    res = session.execute(
+        update(RunCounter).where(RunCounter.status == status).values(count=RunCounter.count + delta)
+    )
+    if res.rowcount == 0:
+        session.add(RunCounter(status=status, count=delta))
+        session.flush()
+
+
+AggregateKey = Tuple[str, str, str]  # (vendor, currency, month)
+
+
+def _upsert_add(session: Session, table, keys: Dict[str, Any], amounts: Dict[str, Any]) -> None:
+    """
+    INSERT ... ON CONFLICT DO UPDATE adding `amounts` to the row at `keys`: concurrent writers
+    creating the same new row cannot fail on the primary key (SQLite and Postgres).
+    """
+    dialect = postgresql if session.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(table).values(**keys, **amounts)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: table.c[name] + stmt.excluded[name] for name in amounts},
+    ))
+
+
+def _bump_aggregate(session: Session, key: AggregateKey, runs: int, amount: float, warning_runs: int) -> None:
+    """
+    Adjusts one RunAggregate row inside the caller's transaction.
+    """
+    vendor, currency, month = key
+    _upsert_add(
+        session,
+        RunAggregate.__table__,
+        {"vendor": vendor, "currency": currency, "month": month},
+        {"run_count": runs, "amount_total": amount, "warning_runs": warning_runs},
+    )
+
+
+def aggregate_key(run: Run) -> AggregateKey:
+    month = run.invoice_date.strftime("%Y-%m") if run.invoice_date else ""
+    return (run.vendor or "", run.currency or "", month)
+
+
+class RunDeltas:
+    """
+    Counter and aggregate changes of staged run updates, applied in one go by apply()
+    (right before the commit of the same transaction).
+    """
+
+    def __init__(self) -> None:
+        self.status: Dict[str, int] = {}
+        self.aggregates: Dict[AggregateKey, List[float]] = {}
+
+    def move(self, old: str, new: str) -> None:
+        self.status[old] = self.status.get(old, 0) - 1
+        self.status[new] = self.status.get(new, 0) + 1
+
+    def add_run(self, run: Run, sign: int = 1) -> None:
+        # only successful runs are aggregated
+        agg = self.aggregates.setdefault(aggregate_key(run), [0, 0.0, 0])
+        agg[0] += sign
+        agg[1] += sign * (run.amount_total or 0.0)
+        agg[2] += sign * (1 if run.warning_count else 0)
+
+    def apply(self, session: Session) -> None:
+        for status, delta in self.status.items():
+            if delta:
+                _bump_counter(session, status, delta)
+        for key, (runs, amount, warning_runs) in self.aggregates.items():
+            if runs or warning_runs or round(amount, 2):
+                _bump_aggregate(session, key, int(runs), round(amount, 2), int(warning_runs))
+        self.status.clear()
+        self.aggregates.clear()
+
+
+def _set_status(session: Session, run: Run, status: str, deltas: RunDeltas) -> None:
+    if run.status != status:
+        deltas.move(run.status, status)
+        run.status = status
+
+
+def to_date(value: Any) -> Optional[date]:
+    """
+    ISO date (or datetime) prefix -> date; anything else (unparsed raw dates) -> None.
+    """
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value or "").strip()[:10])
+    except ValueError:
+        return None
+
+
+def to_amount(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or value is None or value == "":
+        return None
+    try:
+        return round(float(value), 2)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_currency(value: Any) -> Optional[str]:
+    code = str(value or "").strip().upper()
+    return code[:8] or None
+
+
+def create_run(session: Session, source_filename: Optional[str], status: str = "running") -> Run:
+    return create_runs(session, [source_filename], status=status)[0]
+
+
+def create_runs(session: Session, source_filenames: List[Optional[str]], status: str = "running") -> List[Run]:
+    """
+    Inserts all runs of a batch in one transaction (one commit, no refresh round trips).
+    """
+    runs = [Run(source_filename=name, status=status) for name in source_filenames]
+    if runs:
+        _bump_counter(session, status, len(runs))
+        session.add_all(runs)
+        session.commit()
+    return runs
+
+
+def _stage_ok(
+    session: Session,
+    run: Run,
+    result: Dict[str, Any],
+    trace: Any,
+    deltas: RunDeltas,
+    new_payload: bool = False,
+) -> RunPayload:
+    """
+    Applies a successful result to the run and its payload without committing;
+    counter/aggregate changes are collected in `deltas`.
+    new_payload skips the payload lookup for runs that cannot have one yet.
+    """
+    if run.status == "ok":
+        deltas.add_run(run, -1)  # re-processed: replace its previous contribution
+    _set_status(session, run, "ok", deltas)
+    payload = (None if new_payload else session.get(RunPayload, run.id)) or RunPayload(run_id=run.id)
+    payload.result_json = result or {}
+    # large trace values go to the blob store (TRACE_LEVEL=summary) or are dropped (off)
+    payload.trace_json = trace_for_storage({"trace": trace} if not isinstance(trace, dict) else trace)
+    run.warning_count = warning_count(result)
+
+    # best-effort denormalization
+    fields = result if isinstance(result, dict) else {}
+    run.vendor = fields.get("vendor")
+    run.invoice_date = to_date(fields.get("invoice_date"))
+    run.amount_total = to_amount(fields.get("amount_total"))
+    run.currency = to_currency(fields.get("currency"))
+    logger.debug("run %s persisted: vendor=%s invoice_date=%s amount_total=%s currency=%s",
+                 run.id, run.vendor, run.invoice_date, run.amount_total, run.currency)
+    deltas.add_run(run)
+
+    session.add(run)
+    session.add(payload)
+    return payload
+
+def _stage_error(session: Session, run: Run, msg: str, deltas: RunDeltas) -> None:
+    if run.status == "ok":
+        deltas.add_run(run, -1)
+    _set_status(session, run, "error", deltas)
+    run.error_message = msg
     session.add(run)
+
+def _commit(session: Session, deltas: RunDeltas) -> None:
+    deltas.apply(session)
     session.commit()
-    session.refresh(run)
-    return run
 
 def update_run_ok(
     session: Session,
@@ -21,39 +231,252 @@ def update_run_ok(
     result: Dict[str, Any],
     trace: Any,
 ) -> Run:
-    run.status = "ok"
-    run.result_json = result or {}
-    print(run.result_json)
-    run.trace_json = {"trace": trace} if not isinstance(trace, dict) else trace
-    logger.info("trace persisted : %s", run.trace_json)
-    logger.info("result persisted : %s", run.result_json)
-
-    # best-effort denormalization
-    run.vendor = result.get("vendor") if isinstance(result, dict) else None
-    run.invoice_date = result.get("invoice_date") if isinstance(result, dict) else None
-    run.amount_total = result.get("amount_total") if isinstance(result, dict) else None
-    #login
-    logger.info("vendor persisted : %s", run.vendor)
-    logger.info("invoice_date persisted : %s", run.invoice_date)
-    logger.info("amount_total persisted : %s", run.amount_total)
+    # run, payload, counters and aggregates are written in one transaction
+    deltas = RunDeltas()
+    _stage_ok(session, run, result, trace, deltas)
+    _commit(session, deltas)
+    return run
 
+def update_run_status(session: Session, run: Run, status: str) -> Run:
+    deltas = RunDeltas()
+    if run.status == "ok" and status != "ok":
+        deltas.add_run(run, -1)
+    _set_status(session, run, status, deltas)
     session.add(run)
-    session.commit()
-    session.refresh(run)
+    _commit(session, deltas)
     return run
 
 def update_run_error(session: Session, run: Run, msg: str) -> Run:
-    run.status = "error"
-    run.error_message = msg
-    session.add(run)
-    session.commit()
-    session.refresh(run)
+    deltas = RunDeltas()
+    _stage_error(session, run, msg, deltas)
+    _commit(session, deltas)
     return run
 
-def list_runs(session: Session, limit: int = 50, offset: int = 0) -> List[Run]:
-    stmt = select(Run).order_by(Run.created_at.desc()).offset(offset).limit(limit)
+
+class RunWriteBuffer:
+    """
+    Groups run updates of a batch into few commits: a flush happens once `max_items`
+    updates are pending or `max_delay_s` passed since the first pending one (checked on
+    every add), and always on flush(). Only for runs created by create_runs in the same
+    batch (their payload rows do not exist yet). Not thread-safe: use from one task/loop.
+    """
+
+    def __init__(self, session: Session, max_items: Optional[int] = None, max_delay_s: Optional[float] = None):
+        self.session = session
+        self.max_items = max(1, RUN_COMMIT_BATCH_SIZE if max_items is None else max_items)
+        self.max_delay_s = RUN_COMMIT_INTERVAL_S if max_delay_s is None else max_delay_s
+        self._deltas = RunDeltas()
+        self._pending = 0
+        self._since: Optional[float] = None
+        self.commits = 0
+
+    def ok(self, run: Run, result: Dict[str, Any], trace: Any) -> RunPayload:
+        payload = _stage_ok(self.session, run, result, trace, self._deltas, new_payload=True)
+        self._added()
+        return payload
+
+    def error(self, run: Run, msg: str) -> None:
+        _stage_error(self.session, run, msg, self._deltas)
+        self._added()
+
+    def _added(self) -> None:
+        self._pending += 1
+        if self._since is None:
+            self._since = time.monotonic()
+        if self._pending >= self.max_items or time.monotonic() - self._since >= self.max_delay_s:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        _commit(self.session, self._deltas)
+        self.commits += 1
+        self._pending = 0
+        self._since = None
+
+
+def encode_cursor(run: Run) -> str:
+    raw = f"{run.created_at.isoformat()}|{run.id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Raises ValueError on a malformed cursor.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, run_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), run_id
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+
+def _vendor_prefix_match(column, prefix: str):
+    # LIKE is case-insensitive on SQLite but not on Postgres: compare lower-cased on both
+    return func.lower(column).startswith(prefix.lower(), autoescape=True)
+
+
+def _apply_filters(stmt, filters: Optional[RunFilters]):
+    if filters is None:
+        return stmt
+    if filters.status:
+        stmt = stmt.where(Run.status == filters.status)
+    if filters.vendor_prefix:
+        stmt = stmt.where(_vendor_prefix_match(Run.vendor, filters.vendor_prefix))
+    if filters.date_from:
+        stmt = stmt.where(Run.invoice_date >= filters.date_from)
+    if filters.date_to:
+        stmt = stmt.where(Run.invoice_date <= filters.date_to)
+    if filters.amount_min is not None:
+        stmt = stmt.where(Run.amount_total >= filters.amount_min)
+    if filters.amount_max is not None:
+        stmt = stmt.where(Run.amount_total <= filters.amount_max)
+    return stmt
+
+
+def list_runs(
+    session: Session,
+    limit: int = 50,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    filters: Optional[RunFilters] = None,
+) -> List[Run]:
+    """
+    Newest first. With a cursor (from next_cursor) the page starts right after the
+    cursor row: keyset pagination on (created_at, id), constant cost at any depth.
+    offset is kept for old clients and ignored when a cursor is given.
+    """
+    # index table only: no result/trace JSON is read for list pages
+    stmt = _apply_filters(select(Run), filters)
+    if cursor:
+        created_at, run_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Run.created_at, Run.id) < tuple_(created_at, run_id))
+    elif offset:
+        stmt = stmt.offset(offset)
+    stmt = stmt.order_by(Run.created_at.desc(), Run.id.desc()).limit(limit)
     return list(session.exec(stmt).all())
 
+
+def next_cursor(items: List[Run], limit: int) -> Optional[str]:
+    return encode_cursor(items[-1]) if items and len(items) >= limit else None
+
+
+def count_runs(session: Session, filters: Optional[RunFilters] = None) -> int:
+    """
+    Total for the filters. Unfiltered / status-only totals come from the run counters;
+    other filters run a COUNT cached for RUNS_COUNT_CACHE_S.
+    """
+    filters = filters or RunFilters()
+    if filters.only_status():
+        stmt = select(func.coalesce(func.sum(RunCounter.count), 0))
+        if filters.status:
+            stmt = stmt.where(RunCounter.status == filters.status)
+        return int(session.exec(stmt).one())
+
+    key = (str(session.get_bind().url), *astuple(filters))
+    now = time.monotonic()
+    hit = _count_cache.get(key)
+    if hit and now - hit[0] < RUNS_COUNT_CACHE_S:
+        return hit[1]
+    total = int(session.exec(_apply_filters(select(func.count()).select_from(Run), filters)).one())
+    if len(_count_cache) > 256:
+        _count_cache.clear()
+    _count_cache[key] = (now, total)
+    return total
+
+def iter_runs(session: Session, filters: Optional[RunFilters] = None, chunk_size: int = 500) -> Iterator[Any]:
+    """
+    All runs matching the filters, newest first, as rows of the run columns + result_json.
+    Rows are fetched `chunk_size` at a time (a server-side cursor on Postgres), so memory
+    does not grow with the number of runs.
+    """
+    stmt = (
+        select(*Run.__table__.columns, RunPayload.result_json)
+        .outerjoin(RunPayload, RunPayload.run_id == Run.id)
+    )
+    stmt = _apply_filters(stmt, filters).order_by(Run.created_at.desc(), Run.id.desc())
+    yield from session.exec(stmt.execution_options(yield_per=max(1, chunk_size)))
+
 def get_run(session: Session, run_id: str) -> Optional[Run]:
     stmt = select(Run).where(Run.id == run_id)
     return session.exec(stmt).first()
+
+def get_run_payload(session: Session, run_id: str) -> Optional[RunPayload]:
+    return session.get(RunPayload, run_id)
+
+
+AGGREGATE_GROUPS = ("vendor", "currency", "month")
+
+
+def _aggregate_rows(rows, fields: List[str]) -> List[Dict[str, Any]]:
+    out = []
+    for row in rows:
+        item = {k: getattr(row, k) or None for k in fields}
+        item.update({
+            "runs": int(row.runs),
+            "amount_total": round(float(row.amount or 0), 2),
+            "warning_runs": int(row.warning_runs),
+            "warning_rate": round(row.warning_runs / row.runs, 4) if row.runs else 0.0,
+        })
+        out.append(item)
+    return out
+
+
+def spend_summary(
+    session: Session,
+    group: str,
+    currency: Optional[str] = None,
+    vendor_prefix: Optional[str] = None,
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+    limit: int = 100,
+) -> List[Dict[str, Any]]:
+    """
+    Spend of successful runs per vendor / currency / invoice month, read from RunAggregate
+    (cost grows with the number of groups, not runs). Amounts are never summed across
+    currencies: every row is also keyed by currency. Unknown values come back as None.
+    """
+    if group not in AGGREGATE_GROUPS:
+        raise ValueError(f"unknown group: {group!r}")
+    keys = [getattr(RunAggregate, group)]
+    if group != "currency":
+        keys.append(RunAggregate.currency)
+    amount = func.sum(RunAggregate.amount_total).label("amount")
+    stmt = select(
+        *keys,
+        func.sum(RunAggregate.run_count).label("runs"),
+        amount,
+        func.sum(RunAggregate.warning_runs).label("warning_runs"),
+    )
+    if currency:
+        stmt = stmt.where(RunAggregate.currency == to_currency(currency))
+    if vendor_prefix:
+        stmt = stmt.where(_vendor_prefix_match(RunAggregate.vendor, vendor_prefix))
+    if month_from:
+        stmt = stmt.where(RunAggregate.month >= month_from)
+    if month_to:
+        stmt = stmt.where(RunAggregate.month <= month_to)
+    stmt = stmt.group_by(*keys).having(func.sum(RunAggregate.run_count) > 0)
+    order = keys if group == "month" else [amount.desc(), *keys]
+    return _aggregate_rows(session.exec(stmt.order_by(*order).limit(limit)).all(), [k.key for k in keys])
+
+
+def warning_rates(session: Session, min_runs: int = 1, limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    Share of successful runs with validation warnings, per vendor (all currencies), highest first.
+    """
+    runs = func.sum(RunAggregate.run_count)
+    warned = func.sum(RunAggregate.warning_runs)
+    stmt = (
+        select(RunAggregate.vendor, runs.label("runs"), func.sum(RunAggregate.amount_total).label("amount"),
+               warned.label("warning_runs"))
+        .group_by(RunAggregate.vendor)
+        .having(runs >= max(1, min_runs))
+        .order_by((warned * 1.0 / runs).desc(), runs.desc(), RunAggregate.vendor)
+        .limit(limit)
+    )
+    rows = _aggregate_rows(session.exec(stmt).all(), ["vendor"])
+    for row in rows:
+        row.pop("amount_total")  # mixed currencies
+    return rows
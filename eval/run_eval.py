@@ -7,6 +7,7 @@ from typing import Dict, Any
 
 import sys
 import os
+sys.path.insert(0, "shared")
 sys.path.insert(0, "mcp")
 os.environ.setdefault("LLM_BACKEND", "ollama")
 os.environ.setdefault("OLLAMA_MODEL", "gemma3:1b")
@@ -1,21 +1,50 @@
 from __future__ import annotations
 
+import asyncio
 from abc import ABC, abstractmethod
+from typing import Tuple
 from schemas import AgentContext, InvoiceResult, TraceEvent
+from tracing import slim
 
 
 class Agent(ABC):
     """
     Simple agent interface: agents read context and update the shared result.
+
+    inputs / outputs name what an agent reads and writes: InvoiceResult fields, or
+    "text" (ctx.cleaned_text/raw_text), "classification", "pipeline". The orchestrator
+    derives the execution DAG from them (see dag.py); "*" means everything, so an
+    agent without declarations always runs alone, in pipeline order.
+    result.meta (agents_ran, ...) and the trace are not declared: every agent may write them.
     """
 
     name: str
+    inputs: Tuple[str, ...] = ("*",)
+    outputs: Tuple[str, ...] = ("*",)
 
     def trace(self, ctx: AgentContext, action: str, summary: str = None, status: str = "ok", data=None):
+        if ctx.trace_level == "off":
+            return
+        if ctx.trace_level == "summary":
+            data = slim(data)
         ctx.trace.append(
             TraceEvent(agent=self.name, action=action, status=status, summary=summary, data=data or {})
         )
 
+    def llm_unanswered(self, ctx: AgentContext) -> None:
+        """
+        Marks the invoice as degraded: this agent needed the LLM and got no usable answer.
+        Such results are not cached (see orchestrator._finish), like failed LLM answers.
+        """
+        ctx.scratch["llm_unanswered"] = [*ctx.scratch.get("llm_unanswered", []), self.name]
+
     @abstractmethod
     def run(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
         raise NotImplementedError
+
+    async def arun(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
+        """
+        Async variant used by arun_pipeline. Defaults to run() on a worker thread;
+        agents waiting on the LLM override it to await the async gateway instead.
+        """
+        return await asyncio.to_thread(self.run, ctx, result)
@@ -1,20 +1,25 @@
 # mcp/agents/classifier_agent.py
-import re
 from agent_base import Agent
+from patterns import ScanResult, scan_text
 from schemas import AgentContext, InvoiceResult
 
 class ClassifierAgent(Agent):
     name = "classifier"
+    inputs = ("text",)
+    outputs = ("classification",)
 
     def run(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
         text = ctx.raw_text
+        scan = ctx.scratch.get("scan")
+        if not isinstance(scan, ScanResult):
+            scan = scan_text(ctx.cleaned_text or text)
 
-        is_table_like = bool(re.search(r"\bQty\b|\bUnit price\b|\bSubtotal\b|\bTax\b", text, re.IGNORECASE))
+        is_table_like = any(scan.has(k) for k in ("table_marker", "subtotal_label", "tax_label"))
         has_eur = "€" in text or "EUR" in text
         has_usd = "$" in text or "USD" in text
 
         # naive language guess
-        lang = "fr" if re.search(r"\bFacture\b|\bTVA\b|\bTotal TTC\b", text, re.IGNORECASE) else "en"
+        lang = "fr" if scan.has("fr_marker") else "en"
 
         ctx.meta["classification"] = {
             "lang": lang,
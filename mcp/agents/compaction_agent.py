@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import os
+import re
+from typing import Dict, List, Tuple
+
+from agent_base import Agent
+from patterns import ScanResult, scan_text
+from schemas import AgentContext, InvoiceResult
+from agents.invoice_extraction_agent import _estimate_tokens
+
+# invoice text sent to the LLM is cut down to this (rough) token estimate
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1200"))
+# blocks = paragraphs, split further into windows of at most this many lines
+COMPACTION_BLOCK_LINES = int(os.getenv("COMPACTION_BLOCK_LINES", "6"))
+OMITTED = "[...]"
+
+# what makes a line worth a prompt token: the candidates the scan found on it
+KIND_WEIGHTS: Dict[str, float] = {
+    "total_label": 5.0,
+    "subtotal_label": 4.0,
+    "tax_label": 4.0,
+    "invoice_number": 4.0,
+    "vendor_label": 4.0,
+    "invoice_date_label": 3.0,
+    "due_date_label": 2.0,
+    "date": 2.0,
+    "currency_code": 1.0,
+    "currency_symbol": 1.0,
+    "table_marker": 1.0,
+}
+HEADER_BONUS = 5.0   # first block: vendor name / letterhead
+DIGIT_WEIGHT = 4.0   # x share of digits in the line
+LONG_PROSE_CHARS = 160
+
+DIGIT_RE = re.compile(r"\d")
+
+
+def _blocks(lines: List[str], size: int) -> List[Tuple[int, int]]:
+    """
+    (first line, end line) of each block: non-blank runs, cut every `size` lines.
+    """
+    out: List[Tuple[int, int]] = []
+    start = None
+    for i, line in enumerate(lines + [""]):
+        if line.strip():
+            if start is None:
+                start = i
+            elif i - start >= size:
+                out.append((start, i))
+                start = i
+        elif start is not None:
+            out.append((start, i))
+            start = None
+    return out
+
+
+def line_score(line: str, kinds: List[str]) -> float:
+    score = sum(KIND_WEIGHTS.get(k, 0.0) for k in kinds)
+    stripped = line.strip()
+    if stripped:
+        score += DIGIT_WEIGHT * len(DIGIT_RE.findall(stripped)) / len(stripped)
+    if len(stripped) > LONG_PROSE_CHARS and not kinds:
+        score -= 1.0  # terms & conditions, legal notes
+    return score
+
+
+def compact_text(text: str, scan: ScanResult, budget: int) -> Tuple[str, Dict[str, int]]:
+    """
+    Keeps the highest scoring blocks (per token) that fit `budget`, in document order;
+    gaps are marked with [...]. Text already within budget is returned unchanged.
+    """
+    original = _estimate_tokens(text)
+    stats = {"original_tokens": original, "compacted_tokens": original, "blocks": 0, "kept_blocks": 0}
+    if original <= budget:
+        return text, stats
+
+    lines = text.split("\n")
+    kinds: Dict[int, List[str]] = {}
+    for c in scan.candidates:
+        kinds.setdefault(c.line, []).append(c.kind)
+
+    blocks = _blocks(lines, max(1, COMPACTION_BLOCK_LINES))
+    scored = []
+    for b, (start, end) in enumerate(blocks):
+        score = sum(line_score(lines[i], kinds.get(i, [])) for i in range(start, end))
+        if b == 0:
+            score += HEADER_BONUS
+        cost = _estimate_tokens("\n".join(lines[start:end])) + 1
+        scored.append((score / cost, score, b, cost))
+
+    keep, used = set(), 0
+    for _, score, b, cost in sorted(scored, key=lambda s: (-s[0], s[2])):
+        if score <= 0 or used + cost > budget:
+            continue
+        keep.add(b)
+        used += cost
+
+    if not keep:
+        # nothing fits (one huge block): plain cut at the budget
+        compacted = text[: budget * 4]
+        stats.update(compacted_tokens=_estimate_tokens(compacted), blocks=len(blocks))
+        return compacted, stats
+
+    parts: List[str] = []
+    last_end = 0
+    for b, (start, end) in enumerate(blocks):
+        if b not in keep:
+            continue
+        if start > last_end and any(lines[i].strip() for i in range(last_end, start)):
+            parts.append(OMITTED)
+        parts.append("\n".join(lines[start:end]))
+        last_end = end
+    if any(line.strip() for line in lines[last_end:]):
+        parts.append(OMITTED)
+
+    compacted = "\n".join(parts)
+    stats.update(compacted_tokens=_estimate_tokens(compacted), blocks=len(blocks), kept_blocks=len(keep))
+    return compacted, stats
+
+
+class CompactionAgent(Agent):
+    """
+    Relevance-windowed invoice text for the LLM prompt (ctx.scratch["prompt_text"]),
+    so prompt size stops growing with the document. Regex extraction still reads the full text.
+    """
+    name = "compact"
+    inputs = ("text",)
+    outputs = ("prompt_text",)
+
+    def run(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
+        text = ctx.cleaned_text or ctx.raw_text or ""
+        scan = ctx.scratch.get("scan")
+        if not isinstance(scan, ScanResult):
+            scan = scan_text(text)
+
+        compacted, stats = compact_text(text, scan, PROMPT_TOKEN_BUDGET)
+        ctx.scratch["prompt_text"] = compacted
+        result.meta["prompt_compaction"] = stats
+        result.meta.setdefault("agents_ran", []).append(self.name)
+        self.trace(ctx, "compact prompt text",
+                   summary=f"~{stats['original_tokens']} -> ~{stats['compacted_tokens']} tokens (budget {PROMPT_TOKEN_BUDGET})",
+                   data={**stats, "budget": PROMPT_TOKEN_BUDGET, "chars": [len(text), len(compacted)]})
+        return result
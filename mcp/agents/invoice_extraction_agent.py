@@ -1,86 +1,204 @@
 from __future__ import annotations
 
+import asyncio
+import os
 import re
+import threading
+import time
 from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from agent_base import Agent
+from layout import Layout, layout_view
+from patterns import CURRENCY_SYMBOLS, ScanResult, scan_text
 from schemas import AgentContext, InvoiceResult
-from llm.gateway import generate_json, llm_backend, llm_model
+from agents.validation_agent import totals_rel_err
+from llm.json_stream import field_listener
+from llm.gateway import (
+    agenerate_json, agenerate_json_array, generate_json, generate_json_array, llm_backend, llm_enabled, llm_model,
+)
+
+# bump whenever the extraction prompt or merge rules change: invalidates cached extractions
+PROMPT_VERSION = "4"
+
+
+NON_MONEY_RE = re.compile(r"[^0-9.,]")
+DECIMAL_SPLIT_RE = re.compile(r"^(.*?)[.,](\d{1,2})$")
+SEPARATORS_RE = re.compile(r"[.,]")
+ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+WHITESPACE_RE = re.compile(r"\s+")
+
+AMOUNT_RE = re.compile(r"\d{1,3}(?:[ ,.]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?")
+PERCENT_RE = re.compile(r"\d+(?:[.,]\d+)?\s*%")
+# a line holding nothing but an amount (and maybe a currency): PDF table cell
+BARE_AMOUNT_RE = re.compile(r"^\s*[$€£¥]?\s*[\d][\d ,.]*\s*(?:[A-Z]{3}|[$€£¥])?\s*$")
+LABEL_FIELDS = {"subtotal_label": "subtotal", "tax_label": "amount_tax", "total_label": "amount_total"}
+TITLE_LINE = re.compile(r"^(tax\s+)?(invoice|facture|receipt|reçu|bill|statement)\b|^page\s+\d", re.IGNORECASE)
 
 
 def _try_parse_money(s: str) -> float:
-    s = (s or "").strip()
-    s = s.replace(",", ".")
-    s = re.sub(r"[^0-9.]", "", s)
+    """
+    "1,480.00" / "1.480,00" / "49,90" / "$6.00" -> float. The last separator followed by
+    1-2 digits is the decimal one, other separators are thousands separators.
+    """
+    s = NON_MONEY_RE.sub("", (s or "").strip())
+    m = DECIMAL_SPLIT_RE.match(s)
+    if m:
+        s = SEPARATORS_RE.sub("", m.group(1)) + "." + m.group(2)
+    else:
+        s = SEPARATORS_RE.sub("", s)
     try:
         return float(s) if s else 0.0
     except Exception:
         return 0.0
 
 
-def _regex_fallback(text: str) -> dict:
-    # Very light fallback (better than empty)
-    vendor = ""
-    first_line = (text.splitlines()[0].strip() if text else "")
-    vendor = first_line[:80] if first_line else ""
+def _line_amount(lines: List[str], i: int) -> float:
+    """
+    Amount on a label line, or on the next line when the label stands alone (PDF table cells).
+    """
+    m = AMOUNT_RE.findall(PERCENT_RE.sub("", lines[i]))
+    if m:
+        return _try_parse_money(m[-1])
+    if i + 1 < len(lines) and BARE_AMOUNT_RE.match(lines[i + 1]):
+        return _try_parse_money(AMOUNT_RE.findall(lines[i + 1])[-1])
+    return 0.0
+
+
+def _currency(scan: ScanResult, lines: Optional[Iterable[int]] = None) -> str:
+    """
+    First currency code (on the given lines, or anywhere), else the most specific symbol.
+    """
+    code = scan.first("currency_code", lines=lines)
+    if code:
+        return code.value
+    pool = scan.candidates if lines is None else scan.on_lines(lines)
+    symbols = {c.value for c in pool if c.kind == "currency_symbol"}
+    for sym, iso in CURRENCY_SYMBOLS.items():
+        if sym in symbols:
+            return iso
+    return ""
 
-    total = 0.0
-    m_total = re.search(r"(Amount due|Total)\s*[:\n ]*\$?€?\s*([0-9][0-9\.,]*)", text, re.IGNORECASE)
-    if m_total:
-        total = _try_parse_money(m_total.group(2))
 
-    # Date: tries “July 6, 2025” or “06/07/2025”
-    issue_date = ""
-    m_date = re.search(r"(Date of issue|Date)\s*[:\n ]*([A-Za-z]+\s+\d{1,2},\s+\d{4})", text, re.IGNORECASE)
-    if m_date:
-        issue_date = m_date.group(2).strip()
+def _vendor_like(v: str) -> bool:
+    # not a title, a "label: value" line, an address number or a reference
+    return bool(v) and not (TITLE_LINE.match(v) or ":" in v or v[0].isdigit() or sum(c.isdigit() for c in v) > 3)
 
-    return {
-        "vendor": vendor,
-        "invoice_date": issue_date,
-        "amount_total": total
+
+def _guess_vendor(lines: List[str], scan: ScanResult, layout: Optional[Layout] = None) -> str:
+    label = scan.first("vendor_label", lines=range(15))
+    if label and label.value:
+        return label.value[:80]
+    if layout is not None:
+        letterhead = layout.letterhead(_vendor_like)
+        if letterhead:
+            return letterhead[:80]
+    for line in [ln for ln in lines if ln.strip()][:6]:
+        v = line.strip()
+        if _vendor_like(v):
+            return v[:80]
+    return ""
+
+
+def _regex_fallback(text: str, scan: Optional[ScanResult] = None, layout: Optional[Layout] = None) -> dict:
+    """
+    Deterministic extraction (first tier) over the pattern candidates of the text:
+    labels give the line, amounts are read from that line (or the next one).
+    With the PDF layout, amounts are looked up next to their label (same row or right below)
+    and a letterhead in a larger font is the vendor when no vendor label is found.
+    Fields that are not found stay empty / 0.0.
+    """
+    text = text or ""
+    if scan is None or scan.text != text:
+        scan = scan_text(text)
+    lines = text.split("\n")  # same line numbering as the scan
+    out: Dict[str, Any] = {
+        "vendor": _guess_vendor(lines, scan, layout),
+        "invoice_number": "",
+        "invoice_date": "",
+        "due_date": "",
+        "currency": "",
+        "subtotal": 0.0,
+        "amount_tax": 0.0,
+        "amount_total": 0.0,
     }
 
+    number = scan.first("invoice_number", source="builtin")
+    if number:
+        out["invoice_number"] = number.value
+
+    # a line carries one amount label: "Total Tax" is a tax line (labels come in subtotal, tax, total order)
+    due_lines, amount_lines = set(), set()
+    for c in scan.candidates:
+        if c.source != "builtin":
+            continue
+        window = (c.line, c.line + 1)
+        if c.kind == "due_date_label":
+            due_lines.add(c.line)
+            date = scan.first("date", source="builtin", lines=window)
+            if date and not out["due_date"]:
+                out["due_date"] = date.value
+        elif c.kind == "invoice_date_label" and c.line not in due_lines:
+            date = scan.first("date", source="builtin", lines=window)
+            if date and not out["invoice_date"]:
+                out["invoice_date"] = date.value
+        elif c.kind in ("subtotal_label", "tax_label", "total_label"):
+            if c.line in amount_lines:
+                continue
+            amount_lines.add(c.line)
+            if c.kind == "subtotal_label":
+                out["subtotal"] = out["subtotal"] or _line_amount(lines, c.line)
+            elif c.kind == "tax_label":
+                out["amount_tax"] = out["amount_tax"] or _line_amount(lines, c.line)
+            elif not out["amount_total"]:
+                out["amount_total"] = _line_amount(lines, c.line)
+                out["currency"] = _currency(scan, window)
+
+    if layout is not None:
+        for kind, value in layout.amount_labels().items():
+            amount = _line_amount([value], 0)
+            if amount:
+                out[LABEL_FIELDS[kind]] = amount
+
+    if not out["invoice_date"]:
+        date = scan.first("date", source="builtin")
+        if date:
+            out["invoice_date"] = date.value
+    if not out["currency"]:
+        out["currency"] = _currency(scan)
+
+    out["invoice_date"] = _normalize_date_to_iso(out["invoice_date"])
+    out["due_date"] = _normalize_date_to_iso(out["due_date"])
+    return out
+
 
 def _normalize_date_to_iso(value: str) -> str:
     v = (value or "").strip()
     if not v:
         return ""
     # already ISO?
-    if re.match(r"^\d{4}-\d{2}-\d{2}$", v):
+    if ISO_DATE_RE.match(v):
         return v
     # Try common formats
-    for fmt in ("%B %d, %Y", "%b %d, %Y", "%d/%m/%Y", "%m/%d/%Y"):
+    v = WHITESPACE_RE.sub(" ", v.replace(".", " ").replace(",", ", ")).replace(" ,", ",")
+    for fmt in ("%B %d, %Y", "%b %d, %Y", "%B %d %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y",
+                "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%Y/%m/%d", "%Y %m %d", "%Y-%m-%d", "%d %m %Y"):
         try:
             return datetime.strptime(v, fmt).strftime("%Y-%m-%d")
         except Exception:
             pass
-    return v  # keep raw if cannot parse
+    return value.strip()  # keep raw if cannot parse
 
 
-class InvoiceExtractionAgent(Agent):
-    name = "extract"
+EXTRACTION_KEYS = ("vendor", "invoice_number", "invoice_date", "due_date",
+                   "currency", "subtotal", "amount_tax", "amount_total")
+NUMERIC_KEYS = ("subtotal", "amount_tax", "amount_total")
 
-    def run(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
-        text = ctx.cleaned_text or ctx.raw_text or ""
-        fallback = _regex_fallback(text)
 
-        # LLM prompt
-        prompt = f"""
-You are an expert accounting assistant.
-Extract invoice fields from the text below.
+def fields_schema(keys=EXTRACTION_KEYS) -> str:
+    return ",\n".join(f'  "{k}": {"0.0" if k in NUMERIC_KEYS else chr(34) * 2}' for k in keys)
 
-Return ONLY a valid JSON object with this schema:
-{{
-  "vendor": "",
-  "invoice_number": "",
-  "invoice_date": "",
-  "due_date": "",
-  "currency": "",
-  "subtotal": 0.0,
-  "amount_tax": 0.0,
-  "amount_total": 0.0
-}}
 
+RULES = """
 Rules:
 - Dates should be output as YYYY-MM-DD when possible.
 - If a field is not found, return an empty string or 0.00.
@@ -89,24 +207,327 @@ Rules:
 - Convert amounts to float numbers.
 - Convert currency symbols to currency codes
 - Do not include any extra keys. Do not include explanations.
+""".strip()
+
+# packed prompts are capped by this (rough) token estimate
+BATCH_TOKEN_BUDGET = int(os.getenv("EXTRACTION_BATCH_TOKEN_BUDGET", "3000"))
+# skip the LLM when the deterministic tier already passes validation
+FAST_PATH = os.getenv("EXTRACTION_FAST_PATH", "1") == "1"
+
+TIERS = ("deterministic", "llm_partial", "llm_full")
+_tier_counts: Dict[str, int] = {t: 0 for t in TIERS}
+_tier_lock = threading.Lock()
+
+
+def _record_tier(tier: str) -> None:
+    with _tier_lock:
+        _tier_counts[tier] += 1
+
+
+def tier_hit_rates() -> Dict[str, float]:
+    """
+    Process-wide share of invoices settled by each tier (served by /cache/stats).
+    """
+    with _tier_lock:
+        total = sum(_tier_counts.values())
+        return {t: round(c / total, 4) if total else 0.0 for t, c in _tier_counts.items()}
+
+
+def _to_float(v: Any) -> float:
+    if isinstance(v, str):
+        return _try_parse_money(v)
+    try:
+        return float(v or 0.0)
+    except Exception:
+        return 0.0
+
+
+def plan_extraction(det: dict) -> Tuple[str, List[str]]:
+    """
+    Confidence gate on the deterministic fields -> (tier, fields to ask the LLM for).
+    Passing means vendor, date and total are present and a subtotal was found with
+    subtotal+tax ~= total: a total that nothing cross-checks (the wrong figure picked after
+    a "Total" label) is not trusted on its own.
+    """
+    if not FAST_PATH:
+        return "llm_full", list(EXTRACTION_KEYS)
+
+    rel_err = totals_rel_err(det["subtotal"], det["amount_tax"], det["amount_total"])
+    reconciled = rel_err is not None and rel_err < 0.02
+    if det["vendor"] and det["invoice_date"] and det["amount_total"] > 0 and reconciled:
+        return "deterministic", []
+
+    missing = [k for k in EXTRACTION_KEYS if not det.get(k)]
+    if not reconciled:
+        # the LLM re-reads the amounts it could not cross-check
+        missing += [k for k in NUMERIC_KEYS if k not in missing]
+    if len(missing) == len(EXTRACTION_KEYS):
+        return "llm_full", list(EXTRACTION_KEYS)
+    return "llm_partial", [k for k in EXTRACTION_KEYS if k in missing]
+
+
+def _estimate_tokens(s: str) -> int:
+    # ~4 chars per token is close enough for budgeting
+    return len(s) // 4 + 1
+
+
+def prompt_text(ctx: AgentContext) -> str:
+    # compacted by the CompactionAgent when it ran, else the whole cleaned text
+    return ctx.scratch.get("prompt_text") or ctx.cleaned_text or ctx.raw_text or ""
+
+
+def build_prompt(text: str, keys=EXTRACTION_KEYS) -> str:
+    return f"""
+You are an expert accounting assistant.
+Extract invoice fields from the text below.
+
+Return ONLY a valid JSON object with this schema:
+{{
+{fields_schema(keys)}
+}}
+
+{RULES}
 
 Invoice text:
 {text}
 """.strip()
 
-        data = generate_json(prompt) or {}
 
-        # Merge LLM → result with fallback
-        result.vendor = data.get("vendor") or result.vendor or fallback.get("vendor", "")
-        result.invoice_number = data.get("invoice_number") or result.invoice_number
-        result.invoice_date = _normalize_date_to_iso(data.get("invoice_date") or result.issue_date or fallback.get("invoice_date", ""))
-        result.due_date = _normalize_date_to_iso(data.get("due_date") or result.due_date)
-        result.currency = data.get("currency") or result.currency
+def build_batch_prompt(texts: List[str]) -> str:
+    """
+    Several invoices in one request: the instruction block is paid once.
+    """
+    invoices = "\n\n".join(f"### Invoice id={i}\n{t}" for i, t in enumerate(texts))
+    return f"""
+You are an expert accounting assistant.
+Extract invoice fields from each of the {len(texts)} invoices below.
+
+Return ONLY a valid JSON array with exactly one object per invoice, in the same order, each with this schema:
+{{
+  "id": 0,
+{fields_schema()}
+}}
+
+{RULES}
+- "id" must be the number from the "### Invoice id=" header of that invoice.
+
+{invoices}
+""".strip()
+
+
+def _pack(texts: List[str], budget: int) -> List[List[int]]:
+    """
+    Greedy packing of invoice indexes into groups that fit the token budget.
+    An invoice too large to share a prompt ends up alone (single-invoice call).
+    """
+    overhead = _estimate_tokens(build_batch_prompt([]))
+    groups: List[List[int]] = []
+    current: List[int] = []
+    used = overhead
+    for i, t in enumerate(texts):
+        cost = _estimate_tokens(t) + 8
+        if current and used + cost > budget:
+            groups.append(current)
+            current, used = [], overhead
+        current.append(i)
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
+
+
+CURRENCY_CODE_RE = re.compile(r"^[A-Za-z]{3}$")
+
+
+def _valid_value(key: str, v: Any) -> bool:
+    if v is None or v == "":
+        return True
+    if key in NUMERIC_KEYS:
+        if isinstance(v, bool):
+            return False
+        if isinstance(v, (int, float)):
+            return v >= 0
+        return isinstance(v, str) and bool(AMOUNT_RE.search(v))
+    if not isinstance(v, str):
+        return False
+    if key in ("invoice_date", "due_date"):
+        return bool(ISO_DATE_RE.match(_normalize_date_to_iso(v)))
+    if key == "currency":
+        return bool(CURRENCY_CODE_RE.match(v.strip()))
+    return True
+
+
+def _valid_entry(entry: Any) -> bool:
+    """
+    One object of a packed answer: known keys only, at least one field, values of the
+    schema's types (amounts >= 0, parseable dates, 3-letter currency) and an int id.
+    """
+    if not isinstance(entry, dict):
+        return False
+    fields = set(entry) - {"id"}
+    if not fields or not fields <= set(EXTRACTION_KEYS):
+        return False
+    if "id" in entry and (isinstance(entry["id"], bool) or not isinstance(entry["id"], int)):
+        return False
+    return all(_valid_value(k, entry[k]) for k in fields)
+
+
+def _map_batch_answer(answer: Any, n: int) -> Dict[int, dict]:
+    """
+    Maps a packed answer back to invoice positions; only entries that validate are returned.
+    """
+    if not isinstance(answer, list):
+        return {}
+    mapped: Dict[int, dict] = {}
+    for pos, entry in enumerate(answer):
+        if not _valid_entry(entry):
+            continue
+        idx = entry.get("id", pos if len(answer) == n else None)
+        if not isinstance(idx, int) or not (0 <= idx < n) or idx in mapped:
+            continue
+        mapped[idx] = {k: v for k, v in entry.items() if k != "id"}
+    return mapped
+
+
+class InvoiceExtractionAgent(Agent):
+    name = "extract"
+    # previous field values are kept as last resort, hence read too
+    inputs = ("text", "prompt_text") + EXTRACTION_KEYS
+    outputs = EXTRACTION_KEYS + ("confidence",)
+
+    def run(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
+        text = ctx.cleaned_text or ctx.raw_text or ""
+        det = _regex_fallback(text, ctx.scratch.get("scan"), layout_view(ctx))
+        tier, keys = plan_extraction(det)
+        with self._stream_trace(ctx):
+            data = (generate_json(build_prompt(prompt_text(ctx), keys)) or {}) if keys else {}
+        return self._apply(ctx, result, det, data, tier, keys, mode="single")
+
+    def _stream_trace(self, ctx: AgentContext):
+        """
+        While the LLM answer streams in (OLLAMA_STREAM), every completed field becomes a trace event.
+        """
+        started = time.perf_counter()
+
+        def on_field(key: str, value: Any) -> None:
+            ms = round((time.perf_counter() - started) * 1000)
+            self.trace(ctx, "llm field", summary=f"{key} after {ms} ms", data={"field": key, "value": value, "ms": ms})
+
+        return field_listener(on_field)
+
+    async def arun(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
+        # the regex tier is CPU work (thread), the LLM call only awaits a limiter slot + HTTP
+        text = ctx.cleaned_text or ctx.raw_text or ""
+        det = await asyncio.to_thread(_regex_fallback, text, ctx.scratch.get("scan"), layout_view(ctx))
+        tier, keys = plan_extraction(det)
+        with self._stream_trace(ctx):
+            data = (await agenerate_json(build_prompt(prompt_text(ctx), keys)) or {}) if keys else {}
+        return self._apply(ctx, result, det, data, tier, keys, mode="single")
+
+    def _plan_batch(self, items: List[Tuple[AgentContext, InvoiceResult]]):
+        """
+        Deterministic tier for every invoice of a batch. Settled invoices are applied right
+        away; the others are packed into groups of prompts (BATCH_TOKEN_BUDGET).
+        """
+        texts = [ctx.cleaned_text or ctx.raw_text or "" for ctx, _ in items]
+        dets = [_regex_fallback(t, ctx.scratch.get("scan"), layout_view(ctx)) for t, (ctx, _) in zip(texts, items)]
+        prompts = [prompt_text(ctx) for ctx, _ in items]
+        plans = [plan_extraction(d) for d in dets]
+        out: List[Optional[InvoiceResult]] = [None] * len(items)
+
+        need_llm = []
+        for i, (tier, keys) in enumerate(plans):
+            if keys:
+                need_llm.append(i)
+            else:
+                ctx, res = items[i]
+                out[i] = self._apply(ctx, res, dets[i], {}, tier, keys, mode="single")
+
+        groups = [[need_llm[g] for g in group] for group in _pack([prompts[i] for i in need_llm], BATCH_TOKEN_BUDGET)]
+        return dets, prompts, plans, out, groups
+
+    def _apply_group(self, items, dets, plans, out, group: List[int], answer: Any) -> List[int]:
+        """
+        Applies the valid entries of a packed answer; returns the invoices needing a
+        single-invoice call (missing or malformed entry).
+        """
+        mapped = _map_batch_answer(answer, len(group)) if len(group) > 1 else {}
+        retry = []
+        for pos, i in enumerate(group):
+            ctx, res = items[i]
+            if pos in mapped:
+                tier, keys = plans[i]
+                out[i] = self._apply(ctx, res, dets[i], mapped[pos], tier, keys, mode=f"batched({len(group)})")
+                continue
+            if len(group) > 1:
+                self.trace(ctx, "batched extraction", status="warn",
+                           summary="no valid entry in packed answer: single-invoice fallback")
+            retry.append(i)
+        return retry
+
+    def run_batch(self, items: List[Tuple[AgentContext, InvoiceResult]]) -> List[InvoiceResult]:
+        """
+        Packed extraction for batches: several invoices per LLM request (up to BATCH_TOKEN_BUDGET).
+        Invoices settled by the deterministic tier never reach the LLM.
+        Any invoice whose answer is missing or malformed falls back to a single-invoice call.
+        """
+        if not llm_enabled() or len(items) < 2:
+            return [self.run(ctx, res) for ctx, res in items]
+
+        dets, prompts, plans, out, groups = self._plan_batch(items)
+        for group in groups:
+            answer = generate_json_array(build_batch_prompt([prompts[i] for i in group])) if len(group) > 1 else None
+            for i in self._apply_group(items, dets, plans, out, group, answer):
+                out[i] = self.run(*items[i])
+        return out
+
+    async def arun_batch(self, items: List[Tuple[AgentContext, InvoiceResult]]) -> List[InvoiceResult]:
+        """
+        run_batch for the event loop: the packed requests of all groups are awaited together.
+        """
+        if not llm_enabled() or len(items) < 2:
+            return list(await asyncio.gather(*(self.arun(ctx, res) for ctx, res in items)))
+
+        dets, prompts, plans, out, groups = await asyncio.to_thread(self._plan_batch, items)
+
+        async def run_group(group: List[int]) -> None:
+            answer = await agenerate_json_array(build_batch_prompt([prompts[i] for i in group])) if len(group) > 1 else None
+            retry = self._apply_group(items, dets, plans, out, group, answer)
+            for i, res in zip(retry, await asyncio.gather(*(self.arun(*items[i]) for i in retry))):
+                out[i] = res
+
+        await asyncio.gather(*(run_group(g) for g in groups))
+        return out
+
+    def _apply(
+        self,
+        ctx: AgentContext,
+        result: InvoiceResult,
+        det: dict,
+        data: dict,
+        tier: str,
+        llm_keys: List[str],
+        mode: str,
+    ) -> InvoiceResult:
+        if llm_keys and llm_enabled() and not data:
+            self.llm_unanswered(ctx)
+        # Merge: LLM answers only count for the fields it was asked for,
+        # deterministic values win for everything else; previous values are kept as last resort.
+        merged: Dict[str, Any] = {}
+        for k in EXTRACTION_KEYS:
+            primary = data.get(k) if k in llm_keys else det.get(k)
+            merged[k] = primary or getattr(result, k) or det.get(k)
+
+        result.vendor = merged["vendor"] or ""
+        result.invoice_number = merged["invoice_number"] or ""
+        result.invoice_date = _normalize_date_to_iso(merged["invoice_date"] or "")
+        result.due_date = _normalize_date_to_iso(merged["due_date"] or "")
+        result.currency = merged["currency"] or ""
 
         # numeric
-        result.subtotal = float(data.get("subtotal") or result.subtotal or 0.0)
-        result.amount_tax = float(data.get("amount_tax") or result.amount_tax or 0.0)
-        result.amount_total = float(data.get("amount_total") or result.amount_total or fallback.get("amount_total", 0.0))
+        result.subtotal = _to_float(merged["subtotal"])
+        result.amount_tax = _to_float(merged["amount_tax"])
+        result.amount_total = _to_float(merged["amount_total"])
 
         # initial confidence (very rough; refined by ValidationAgent)
         result.confidence.setdefault("vendor", 0.7 if result.vendor else 0.2)
@@ -114,8 +535,15 @@ Invoice text:
 
         result.meta.setdefault("llm_backend", llm_backend())
         result.meta.setdefault("llm_model", llm_model())
+        result.meta["extraction_mode"] = mode
+        result.meta["extraction_tier"] = tier
+        result.meta["llm_fields"] = llm_keys
+        _record_tier(tier)
         result.meta.setdefault("agents_ran", []).append(self.name)
-        self.trace(ctx, "invoice extraction", summary=f"extract vendor={result.vendor}, amount_total={result.amount_total}",
+        self.trace(ctx, "invoice extraction", summary=f"extract vendor={result.vendor}, amount_total={result.amount_total} (tier={tier})",
                    data={"LLM extraction":data,
-                         "fall back":fallback})
+                         "fall back":det,
+                         "tier": tier,
+                         "llm_fields": llm_keys,
+                         "mode": mode})
         return result
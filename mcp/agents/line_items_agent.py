@@ -1,16 +1,352 @@
 from __future__ import annotations
 
+import asyncio
+import itertools
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
 from agent_base import Agent
+from layout import layout_view
+from llm.gateway import agenerate_json_array, generate_json_array, llm_enabled
+from patterns import ScanResult, scan_text
 from schemas import AgentContext, InvoiceResult
+from agents.invoice_extraction_agent import _line_amount, _to_float, _try_parse_money
+
+# rows whose numbers do not add up are re-read by the LLM, at most this many (one call)
+LINE_ITEMS_LLM_MAX_ROWS = int(os.getenv("LINE_ITEMS_LLM_MAX_ROWS", "30"))
+# qty x unit price must match the amount within this share (plus a cent for rounding)
+LINE_ITEMS_TOLERANCE = float(os.getenv("LINE_ITEMS_TOLERANCE", "0.005"))
+MAX_COLUMNS = 12  # numbers per row taken into account by the column search
+
+HEADER_RE = re.compile(
+    r"\b(?:qty|quantity|unit\s+price|price|description|amount|"
+    r"qté|quantité|prix\s+unitaire|désignation|montant)\b",
+    re.IGNORECASE,
+)
+NUMBER_TOKEN_RE = re.compile(r"^[$€£¥]?\(?-?\d[\d,.']*\)?[$€£¥%]?$")
+UNIT_TOKEN_RE = re.compile(r"^(?:[A-Za-z]{1,4}\.?|[$€£¥]|x|@|=)$")
+DECIMALS_RE = re.compile(r"[.,]\d{1,2}\)?[$€£¥%]?$")
+TOKEN_RE = re.compile(r"\S+")
+END_KINDS = ("subtotal_label", "tax_label", "total_label")
+
+
+@dataclass
+class Row:
+    layout: str                  # "line" (one text line per row) | "cells" (one value per line)
+    description: str = ""
+    values: List[float] = field(default_factory=list)
+    decimals: List[bool] = field(default_factory=list)   # value written with decimals (prices, amounts)
+    lines: List[int] = field(default_factory=list)
+    text: str = ""               # "line" rows: the line, values at `offsets`
+    offsets: List[int] = field(default_factory=list)
+
+    @property
+    def raw(self) -> str:
+        return " | ".join([self.description] + [f"{v:g}" for v in self.values])
+
+
+def _split_numbers(line: str) -> Tuple[str, List[str], List[int]]:
+    """
+    "Widget A 2 10.00 20.00" -> ("Widget A", ["2", "10.00", "20.00"], offsets): trailing
+    number tokens, with units right after a number ("12,000 KG", "20.00 EUR") skipped.
+    """
+    tokens = list(TOKEN_RE.finditer(line))
+    numbers: List[re.Match] = []
+    j = len(tokens)
+    while j > 0:
+        tok = tokens[j - 1].group()
+        if NUMBER_TOKEN_RE.match(tok):
+            numbers.append(tokens[j - 1])
+        elif not (UNIT_TOKEN_RE.match(tok) and j > 1 and NUMBER_TOKEN_RE.match(tokens[j - 2].group())):
+            break
+        j -= 1
+    desc = line[:tokens[j].start()].strip() if j < len(tokens) else line.strip()
+    numbers.reverse()
+    return desc, [m.group() for m in numbers], [m.start() for m in numbers]
+
+
+def _header_end(lines: List[str], start: int) -> int:
+    """
+    Line after the table header starting at `start`: the header words may be spread over
+    several lines (one per cell), up to the first line holding a number.
+    """
+    end = start + 1
+    for i in range(start + 1, len(lines)):
+        if _split_numbers(lines[i])[1]:
+            break
+        if HEADER_RE.search(lines[i]):
+            end = i + 1
+    return end
+
+
+def _is_header(line: str) -> bool:
+    return bool(HEADER_RE.search(line)) and not _split_numbers(line)[1]
+
+
+def table_regions(lines: List[str], scan: ScanResult) -> List[Tuple[int, int]]:
+    """
+    (first, end) line ranges of the item tables: after a header line, up to the
+    subtotal / tax / total block or the next header (tables repeated per page).
+    """
+    ends = sorted(c.line for c in scan.candidates if c.kind in END_KINDS)
+    regions: List[Tuple[int, int]] = []
+    i = 0
+    while i < len(lines):
+        if not _is_header(lines[i]):
+            i += 1
+            continue
+        start = _header_end(lines, i)
+        stop = next((e for e in ends if e >= start), len(lines))
+        end = next((k for k in range(start, stop) if _is_header(lines[k])), stop)
+        if end > start:
+            regions.append((start, end))
+        i = end if end < stop else stop + 1
+    return regions
+
+
+def segment_rows(lines: List[str], start: int, end: int, continuation: bool = False) -> List[Row]:
+    """
+    Text lines of a table -> rows. A line with a description and 2+ trailing numbers is a
+    row by itself; otherwise description lines followed by number-only lines (PDF cells)
+    make one row. Rows without a description or without numbers are dropped.
+    With `continuation` (visual rows of the layout, no cell runs) a description-only line
+    continues the description of the row above it.
+    """
+    rows: List[Row] = []
+    pending = Row("cells")
+
+    def flush() -> None:
+        nonlocal pending
+        if pending.description and pending.values:
+            rows.append(pending)
+        pending = Row("cells")
+
+    for i in range(start, end):
+        line = lines[i].strip()
+        if not line:
+            continue
+        desc, numbers, offsets = _split_numbers(line)
+        parsed = [_try_parse_money(n) * (-1 if n.startswith(("-", "(")) else 1) for n in numbers]
+        decimals = [bool(DECIMALS_RE.search(n)) for n in numbers]
+        if desc and len(numbers) >= 2:
+            flush()
+            rows.append(Row("line", desc, parsed, decimals, [i], line, offsets))
+        elif desc:
+            if continuation and rows and rows[-1].layout == "line" and not pending.description:
+                rows[-1].description = f"{rows[-1].description} {line}"
+                rows[-1].lines.append(i)
+                continue
+            if pending.values:
+                flush()
+            pending.description = f"{pending.description} {line}".strip()
+            pending.lines.append(i)
+        else:
+            pending.values += parsed
+            pending.decimals += decimals
+            pending.lines.append(i)
+    flush()
+    return rows
+
+
+def _matrix(rows: List[Row], align: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Values (NaN padded) and decimals flags as (rows x MAX_COLUMNS) arrays. Single line rows
+    are right aligned (descriptions may end with numbers), cell rows left aligned (the
+    next row's reference numbers may trail).
+    """
+    values = np.full((len(rows), MAX_COLUMNS), np.nan)
+    decimals = np.zeros((len(rows), MAX_COLUMNS), dtype=bool)
+    for r, row in enumerate(rows):
+        vals, decs = row.values, row.decimals
+        if align == "right":
+            vals, decs = vals[-MAX_COLUMNS:], decs[-MAX_COLUMNS:]
+            values[r, MAX_COLUMNS - len(vals):] = vals
+            decimals[r, MAX_COLUMNS - len(decs):] = decs
+        else:
+            vals, decs = vals[:MAX_COLUMNS], decs[:MAX_COLUMNS]
+            values[r, :len(vals)] = vals
+            decimals[r, :len(decs)] = decs
+    return values, decimals
+
+
+def _fits(q: np.ndarray, p: np.ndarray, a: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore"):
+        return (q > 0) & (p > 0) & (a > 0) & (np.abs(q * p - a) <= np.maximum(0.011, LINE_ITEMS_TOLERANCE * a))
+
+
+def assign_columns(values: np.ndarray, decimals: np.ndarray) -> Optional[Tuple[int, int, int]]:
+    """
+    (qty, unit price, amount) column indexes satisfied by the most rows, in one vectorized
+    pass over all column triples; ties go to an integer qty column, then to the leftmost.
+    None when no row fits any triple.
+    """
+    k = values.shape[1]
+    triples = np.array([t for t in itertools.permutations(range(k), 3)])
+    if not len(values) or not len(triples):
+        return None
+    ok = _fits(values[:, triples[:, 0]], values[:, triples[:, 1]], values[:, triples[:, 2]])  # rows x triples
+    hits = ok.sum(axis=0)
+    if hits.max() == 0:
+        return None
+    integer_qty = (ok & ~decimals[:, triples[:, 0]]).sum(axis=0)
+    order = np.lexsort((triples[:, 0], -integer_qty, -hits))
+    return tuple(int(c) for c in triples[order[0]])
+
+
+def _item(row: Row, qty: Optional[float], price: Optional[float], amount: Optional[float],
+          checked: bool, source: str) -> Dict[str, Any]:
+    return {
+        "description": row.description[:200],
+        "quantity": qty,
+        "unit_price": price,
+        "amount": amount,
+        "checked": checked,
+        "source": source,
+    }
+
+
+def parse_rows(rows: List[Row]) -> Tuple[List[Optional[Dict[str, Any]]], List[int]]:
+    """
+    Items for the rows (same order) and the indexes of the rows that failed the
+    qty x unit price = amount check. Failed rows get a best-effort item (last value as amount).
+    """
+    items: List[Optional[Dict[str, Any]]] = [None] * len(rows)
+    failed: List[int] = []
+    for layout, align in (("line", "right"), ("cells", "left")):
+        idx = [i for i, row in enumerate(rows) if row.layout == layout]
+        if not idx:
+            continue
+        values, decimals = _matrix([rows[i] for i in idx], align)
+        cols = assign_columns(values, decimals)
+        if cols is not None:
+            q, p, a = values[:, cols[0]], values[:, cols[1]], values[:, cols[2]]
+            ok = _fits(q, p, a)
+        else:
+            ok = np.zeros(len(idx), dtype=bool)
+        for n, i in enumerate(idx):
+            if ok[n] and align == "right":
+                # numbers left of the used columns belong to the description ("Pack of 12 PC")
+                first = len(rows[i].values) - (MAX_COLUMNS - min(cols))
+                if first > 0:
+                    rows[i].description = rows[i].text[:rows[i].offsets[first]].strip()
+            if ok[n]:
+                items[i] = _item(rows[i], float(q[n]), float(p[n]), float(a[n]), True, "table")
+            else:
+                items[i] = _item(rows[i], None, None, rows[i].values[-1], False, "table")
+                failed.append(i)
+    return items, sorted(failed)
+
+
+def build_rows_prompt(rows: List[Row]) -> str:
+    listing = "\n".join(f"{n}. {row.raw}" for n, row in enumerate(rows))
+    return f"""
+You read invoice line items. Each numbered row below is one item: its description, then
+the numbers of its table cells (quantity, unit price, amount, taxes... in table order).
+Return ONLY a JSON array with one object per row, in the same order:
+[{{"description": "", "quantity": 0.0, "unit_price": 0.0, "amount": 0.0}}]
+Use null for a value that is not there. Do not invent rows.
+
+Rows:
+{listing}
+""".strip()
+
+
+def sum_check(items: List[Dict[str, Any]], subtotal: float) -> Dict[str, Any]:
+    amounts = np.array([it["amount"] if it["amount"] is not None else np.nan for it in items], dtype=float)
+    total = float(np.round(np.nansum(amounts), 2))
+    rel_err = abs(total - subtotal) / subtotal if subtotal > 0 and items else None
+    return {"sum": total, "subtotal": subtotal, "rel_err": rel_err,
+            "matches": None if rel_err is None else bool(rel_err < 0.02)}
 
 
 class LineItemsAgent(Agent):
     """
-    Scaffold for later: keep in pipeline but can be disabled by env/config.
+    Deterministic line items: rows are segmented from the table layout (visual rows of the
+    PDF layout when the request has one, else the text lines) and qty / unit price / amount
+    columns are found for all rows at once (NumPy); only the rows that do not add up are
+    sent to the LLM, in a single call.
     """
     name = "line_items"
+    inputs = ("text",)
+    outputs = ("line_items",)
+
+    def _segment(self, ctx: AgentContext):
+        layout = layout_view(ctx)
+        if layout is not None:
+            # cells of a row are side by side: one text line per visual row
+            text = "\n".join(layout.row_texts())
+        else:
+            text = ctx.cleaned_text or ctx.raw_text or ""
+        scan = ctx.scratch.get("scan")
+        if not isinstance(scan, ScanResult) or scan.text != text:
+            scan = scan_text(text)
+        lines = text.split("\n")
+
+        rows = [
+            row for start, end in table_regions(lines, scan)
+            for row in segment_rows(lines, start, end, continuation=layout is not None)
+        ]
+        items, failed = parse_rows(rows)
+        llm_rows = failed[:LINE_ITEMS_LLM_MAX_ROWS] if llm_enabled() else []
+        return lines, scan, rows, items, failed, llm_rows
 
     def run(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
-        # No-op for Priority 1 (or implement minimal LLM extraction later)
+        lines, scan, rows, items, failed, llm_rows = self._segment(ctx)
+        answer = generate_json_array(build_rows_prompt([rows[i] for i in llm_rows])) if llm_rows else []
+        return self._apply(ctx, result, lines, scan, rows, items, failed, llm_rows, answer)
+
+    async def arun(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
+        # segmentation and the column search are CPU work (thread); the LLM call is awaited
+        lines, scan, rows, items, failed, llm_rows = await asyncio.to_thread(self._segment, ctx)
+        answer = await agenerate_json_array(build_rows_prompt([rows[i] for i in llm_rows])) if llm_rows else []
+        return self._apply(ctx, result, lines, scan, rows, items, failed, llm_rows, answer)
+
+    def _apply(
+        self,
+        ctx: AgentContext,
+        result: InvoiceResult,
+        lines: List[str],
+        scan: ScanResult,
+        rows: List[Row],
+        items: List[Optional[dict]],
+        failed: List[int],
+        llm_rows: List[int],
+        answer: Any,
+    ) -> InvoiceResult:
+        if llm_rows and not answer:
+            self.llm_unanswered(ctx)
+        for n, i in enumerate(llm_rows):
+            entry = answer[n] if isinstance(answer, list) and n < len(answer) else None
+            if not isinstance(entry, dict):
+                continue
+            amount = _to_float(entry.get("amount"))
+            if amount <= 0:
+                continue
+            qty, price = _to_float(entry.get("quantity")), _to_float(entry.get("unit_price"))
+            checked = bool(_fits(np.float64(qty), np.float64(price), np.float64(amount)))
+            items[i] = _item(rows[i], qty or None, price or None, amount, checked, "llm")
+            items[i]["description"] = str(entry.get("description") or rows[i].description)[:200]
+
+        result.line_items = [it for it in items if it is not None]
+
+        subtotal_label = scan.first("subtotal_label", source="builtin")
+        subtotal = _line_amount(lines, subtotal_label.line) if subtotal_label else 0.0
+        check = sum_check(result.line_items, subtotal)
+        check.update(rows=len(rows), failed_rows=len(failed), llm_rows=len(llm_rows),
+                     unchecked=sum(not it["checked"] for it in result.line_items))
+        result.meta["line_items_check"] = check
+
         result.meta.setdefault("agents_ran", []).append(self.name)
+        if not rows:
+            self.trace(ctx, "line items", summary="no item table found", status="skip")
+            return result
+        self.trace(ctx, "line items",
+                   summary=f"{len(rows)} rows, {len(rows) - len(failed)} checked, {len(llm_rows)} sent to LLM, "
+                           f"sum={check['sum']} vs subtotal={subtotal}",
+                   status="ok" if check["matches"] is not False and not check["unchecked"] else "warn",
+                   data={**check, "items": result.line_items})
         return result
@@ -2,21 +2,31 @@ from __future__ import annotations
 
 import re
 from agent_base import Agent
+from patterns import scan_text
 from schemas import AgentContext, InvoiceResult
 
+SPACES_RE = re.compile(r"[ \t]+")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+
 
 class TextPreprocessAgent(Agent):
     name = "preprocess"
+    inputs = ("raw_text",)
+    outputs = ("text",)
 
     def run(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
         text = ctx.raw_text or ""
 
         # Normalize whitespace and separators
         text = text.replace("\r\n", "\n").replace("\r", "\n")
-        text = re.sub(r"[ \t]+", " ", text)
-        text = re.sub(r"\n{3,}", "\n\n", text).strip()
+        text = SPACES_RE.sub(" ", text)
+        text = BLANK_LINES_RE.sub("\n\n", text).strip()
 
         ctx.cleaned_text = text
+        # single pattern scan shared by the deterministic agents downstream
+        scan = scan_text(text)
+        ctx.scratch["scan"] = scan
         result.meta.setdefault("agents_ran", []).append(self.name)
-        self.trace(ctx, "clean text", summary=f"clean raw text", data={"clean text": ctx.cleaned_text,"raw_text": ctx.raw_text})
+        self.trace(ctx, "clean text", summary=f"clean raw text", data={"clean text": ctx.cleaned_text,"raw_text": ctx.raw_text,
+                                                                      "patterns": scan.summary()})
         return result
@@ -4,10 +4,14 @@ from schemas import AgentContext, InvoiceResult
 
 class RouterAgent(Agent):
     name = "router"
+    inputs = ("classification",)
+    outputs = ("pipeline",)
 
     def run(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
         c = ctx.meta.get("classification", {})
-        pipeline = ["vendor", "invoice_extraction", "validation"]
+        # compaction shrinks the text the LLM sees; it is cheap, so it always runs.
+        # vendor normalizes the extracted name, hence after extraction
+        pipeline = ["compaction", "invoice_extraction", "vendor", "validation"]
 
         # enable line items only if table-like
         if c.get("is_table_like"):
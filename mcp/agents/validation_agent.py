@@ -4,8 +4,22 @@ from agent_base import Agent
 from schemas import AgentContext, InvoiceResult
 
 
+def totals_rel_err(subtotal: float, amount_tax: float, amount_total: float):
+    """
+    Relative gap between subtotal+tax and total, or None when the check does not apply.
+    """
+    if amount_total <= 0 or subtotal <= 0 or amount_tax < 0:
+        return None
+    approx = subtotal + amount_tax
+    if approx == 0:
+        return None
+    return abs(approx - amount_total) / max(amount_total, 1e-6)
+
+
 class ValidationAgent(Agent):
     name = "validate"
+    inputs = ("vendor", "invoice_date", "subtotal", "amount_tax", "amount_total", "line_items", "confidence", "warnings")
+    outputs = ("warnings", "confidence")
 
     def run(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
         warnings = result.warnings
@@ -16,20 +30,16 @@ class ValidationAgent(Agent):
             result.confidence["amount_total"] = min(result.confidence.get("amount_total", 0.2), 0.2)
         else:
             # If subtotal+tax approximates total, boost confidence
-            if result.subtotal > 0 and result.amount_tax >= 0:
-                approx = result.subtotal + result.amount_tax
-                if approx == 0:
-                    pass
+            rel_err = totals_rel_err(result.subtotal, result.amount_tax, result.amount_total)
+            if rel_err is not None:
+                if rel_err < 0.02:
+                    result.confidence["amount_total"] = max(result.confidence.get("amount_total", 0.7), 0.9)
+                elif rel_err < 0.1:
+                    warnings.append("TOTAL_MAY_NOT_MATCH_SUBTOTAL_TAX")
+                    result.confidence["amount_total"] = max(result.confidence.get("amount_total", 0.7), 0.7)
                 else:
-                    rel_err = abs(approx - result.amount_total) / max(result.amount_total, 1e-6)
-                    if rel_err < 0.02:
-                        result.confidence["amount_total"] = max(result.confidence.get("amount_total", 0.7), 0.9)
-                    elif rel_err < 0.1:
-                        warnings.append("TOTAL_MAY_NOT_MATCH_SUBTOTAL_TAX")
-                        result.confidence["amount_total"] = max(result.confidence.get("amount_total", 0.7), 0.7)
-                    else:
-                        warnings.append("TOTAL_MISMATCH_SUBTOTAL_TAX")
-                        result.confidence["amount_total"] = min(result.confidence.get("amount_total", 0.7), 0.5)
+                    warnings.append("TOTAL_MISMATCH_SUBTOTAL_TAX")
+                    result.confidence["amount_total"] = min(result.confidence.get("amount_total", 0.7), 0.5)
 
         # vendor sanity
         if not result.vendor:
@@ -42,6 +52,13 @@ class ValidationAgent(Agent):
         if not result.invoice_date:
             warnings.append("MISSING_INVOICE_DATE")
 
+        # line items sanity (LineItemsAgent check)
+        check = result.meta.get("line_items_check") or {}
+        if check.get("unchecked"):
+            warnings.append("LINE_ITEMS_UNCHECKED")
+        if check.get("matches") is False:
+            warnings.append("LINE_ITEMS_MISMATCH_SUBTOTAL")
+
         result.meta.setdefault("agents_ran", []).append(self.name)
         self.trace(ctx, "validation of the result",
                    summary=f"extract vendor={result.vendor}, amount_total={result.amount_total}, tax amount={result.amount_tax}",
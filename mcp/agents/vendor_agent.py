@@ -1,42 +1,103 @@
 from __future__ import annotations
 
+import asyncio
 import re
+import time
+from typing import Optional
 from agent_base import Agent
 from schemas import AgentContext, InvoiceResult
-from llm.gateway import generate_json, llm_enabled,llm_backend
+from llm.gateway import agenerate_json, generate_json, llm_enabled,llm_backend
+from vendor_registry import VendorMatch, vendor_registry
+
+
+def _prompt(vendor: str) -> str:
+    return f"""
+Normalize the vendor name into a canonical company name.
+Return ONLY JSON: {{"vendor_canonical": ""}}
+Input vendor: "{vendor}"
+""".strip()
 
 
 class VendorAgent(Agent):
+    """
+    Canonical vendor name: registry lookup (exact or trigram fuzzy match) first; the LLM
+    only normalizes names the registry has never seen, and its answer is written back.
+    """
     name = "vendor"
+    inputs = ("vendor", "confidence")
+    outputs = ("vendor", "confidence")
 
-    def run(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
-
-        if not result.vendor or result.vendor!="":
-            result.meta.setdefault("agents_ran", []).append(self.name)
-            self.trace(ctx, "vendor normalization", summary=f"vendor={result.vendor}",
-                       data={"confidence": None, "llm_enabled": False,
-                             "llm_backend": None,"vendor empty": True})
-            return result
+    def _skip(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
+        result.meta.setdefault("agents_ran", []).append(self.name)
+        self.trace(ctx, "vendor normalization", summary="vendor empty", status="skip",
+                   data={"confidence": None, "llm_enabled": False,
+                         "llm_backend": None,"vendor empty": True})
+        return result
 
+    def _lookup(self, result: InvoiceResult):
         # quick normalization
         v = result.vendor.strip()
         v = re.sub(r"\s{2,}", " ", v)
 
-        # optional LLM normalization (safe, but can be disabled)
-        if llm_enabled():
-            prompt = f"""
-Normalize the vendor name into a canonical company name.
-Return ONLY JSON: {{"vendor_canonical": ""}}
-Input vendor: "{v}"
-""".strip()
-            data = generate_json(prompt) or {}
-            v2 = (data.get("vendor_canonical") or "").strip()
-            if v2:
-                v = v2
+        started = time.perf_counter()
+        match = vendor_registry().lookup(v)
+        lookup_ms = round((time.perf_counter() - started) * 1000, 3)
+        return v, match, lookup_ms
+
+    def run(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
+
+        if not result.vendor:
+            return self._skip(ctx, result)
+
+        v, match, lookup_ms = self._lookup(result)
+        canonical = ""
+        # optional LLM normalization for unseen names (safe, but can be disabled)
+        if match is None and llm_enabled():
+            data = generate_json(_prompt(v)) or {}
+            canonical = (data.get("vendor_canonical") or "").strip()
+            if canonical:
+                vendor_registry().learn(v, canonical)
+        return self._apply(ctx, result, v, match, lookup_ms, canonical)
+
+    async def arun(self, ctx: AgentContext, result: InvoiceResult) -> InvoiceResult:
+        # the registry lookup is in memory; only the LLM call (unseen names) is awaited
+        if not result.vendor:
+            return self._skip(ctx, result)
+
+        v, match, lookup_ms = self._lookup(result)
+        canonical = ""
+        if match is None and llm_enabled():
+            data = await agenerate_json(_prompt(v)) or {}
+            canonical = (data.get("vendor_canonical") or "").strip()
+            if canonical:
+                await asyncio.to_thread(vendor_registry().learn, v, canonical)
+        return self._apply(ctx, result, v, match, lookup_ms, canonical)
+
+    def _apply(
+        self,
+        ctx: AgentContext,
+        result: InvoiceResult,
+        v: str,
+        match: Optional[VendorMatch],
+        lookup_ms: float,
+        canonical: str,
+    ) -> InvoiceResult:
+        source = "extracted"
+        if match is not None:
+            v = match.vendor
+            source = "registry" if match.exact else "registry_fuzzy"
+        elif canonical:
+            v = canonical
+            source = "llm"
+        elif llm_enabled():
+            self.llm_unanswered(ctx)
 
         result.vendor = v
         result.confidence["vendor"] = max(result.confidence.get("vendor", 0.7), 0.9)
 
         result.meta.setdefault("agents_ran", []).append(self.name)
-        self.trace(ctx, "vendor normalization", summary=f"vendor={result.vendor}", data={"confidence" : result.confidence["vendor"],"llm_enabled":llm_enabled(),"llm_backend":llm_backend()})
+        self.trace(ctx, "vendor normalization", summary=f"vendor={result.vendor} ({source})",
+                   data={"confidence" : result.confidence["vendor"],"llm_enabled":llm_enabled(),"llm_backend":llm_backend(),
+                         "source": source, "lookup_ms": lookup_ms,
+                         "match": None if match is None else {"alias": match.alias, "score": match.score}})
         return result
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+
+class TieredCache:
+    """
+    Small two-tier cache for JSON-serializable values:
+    - memory: LRU bounded by `max_items`
+    - disk (optional): SQLite file bounded by `max_disk_items`, survives restarts
+    Both tiers honour the same TTL. Disk hits are promoted to memory.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_items: int = 1024,
+        ttl_s: float = 7 * 24 * 3600,
+        path: Optional[str] = None,
+        max_disk_items: int = 100_000,
+    ):
+        self.name = name
+        self.max_items = max(1, max_items)
+        self.ttl_s = ttl_s
+        self.max_disk_items = max(1, max_disk_items)
+
+        self._mem: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed_at)")
+            self._db.commit()
+
+    def get(self, key: str) -> Optional[Tuple[Any, str]]:
+        """
+        Returns (value, tier) with tier in {"memory", "disk"}, or None on miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return value, "memory"
+                del self._mem[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if row[1] > now:
+                        value = json.loads(row[0])
+                        self._db.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._mem_put(key, row[1], value)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value, "disk"
+                    self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        expires_at = now + self.ttl_s
+        with self._lock:
+            self._mem_put(key, expires_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), expires_at, now),
+                )
+                self._disk_evict()
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "size": len(self._mem),
+                "max_items": self.max_items,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "persistent": self._db is not None,
+            }
+
+    def _mem_put(self, key: str, expires_at: float, value: Any) -> None:
+        self._mem[key] = (expires_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_evict(self) -> None:
+        (count,) = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()
+        overflow = count - self.max_disk_items
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += overflow
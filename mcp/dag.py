@@ -0,0 +1,101 @@
+# mcp/dag.py
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from agent_base import Agent
+from schemas import AgentContext, InvoiceResult
+
+# threads running independent agents (and invoices) at the same time; 1 = strictly sequential
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "4"))
+
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _overlap(a: Sequence[str], b: Sequence[str]) -> bool:
+    return "*" in a or "*" in b or bool(set(a) & set(b))
+
+
+def depends_on(later: Agent, earlier: Agent) -> bool:
+    """
+    `later` must wait for `earlier` (pipeline order) when it reads what earlier writes,
+    writes what earlier reads, or both write the same thing.
+    """
+    return (
+        _overlap(earlier.outputs, later.inputs)
+        or _overlap(earlier.inputs, later.outputs)
+        or _overlap(earlier.outputs, later.outputs)
+    )
+
+
+def plan_levels(pipeline: List[str], agents: Dict[str, Agent]) -> List[List[str]]:
+    """
+    Routed pipeline -> levels of the dependency DAG. Agents of one level are independent
+    of each other; within a level the pipeline order is kept (it is the merge order).
+    """
+    depth: Dict[int, int] = {}
+    for i, key in enumerate(pipeline):
+        deps = [depth[j] for j in range(i) if depends_on(agents[key], agents[pipeline[j]])]
+        depth[i] = 1 + max(deps) if deps else 0
+    levels: List[List[str]] = [[] for _ in range(1 + max(depth.values(), default=-1))]
+    for i, key in enumerate(pipeline):
+        levels[depth[i]].append(key)
+    return levels
+
+
+def fork(ctx: AgentContext, res: InvoiceResult) -> Tuple[AgentContext, InvoiceResult]:
+    """
+    Private copies for one agent of a parallel level: own trace, meta/scratch dicts and result.
+    """
+    ctx_copy = ctx.model_copy(update={"trace": [], "meta": dict(ctx.meta), "scratch": dict(ctx.scratch)})
+    return ctx_copy, res.model_copy(deep=True)
+
+
+def join(
+    ctx: AgentContext,
+    res: InvoiceResult,
+    branches: List[Tuple[Agent, AgentContext, InvoiceResult]],
+) -> InvoiceResult:
+    """
+    Merges the branches of a level back, in pipeline order: declared outputs, new
+    result.meta entries, context meta/scratch changes and trace events.
+    """
+    base_meta = res.meta
+    ran = list(base_meta.get("agents_ran", []))
+    meta = dict(base_meta)
+    for agent, b_ctx, b_res in branches:
+        for field in agent.outputs:
+            if field in InvoiceResult.model_fields:
+                setattr(res, field, getattr(b_res, field))
+        for k, v in b_res.meta.items():
+            if k == "agents_ran":
+                ran += v[len(base_meta.get("agents_ran", [])):]
+            elif base_meta.get(k) != v:
+                meta[k] = v
+        for attr in ("meta", "scratch"):
+            own, theirs = getattr(ctx, attr), getattr(b_ctx, attr)
+            own.update({k: v for k, v in theirs.items() if own.get(k) is not v})
+        ctx.trace.extend(b_ctx.trace)
+    if ran:
+        meta["agents_ran"] = ran
+    res.meta = meta
+    return res
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=max(1, AGENT_WORKERS), thread_name_prefix="agent")
+    return _pool
+
+
+def run_jobs(jobs: List[Callable[[], Any]]) -> List[Any]:
+    """
+    Runs independent jobs concurrently (AGENT_WORKERS threads); results in job order.
+    """
+    if len(jobs) < 2 or AGENT_WORKERS <= 1:
+        return [job() for job in jobs]
+    futures = [_executor().submit(job) for job in jobs]
+    return [f.result() for f in futures]
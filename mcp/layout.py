@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import re
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from patterns import BUILTIN_PATTERNS
+from schemas import AgentContext, DocumentLayout
+
+# lines taller than this many times the median line are watermarks / stamps, not content
+OVERSIZE_FACTOR = 3.0
+# top share of the first page holding the letterhead
+HEADER_BAND = 0.25
+AMOUNT_KINDS = ("subtotal_label", "tax_label", "total_label")
+DIGIT_RE = re.compile(r"\d")
+PERCENT_RE = re.compile(r"\d+(?:[.,]\d+)?\s*%")
+
+_LABELS = {
+    spec.kind: re.compile(spec.pattern, (re.IGNORECASE if spec.ignore_case else 0) | re.MULTILINE)
+    for spec in BUILTIN_PATTERNS if spec.kind in AMOUNT_KINDS
+}
+
+
+class Layout:
+    """
+    NumPy view of a DocumentLayout for geometric lookups: visual rows, the value right
+    of / below a label, the letterhead. Line indexes are the DocumentLayout entries, their
+    text comes from the request text.
+    """
+
+    def __init__(self, doc: DocumentLayout, text: str):
+        self.text = doc.line_texts(text)
+        self.pages = doc.pages
+        self.page = np.asarray(doc.page, dtype=int)
+        self.x0 = np.asarray(doc.x0, dtype=float)
+        self.y0 = np.asarray(doc.y0, dtype=float)
+        self.x1 = np.asarray(doc.x1, dtype=float)
+        self.y1 = np.asarray(doc.y1, dtype=float)
+        self.size = np.asarray(doc.size, dtype=float)
+        self.height = np.maximum(self.y1 - self.y0, 1e-6)
+        self.yc = (self.y0 + self.y1) / 2
+        median = float(np.median(self.height)) if len(self.text) else 0.0
+        self.normal = self.height <= OVERSIZE_FACTOR * max(median, 1e-6)
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def rows(self) -> List[List[int]]:
+        """
+        Visual rows in reading order (page, top to bottom), each left to right: lines whose
+        vertical center is within half a line height of the row's first line.
+        Oversized lines (watermarks) are left out.
+        """
+        idx = np.flatnonzero(self.normal)
+        order = idx[np.lexsort((self.x0[idx], self.yc[idx], self.page[idx]))]
+        rows: List[List[int]] = []
+        current: List[int] = []
+        for i in order.tolist():
+            first = current[0] if current else -1
+            if current and self.page[i] == self.page[first] and abs(self.yc[i] - self.yc[first]) <= self.height[first] / 2:
+                current.append(i)
+                continue
+            if current:
+                rows.append(sorted(current, key=lambda k: self.x0[k]))
+            current = [i]
+        if current:
+            rows.append(sorted(current, key=lambda k: self.x0[k]))
+        return rows
+
+    def row_texts(self) -> List[str]:
+        return [" ".join(self.text[i].strip() for i in row) for row in self.rows()]
+
+    def right_of(self, i: int) -> Optional[int]:
+        """
+        Nearest line to the right of line i on the same visual row.
+        """
+        mask = (
+            self.normal & (self.page == self.page[i])
+            & (np.abs(self.yc - self.yc[i]) <= self.height[i] / 2)
+            & (self.x0 >= self.x1[i] - 1)
+        )
+        mask[i] = False
+        hits = np.flatnonzero(mask)
+        return int(hits[np.argmin(self.x0[hits])]) if len(hits) else None
+
+    def below(self, i: int) -> Optional[int]:
+        """
+        Nearest line right under line i (overlapping it horizontally, within two line heights).
+        """
+        mask = (
+            self.normal & (self.page == self.page[i])
+            & (self.y0 >= self.y1[i] - 1) & (self.y0 - self.y1[i] <= 2 * self.height[i])
+            & (self.x0 < self.x1[i]) & (self.x1 > self.x0[i])
+        )
+        mask[i] = False
+        hits = np.flatnonzero(mask)
+        return int(hits[np.argmin(self.y0[hits])]) if len(hits) else None
+
+    def value_text(self, i: int) -> str:
+        """
+        Text holding the value of label line i: the line itself when it carries a number
+        after the label, else the cell to its right, else the one below. "" when none has digits.
+        """
+        if DIGIT_RE.search(PERCENT_RE.sub("", self.text[i])):
+            return self.text[i]
+        for j in (self.right_of(i), self.below(i)):
+            if j is not None and DIGIT_RE.search(self.text[j]):
+                return self.text[j]
+        return ""
+
+    def amount_labels(self) -> Dict[str, str]:
+        """
+        kind -> value text for the subtotal / tax / total labels, read from the geometry
+        instead of the text order. One label per line (subtotal, tax, total order, as in the
+        regex tier); the lowest label with a value wins (headers repeat "Total" as a column name).
+        """
+        found: Dict[str, str] = {}
+        order = np.lexsort((self.yc, self.page))
+        for i in order[::-1].tolist():
+            line = self.text[i].strip()
+            kind = next((k for k in AMOUNT_KINDS if _LABELS[k].search(line)), None)
+            if kind is None or kind in found:
+                continue
+            value = self.value_text(i)
+            if value:
+                found[kind] = value
+        return found
+
+    def letterhead(self, accept: Callable[[str], bool]) -> str:
+        """
+        Largest text in the top band of the first page, when it stands out from the body text
+        (vendor name in a letterhead). `accept` filters out titles and labels.
+        """
+        if not len(self) or not self.pages:
+            return ""
+        first = self.normal & (self.page == 0)
+        band = first & (self.yc <= HEADER_BAND * self.pages[0][1])
+        if not band.any():
+            return ""
+        body = float(np.median(self.size[first]))
+        for i in np.flatnonzero(band)[np.lexsort((self.yc[band], -self.size[band]))].tolist():
+            if self.size[i] <= body:
+                break
+            if accept(self.text[i].strip()):
+                return self.text[i].strip()
+        return ""
+
+
+def layout_view(ctx: AgentContext) -> Optional[Layout]:
+    """
+    Layout of the request (None without one), built once per invoice and shared by the agents.
+    """
+    if ctx.layout is None or not ctx.layout.line:
+        return None
+    view = ctx.scratch.get("layout_view")
+    if not isinstance(view, Layout):
+        view = Layout(ctx.layout, ctx.raw_text)
+        ctx.scratch["layout_view"] = view
+    return view
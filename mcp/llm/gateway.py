@@ -1,7 +1,21 @@
 from __future__ import annotations
 
+import copy
+import hashlib
 import os
-from llm.ollama import ollama_generate
+from typing import Any, Optional
+
+from cache import TieredCache
+from llm.limiter import ConcurrencyLimiter
+from llm.ollama import aollama_generate, ollama_generate
+
+_UNSET = object()
+_response_cache = _UNSET
+
+# LLM requests in flight per MCP process (sync and async callers together); extra
+# requests queue here, so many invoices can be in flight while the LLM sets the pace
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+llm_limiter = ConcurrencyLimiter(LLM_MAX_CONCURRENCY)
 
 
 def llm_enabled() -> bool:
@@ -21,15 +35,119 @@ def llm_model() -> str:
     return ""
 
 
-def generate_json(prompt: str) -> dict:
+def response_cache() -> Optional[TieredCache]:
     """
-    Single entrypoint used by agents.
+    Prompt-level response cache (None when LLM_CACHE=0). Replace it with set_response_cache().
     """
-    backend = llm_backend()
-    if backend == "none":
-        return {}
+    global _response_cache
+    if _response_cache is _UNSET:
+        if os.getenv("LLM_CACHE", "1") == "0":
+            _response_cache = None
+        else:
+            _response_cache = TieredCache(
+                "llm",
+                max_items=int(os.getenv("LLM_CACHE_SIZE", "4096")),
+                ttl_s=float(os.getenv("LLM_CACHE_TTL_S", str(30 * 24 * 3600))),
+                path=os.getenv("LLM_CACHE_PATH", "./data/llm_cache.db") or None,
+            )
+    return _response_cache
+
+
+def set_response_cache(cache: Optional[TieredCache]) -> None:
+    """
+    Plug another cache (anything with get/set/stats like TieredCache), or None to disable.
+    """
+    global _response_cache
+    _response_cache = cache
+
+
+def _cache_key(backend: str, model: str, prompt: str) -> str:
+    return f"{backend}:{model}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}"
+
+
+def _generate(backend: str, prompt: str, expect: str) -> Any:
     if backend == "ollama":
-        return ollama_generate(prompt)
+        with llm_limiter:
+            return ollama_generate(prompt, expect=expect)
 
     # Stubs for later providers
     raise ValueError(f"Unsupported LLM_BACKEND={backend}. Use 'ollama' or 'none' for now.")
+
+
+async def _agenerate(backend: str, prompt: str, expect: str) -> Any:
+    if backend == "ollama":
+        async with llm_limiter:
+            return await aollama_generate(prompt, expect=expect)
+
+    raise ValueError(f"Unsupported LLM_BACKEND={backend}. Use 'ollama' or 'none' for now.")
+
+
+def _cache_lookup(prompt: str) -> tuple[Optional[TieredCache], str, Any]:
+    backend = llm_backend()
+    cache = response_cache()
+    key = _cache_key(backend, llm_model(), prompt)
+    hit = cache.get(key) if cache is not None else None
+    return cache, key, copy.deepcopy(hit[0]) if hit else None
+
+
+def _cache_store(cache: Optional[TieredCache], key: str, data: Any) -> None:
+    # empty = unparseable answer: do not pin a failure in the cache
+    if cache is not None and data:
+        cache.set(key, data)
+
+
+def _cached_generate(prompt: str, expect: str) -> Any:
+    """
+    Identical prompts (same backend + model) are answered from the response cache.
+    """
+    cache, key, hit = _cache_lookup(prompt)
+    if hit:
+        return hit
+    data = _generate(llm_backend(), prompt, expect)
+    _cache_store(cache, key, data)
+    return data
+
+
+async def _acached_generate(prompt: str, expect: str) -> Any:
+    cache, key, hit = _cache_lookup(prompt)
+    if hit:
+        return hit
+    data = await _agenerate(llm_backend(), prompt, expect)
+    _cache_store(cache, key, data)
+    return data
+
+
+def generate_json(prompt: str) -> dict:
+    """
+    Single entrypoint used by agents.
+    """
+    if llm_backend() == "none":
+        return {}
+    return _cached_generate(prompt, "object")
+
+
+def generate_json_array(prompt: str) -> list:
+    """
+    Same as generate_json for prompts that answer with a JSON array (packed batch prompts).
+    """
+    if llm_backend() == "none":
+        return []
+    return _cached_generate(prompt, "array")
+
+
+async def agenerate_json(prompt: str) -> dict:
+    """
+    generate_json for async agents (Agent.arun).
+    """
+    if llm_backend() == "none":
+        return {}
+    return await _acached_generate(prompt, "object")
+
+
+async def agenerate_json_array(prompt: str) -> list:
+    """
+    generate_json_array for async agents.
+    """
+    if llm_backend() == "none":
+        return []
+    return await _acached_generate(prompt, "array")
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, List, Optional
+
+FieldCallback = Callable[[str, Any], None]
+
+# receives the top-level fields of a streamed answer as they complete (see field_listener)
+_on_field: ContextVar[Optional[FieldCallback]] = ContextVar("llm_on_field", default=None)
+
+
+@contextmanager
+def field_listener(callback: FieldCallback) -> Iterator[None]:
+    """
+    Calls callback(key, value) for each answer field while it streams in, for the LLM
+    calls made inside the block (same thread/task; follows asyncio.to_thread).
+    """
+    token = _on_field.set(callback)
+    try:
+        yield
+    finally:
+        _on_field.reset(token)
+
+
+def current_field_listener() -> Optional[FieldCallback]:
+    return _on_field.get()
+
+
+class JsonStreamScanner:
+    """
+    Incremental scanner for a model answer arriving token by token.
+
+    feed() returns the first complete top-level JSON object (expect="object") or array
+    (expect="array") as soon as its closing bracket arrives, so the caller can stop the
+    generation there; text before it (and invalid candidates) is skipped. Every member
+    of the top-level value ("key": value pairs, or array elements under their index)
+    is passed to `on_field` as soon as it is complete.
+    """
+
+    def __init__(self, expect: str = "object", on_field: Optional[FieldCallback] = None):
+        self.open_c, self.close_c = ("{", "}") if expect == "object" else ("[", "]")
+        self.kind = dict if expect == "object" else list
+        self.on_field = on_field
+        self.text = ""
+        self.value: Any = None
+        self._pos = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self._start = -1       # index of the opening bracket of the current candidate
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = -1
+        self._members: List[Any] = []
+
+    @property
+    def done(self) -> bool:
+        return self.value is not None
+
+    def feed(self, chunk: str) -> Any:
+        if self.done:
+            return self.value
+        self.text += chunk
+        while self._pos < len(self.text) and not self.done:
+            self._step(self.text[self._pos])
+            self._pos += 1
+        return self.value
+
+    def _step(self, c: str) -> None:
+        if self._start < 0:
+            if c == self.open_c:
+                self._start, self._depth, self._member_start = self._pos, 1, self._pos + 1
+            return
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif c == "\\":
+                self._escape = True
+            elif c == '"':
+                self._in_string = False
+            return
+        if c == '"':
+            self._in_string = True
+        elif c in "{[":
+            self._depth += 1
+        elif c in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                self._member_done()
+                self._close()
+        elif c == "," and self._depth == 1:
+            self._member_done()
+            self._member_start = self._pos + 1
+
+    def _member_done(self) -> None:
+        raw = self.text[self._member_start:self._pos].strip()
+        if not raw or self.on_field is None:
+            return
+        try:
+            if self.kind is dict:
+                member = json.loads("{" + raw + "}")
+                for key, value in member.items():
+                    self.on_field(key, value)
+            else:
+                self.on_field(str(len(self._members)), json.loads(raw))
+                self._members.append(None)
+        except ValueError:
+            pass  # not valid (yet): the whole candidate is checked on close
+
+    def _close(self) -> None:
+        start, end = self._start, self._pos + 1
+        try:
+            value = json.loads(self.text[start:end])
+        except ValueError:
+            value = None
+        if isinstance(value, self.kind):
+            self.value = value
+            return
+        # not a valid candidate: look for the next opening bracket after it
+        self._reset()
+        self._pos = start
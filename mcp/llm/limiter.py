@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import deque
+from typing import Deque, Union
+
+
+class ConcurrencyLimiter:
+    """
+    Semaphore shared by threads (`with limiter:`) and event loops (`async with limiter:`),
+    so sync and async callers together never exceed `limit`. Slots are handed over in
+    FIFO order; async waiters only hold a future, not a thread.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._lock = threading.Lock()
+        self._free = self.limit
+        self._waiters: Deque[Union[threading.Event, asyncio.Future]] = deque()
+        self.waiting_max = 0
+
+    def in_use(self) -> int:
+        with self._lock:
+            return self.limit - self._free
+
+    def _take(self, waiter=None) -> bool:
+        # caller holds the lock
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return True
+        if waiter is not None:
+            self._waiters.append(waiter)
+            self.waiting_max = max(self.waiting_max, len(self._waiters))
+        return False
+
+    def acquire(self) -> None:
+        event = threading.Event()
+        with self._lock:
+            if self._take(event):
+                return
+        event.wait()  # the slot is handed over by release()
+
+    async def aacquire(self) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        with self._lock:
+            if self._take(fut):
+                return
+        try:
+            await fut
+        except asyncio.CancelledError:
+            with self._lock:
+                if fut in self._waiters:
+                    self._waiters.remove(fut)
+                    raise
+            if fut.done() and not fut.cancelled():
+                self.release()  # handed over just before the cancellation
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                if not waiter.done():
+                    waiter.get_loop().call_soon_threadsafe(self._wake, waiter)
+                    return
+            self._free += 1
+
+    def _wake(self, fut: asyncio.Future) -> None:
+        if fut.cancelled():
+            self.release()  # its waiter is gone: pass the slot on
+        else:
+            fut.set_result(None)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    async def __aenter__(self):
+        await self.aacquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
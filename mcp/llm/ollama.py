@@ -2,33 +2,104 @@ from __future__ import annotations
 
 import json
 import os
-import requests
+from typing import Any
 
+from http_client import apost, astream_post, async_http_client, http_session, sync_timeout
+from llm.json_stream import JsonStreamScanner, current_field_listener
 
-def ollama_generate(prompt: str) -> dict:
+# stream mode: read the answer token by token and hang up as soon as the JSON value
+# is complete (small models tend to keep talking after it)
+OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "1") != "0"
+
+
+def parse_json_answer(text: str, expect: str = "object") -> Any:
     """
-    Calls Ollama HTTP API (generate) and returns parsed JSON when possible.
+    Parses a model answer as a JSON object (expect="object") or array (expect="array").
+    Returns {} / [] when nothing usable is found.
     """
+    empty, open_c, close_c, kind = ({}, "{", "}", dict) if expect == "object" else ([], "[", "]", list)
+    # Try parse JSON directly
+    try:
+        data = json.loads(text)
+        if isinstance(data, kind):
+            return data
+    except Exception:
+        pass
+    # Try to salvage JSON block
+    start = text.find(open_c)
+    end = text.rfind(close_c)
+    if start != -1 and end != -1 and end > start:
+        try:
+            data = json.loads(text[start : end + 1])
+            return data if isinstance(data, kind) else empty
+        except Exception:
+            return empty
+    return empty
+
+
+def _request(prompt: str, stream: bool = False) -> tuple[str, dict]:
     base_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
     model = os.getenv("OLLAMA_MODEL", "llama3.2:latest")
+    return f"{base_url.rstrip('/')}/api/generate", {"model": model, "prompt": prompt, "stream": stream}
+
 
-    url = f"{base_url.rstrip('/')}/api/generate"
-    payload = {"model": model, "prompt": prompt, "stream": False}
+def _stream_chunk(line: str) -> tuple[str, bool]:
+    # one NDJSON line of /api/generate: {"response": "<tokens>", "done": false, ...}
+    if not line.strip():
+        return "", False
+    msg = json.loads(line)
+    if msg.get("error"):
+        raise RuntimeError(f"Ollama error: {msg['error']}")
+    return msg.get("response", "") or "", bool(msg.get("done"))
 
-    r = requests.post(url, json=payload, timeout=120)
+
+def ollama_generate(prompt: str, expect: str = "object") -> Any:
+    """
+    Calls Ollama HTTP API (generate) and returns parsed JSON when possible.
+    """
+    if OLLAMA_STREAM:
+        return _ollama_stream(prompt, expect)
+    url, payload = _request(prompt)
+    r = http_session().post(url, json=payload, timeout=sync_timeout())
     r.raise_for_status()
 
     text = r.json().get("response", "") or ""
-    # Try parse JSON directly
-    try:
-        return json.loads(text)
-    except Exception:
-        # Try to salvage JSON block
-        start = text.find("{")
-        end = text.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            try:
-                return json.loads(text[start : end + 1])
-            except Exception:
-                return {}
-        return {}
+    return parse_json_answer(text, expect)
+
+
+def _ollama_stream(prompt: str, expect: str) -> Any:
+    url, payload = _request(prompt, stream=True)
+    scanner = JsonStreamScanner(expect, current_field_listener())
+    with http_session().post(url, json=payload, timeout=sync_timeout(), stream=True) as r:
+        r.raise_for_status()
+        for line in r.iter_lines(decode_unicode=True):
+            chunk, done = _stream_chunk(line)
+            if scanner.feed(chunk) is not None or done:
+                break  # closing the response stops the generation
+    return scanner.value if scanner.done else parse_json_answer(scanner.text, expect)
+
+
+async def aollama_generate(prompt: str, expect: str = "object") -> Any:
+    """
+    ollama_generate for the event loop: waits on the shared async client, no thread held.
+    """
+    if OLLAMA_STREAM:
+        return await _aollama_stream(prompt, expect)
+    url, payload = _request(prompt)
+    r = await apost(async_http_client(), url, json=payload)
+    r.raise_for_status()
+
+    text = r.json().get("response", "") or ""
+    return parse_json_answer(text, expect)
+
+
+async def _aollama_stream(prompt: str, expect: str) -> Any:
+    url, payload = _request(prompt, stream=True)
+    scanner = JsonStreamScanner(expect, current_field_listener())
+    async with astream_post(async_http_client(), url, json=payload) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            chunk, done = _stream_chunk(line)
+            if scanner.feed(chunk) is not None or done:
+                break
+    return scanner.value if scanner.done else parse_json_answer(scanner.text, expect)
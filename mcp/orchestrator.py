@@ -1,12 +1,24 @@
 # mcp/orchestrator.py
-from schemas import AgentContext, InvoiceResult
+import asyncio
+import copy
+import hashlib
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cache import TieredCache
+from dag import fork, join, plan_levels, run_jobs
+from schemas import AgentContext, DocumentLayout, InvoiceResult, TraceEvent
+from llm.gateway import llm_backend, llm_model
+from tracing import trace_level as effective_trace_level
 
 from agents.classifier_agent import ClassifierAgent
 from agents.router_agent import RouterAgent
 
 from agents.vendor_agent import VendorAgent
 from agents.preprocess_agent import TextPreprocessAgent
-from agents.invoice_extraction_agent import InvoiceExtractionAgent
+from agents.compaction_agent import CompactionAgent
+from agents.invoice_extraction_agent import InvoiceExtractionAgent, PROMPT_VERSION
 from agents.validation_agent import ValidationAgent
 from agents.line_items_agent import LineItemsAgent
 
@@ -15,28 +27,310 @@ AGENTS = {
     "classifier": ClassifierAgent(),
     "router": RouterAgent(),
     "vendor": VendorAgent(),
+    "compaction": CompactionAgent(),
     "invoice_extraction": InvoiceExtractionAgent(),
     "line_items": LineItemsAgent(),
     "validation": ValidationAgent(),
 }
 
-def run_pipeline(text: str, include_trace: bool = True) -> InvoiceResult:
-    ctx = AgentContext(raw_text=text)
-    res = InvoiceResult()
+_cache: Optional[TieredCache] = None
+
+
+def extraction_cache() -> Optional[TieredCache]:
+    """
+    Content-addressed cache of final InvoiceResults (None when EXTRACTION_CACHE=0).
+    """
+    global _cache
+    if os.getenv("EXTRACTION_CACHE", "1") == "0":
+        return None
+    if _cache is None:
+        _cache = TieredCache(
+            "extraction",
+            max_items=int(os.getenv("EXTRACTION_CACHE_SIZE", "1024")),
+            ttl_s=float(os.getenv("EXTRACTION_CACHE_TTL_S", str(7 * 24 * 3600))),
+            path=os.getenv("EXTRACTION_CACHE_PATH", "./data/extraction_cache.db") or None,
+        )
+    return _cache
+
+
+def _cache_version() -> str:
+    # a cached result is only valid for the model + prompt that produced it
+    return f"{llm_backend()}:{llm_model()}:p{PROMPT_VERSION}"
+
+
+def _cache_hit(ctx: AgentContext, value: dict, tier: str, key_kind: str, include_trace: bool) -> InvoiceResult:
+    res = InvoiceResult(**copy.deepcopy(value))
+    res.meta["cache"] = {"hit": True, "tier": tier, "key": key_kind}
+    ctx.trace.append(TraceEvent(
+        agent="cache", action="lookup", summary=f"hit ({tier}, {key_kind} hash)",
+        data={"tier": tier, "key": key_kind},
+    ))
+    res.trace = ctx.trace if include_trace else []
+    return res
+
+
+@dataclass
+class _Item:
+    """
+    Per-invoice state while a (batch of) pipeline(s) runs.
+    """
+    ctx: AgentContext
+    res: InvoiceResult
+    pdf_key: Optional[str] = None
+    text_key: Optional[str] = None
+    pipeline: List[str] = field(default_factory=list)
+    levels: List[List[str]] = field(default_factory=list)
+    done: Optional[InvoiceResult] = None
+    include_trace: bool = True
+
+
+def _new_item(
+    text: str, content_hash: Optional[str], level: str, version: str, layout: Optional[DocumentLayout] = None
+) -> _Item:
+    return _Item(
+        ctx=AgentContext(raw_text=text, trace_level=level, layout=layout),
+        res=InvoiceResult(),
+        # like the text key: results read with a layout are kept apart from text-only ones
+        pdf_key=f"pdf:{content_hash}:{version}" + (":layout" if layout is not None else "") if content_hash else None,
+        include_trace=level != "off",
+    )
+
+
+def _begin(item: _Item, cache: Optional[TieredCache], version: str) -> None:
+    """
+    Cache lookups + the fixed head of the pipeline (preprocess, classify, route).
+    Sets item.done on a cache hit.
+    """
+    # 1) same PDF bytes as before: nothing to do at all
+    if cache is not None and item.pdf_key:
+        hit = cache.get(item.pdf_key)
+        if hit:
+            item.done = _cache_hit(item.ctx, hit[0], hit[1], "pdf", item.include_trace)
+            return
 
     # Always preprocess + classify + route first
-    for key in ["preprocess", "classifier", "router"]:
-        res = AGENTS[key].run(ctx, res)
+    item.res = AGENTS["preprocess"].run(item.ctx, item.res)
+
+    # 2) different bytes, same cleaned text (re-export, email duplicate, ...); results read
+    # with a layout (line items, geometric lookups) are kept apart from text-only ones
+    digest = hashlib.sha256(item.ctx.cleaned_text.encode("utf-8")).hexdigest()
+    item.text_key = f"text:{digest}:{version}" + (":layout" if item.ctx.layout is not None else "")
+    if cache is not None:
+        hit = cache.get(item.text_key)
+        if hit:
+            if item.pdf_key:
+                cache.set(item.pdf_key, hit[0])
+            item.done = _cache_hit(item.ctx, hit[0], hit[1], "text", item.include_trace)
+            return
+
+    for key in ["classifier", "router"]:
+        item.res = AGENTS[key].run(item.ctx, item.res)
+
+    item.pipeline = item.ctx.meta.get("pipeline", ["compaction", "invoice_extraction", "vendor", "validation"])
+    item.levels = plan_levels(item.pipeline, AGENTS)
 
-    pipeline = ctx.meta.get("pipeline", ["vendor", "invoice_extraction", "validation"])
 
-    for key in pipeline:
-        res = AGENTS[key].run(ctx, res)
+def _finish(item: _Item, cache: Optional[TieredCache]) -> InvoiceResult:
+    res = item.res
+    unanswered = item.ctx.scratch.get("llm_unanswered")
+    if cache is not None and unanswered:
+        # degraded (LLM needed, no answer): do not pin it, the next request retries the LLM
+        res.meta["cache"] = {"hit": False, "stored": False}
+        item.ctx.trace.append(TraceEvent(
+            agent="cache", action="store", status="warn",
+            summary=f"not cached: no LLM answer for {', '.join(unanswered)}",
+            data={"llm_unanswered": unanswered},
+        ))
+    elif cache is not None:
+        value = res.model_dump(exclude={"trace"})
+        cache.set(item.text_key, value)
+        if item.pdf_key:
+            cache.set(item.pdf_key, value)
+        res.meta["cache"] = {"hit": False}
 
     # attach trace
-    if include_trace:
-        res.trace = ctx.trace
+    if item.include_trace:
+        res.trace = item.ctx.trace
     else:
         res.trace = []
 
     return res
+
+
+Branches = List[Tuple[str, AgentContext, InvoiceResult]]
+
+
+def _level_branches(items: List[_Item], depth: int, pack: bool):
+    """
+    Level `depth` of every item's DAG: all agents of all items are independent here.
+    Agents sharing a level with others work on forked copies that are joined back in
+    pipeline order (_merge_level), so results do not depend on timing.
+    Returns the (item, branches) slots and the (slot, branch) positions of the extraction
+    runs to pack together (pack mode: several invoices per LLM request).
+    """
+    slots: List[Tuple[_Item, Branches]] = []
+    packed: List[Tuple[int, int]] = []
+    for it in items:
+        keys = it.levels[depth] if depth < len(it.levels) else []
+        if not keys:
+            continue
+        branches = [(key, *fork(it.ctx, it.res)) if len(keys) > 1 else (key, it.ctx, it.res) for key in keys]
+        for b, (key, _, _) in enumerate(branches):
+            if pack and key == "invoice_extraction":
+                packed.append((len(slots), b))
+        slots.append((it, branches))
+    return slots, packed
+
+
+def _merge_level(slots: List[Tuple[_Item, Branches]], out: Dict[Tuple[int, int], InvoiceResult]) -> None:
+    for s, (it, branches) in enumerate(slots):
+        if len(branches) == 1:
+            it.res = out[(s, 0)]
+        else:
+            it.res = join(it.ctx, it.res, [
+                (AGENTS[key], ctx, out[(s, b)]) for b, (key, ctx, _) in enumerate(branches)
+            ])
+
+
+def _run_level(items: List[_Item], depth: int, pack: bool) -> None:
+    """
+    Runs level `depth` of every item's DAG on the thread pool (see _level_branches).
+    """
+    slots, packed = _level_branches(items, depth, pack)
+    singles = [(s, b) for s, (_, branches) in enumerate(slots) for b in range(len(branches)) if (s, b) not in packed]
+    jobs: List[Callable[[], Any]] = []
+    for s, b in singles:
+        key, ctx, res = slots[s][1][b]
+        jobs.append(lambda a=AGENTS[key], c=ctx, r=res: a.run(c, r))
+    if packed:
+        batch = [slots[s][1][b][1:] for s, b in packed]
+        jobs.append(lambda: AGENTS["invoice_extraction"].run_batch(batch))
+
+    results = run_jobs(jobs)
+    out = dict(zip(singles, results))
+    if packed:
+        out.update(zip(packed, results[-1]))
+    _merge_level(slots, out)
+
+
+async def _arun_level(items: List[_Item], depth: int, pack: bool) -> None:
+    """
+    _run_level for the event loop: agents run through Agent.arun, the packed extraction
+    through InvoiceExtractionAgent.arun_batch.
+    """
+    slots, packed = _level_branches(items, depth, pack)
+    singles = [(s, b) for s, (_, branches) in enumerate(slots) for b in range(len(branches)) if (s, b) not in packed]
+    coros = [AGENTS[slots[s][1][b][0]].arun(*slots[s][1][b][1:]) for s, b in singles]
+    if packed:
+        coros.append(AGENTS["invoice_extraction"].arun_batch([slots[s][1][b][1:] for s, b in packed]))
+
+    results = await asyncio.gather(*coros)
+    out = dict(zip(singles, results))
+    if packed:
+        out.update(zip(packed, results[-1]))
+    _merge_level(slots, out)
+
+
+def run_pipeline(
+    text: str,
+    include_trace: bool = True,
+    content_hash: Optional[str] = None,
+    trace_level: Optional[str] = None,
+    layout: Optional[DocumentLayout] = None,
+) -> InvoiceResult:
+    return run_pipeline_batch(
+        [text], include_trace=include_trace, content_hashes=[content_hash], trace_level=trace_level,
+        layouts=[layout],
+    )[0]
+
+
+def run_pipeline_batch(
+    texts: List[str],
+    include_trace: bool = True,
+    content_hashes: Optional[List[Optional[str]]] = None,
+    trace_level: Optional[str] = None,
+    layouts: Optional[List[Optional[DocumentLayout]]] = None,
+) -> List[InvoiceResult]:
+    """
+    Runs the pipeline for several invoices. Results are returned in input order.
+    The routed agents run level by level of their dependency DAG (dag.plan_levels):
+    independent agents, and the same level of different invoices, run concurrently.
+    With EXTRACTION_BATCH_MODE=pack (default) the LLM extraction step packs several
+    invoices into one request; every other agent still runs per invoice.
+    trace_level: off | summary | full (see tracing.trace_level).
+    layouts: PDF line boxes per invoice (InvoiceRequest.layout), when the caller has them.
+    """
+    level = effective_trace_level(trace_level, include_trace)
+    cache = extraction_cache()
+    version = _cache_version()
+    hashes = content_hashes or [None] * len(texts)
+    layouts = layouts or [None] * len(texts)
+
+    items = [_new_item(text, h, level, version, lay) for text, h, lay in zip(texts, hashes, layouts)]
+    for it in items:
+        _begin(it, cache, version)
+    pending = [it for it in items if it.done is None]
+
+    pack = os.getenv("EXTRACTION_BATCH_MODE", "pack") == "pack"
+    for depth in range(max((len(it.levels) for it in pending), default=0)):
+        _run_level(pending, depth, pack)
+
+    for it in pending:
+        it.done = _finish(it, cache)
+
+    return [it.done for it in items]
+
+
+async def arun_pipeline(
+    text: str,
+    include_trace: bool = True,
+    content_hash: Optional[str] = None,
+    trace_level: Optional[str] = None,
+    layout: Optional[DocumentLayout] = None,
+) -> InvoiceResult:
+    """
+    run_pipeline for the event loop (see arun_pipeline_batch).
+    """
+    return (await arun_pipeline_batch(
+        [text], content_hashes=[content_hash], layouts=[layout],
+        include_traces=[include_trace], trace_levels=[trace_level],
+    ))[0]
+
+
+async def arun_pipeline_batch(
+    texts: List[str],
+    content_hashes: Optional[List[Optional[str]]] = None,
+    layouts: Optional[List[Optional[DocumentLayout]]] = None,
+    include_traces: Optional[List[bool]] = None,
+    trace_levels: Optional[List[Optional[str]]] = None,
+) -> List[InvoiceResult]:
+    """
+    run_pipeline_batch for the event loop, with trace options per invoice. Agents run
+    through Agent.arun: LLM-bound ones await the async gateway (bounded by
+    LLM_MAX_CONCURRENCY), so waiting invoices hold no thread; with EXTRACTION_BATCH_MODE=pack
+    the extraction level packs the pending invoices (InvoiceExtractionAgent.arun_batch).
+    Cache lookups and the pipeline head (preprocess/classify/route) run on worker threads.
+    """
+    n = len(texts)
+    cache = extraction_cache()
+    version = _cache_version()
+    hashes = content_hashes or [None] * n
+    layouts = layouts or [None] * n
+    include_traces = include_traces or [True] * n
+    trace_levels = trace_levels or [None] * n
+
+    items = [
+        _new_item(text, h, effective_trace_level(lvl, inc), version, lay)
+        for text, h, lay, inc, lvl in zip(texts, hashes, layouts, include_traces, trace_levels)
+    ]
+    await asyncio.gather(*(asyncio.to_thread(_begin, it, cache, version) for it in items))
+    pending = [it for it in items if it.done is None]
+
+    pack = os.getenv("EXTRACTION_BATCH_MODE", "pack") == "pack"
+    for depth in range(max((len(it.levels) for it in pending), default=0)):
+        await _arun_level(pending, depth, pack)
+
+    done = await asyncio.gather(*(asyncio.to_thread(_finish, it, cache) for it in pending))
+    for it, res in zip(pending, done):
+        it.done = res
+    return [it.done for it in items]
@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import os
+import re
+import bisect
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import yaml
+
+logger = logging.getLogger("invoice-mcp")
+
+# repo layout: <root>/config/features.yml ; in Docker mount it at /config/features.yml
+DEFAULT_FEATURES_PATH = Path(__file__).resolve().parents[1] / "config" / "features.yml"
+
+MONTHS = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?"
+CURRENCY_CODES = ("USD", "EUR", "GBP", "JPY", "ZAR", "AUD", "CAD", "CHF")
+CURRENCY_SYMBOLS = {"€": "EUR", "£": "GBP", "¥": "JPY", "$": "USD"}
+NEWLINE_RE = re.compile("\n")
+
+
+@dataclass(frozen=True)
+class PatternSpec:
+    kind: str
+    pattern: str
+    ignore_case: bool = True
+    value_group: int = 0   # group of `pattern` holding the value (0 = whole match)
+    required: bool = False
+    source: str = "builtin"
+
+
+@dataclass(frozen=True)
+class Candidate:
+    kind: str
+    value: str
+    start: int
+    end: int
+    line: int
+    source: str = "builtin"
+
+
+# Built-in patterns used by the deterministic agents, in priority order.
+# Label patterns are line-anchored; [ \t]* (not \s*) keeps a match on its own line.
+BUILTIN_PATTERNS: List[PatternSpec] = [
+    PatternSpec("due_date_label", r"\b(?:due date|payment due|date d'échéance|échéance)\b"),
+    PatternSpec("invoice_date_label",
+                r"\b(?:date of issue|invoice date|date of invoice|date d'émission|billing date|issued|date)\b"),
+    PatternSpec("subtotal_label", r"^[ \t]*(?:sub\s*-?\s*total|total\s+ht|montant\s+ht|net\s+amount)"),
+    PatternSpec("tax_label", r"^[ \t]*(?:total\s+tax|tax|vat|tva|gst|montant\s+tva)\b"),
+    PatternSpec("total_label",
+                r"^[ \t]*(?:grand\s+total|total|amount\s+due|balance\s+due|montant\s+total|net\s+[àa]\s+payer)\b"),
+    PatternSpec("vendor_label",
+                r"^[ \t]*(?:company|supplier name|supplier|vendor|seller|from|fournisseur)[ \t]*:[ \t]*(.+)$",
+                value_group=1),
+    PatternSpec("invoice_number",
+                r"\b(?:invoice\s*(?:number|no\.?|n°|#|id)|référence facture|facture\s*n°)\s*[:#]?\s*"
+                r"([A-Z0-9][A-Z0-9\-/]*\d[A-Z0-9\-/]*)",
+                value_group=1),
+    PatternSpec("date",
+                r"\b(?:\d{4}[-/.]\d{1,2}[-/.]\d{1,2}"
+                r"|\d{1,2}[-/.]\d{1,2}[-/.]\d{4}"
+                rf"|{MONTHS}\s+\d{{1,2}},?\s+\d{{4}}"
+                rf"|\d{{1,2}}\s+{MONTHS}\s+\d{{4}})\b"),
+    PatternSpec("currency_code", r"\b(?:" + "|".join(CURRENCY_CODES) + r")\b", ignore_case=False),
+    PatternSpec("currency_symbol", "[" + "".join(CURRENCY_SYMBOLS) + "]", ignore_case=False),
+    PatternSpec("table_marker", r"\b(?:qty|unit price|subtotal|tax)\b"),
+    PatternSpec("fr_marker", r"\b(?:facture|tva|total ttc)\b"),
+]
+
+
+def _features_path() -> Path:
+    return Path(os.getenv("FEATURES_CONFIG", str(DEFAULT_FEATURES_PATH)))
+
+
+def load_config_patterns(path: Optional[Path] = None) -> List[PatternSpec]:
+    """
+    features.regex_analysis.patterns from config/features.yml (empty when disabled or missing).
+    Invalid patterns are skipped with a warning instead of breaking the service.
+    """
+    path = path or _features_path()
+    if not path.exists():
+        logger.warning("features config not found at %s, using built-in patterns only", path)
+        return []
+    with path.open("r", encoding="utf-8") as fh:
+        features = (yaml.safe_load(fh) or {}).get("features", {}) or {}
+
+    section = features.get("regex_analysis") or {}
+    if not section.get("enabled", True):
+        return []
+
+    specs: List[PatternSpec] = []
+    for kind, entry in (section.get("patterns") or {}).items():
+        entry = entry if isinstance(entry, dict) else {"pattern": entry}
+        pattern = entry.get("pattern") or ""
+        try:
+            groups = re.compile(pattern).groups
+        except re.error as e:
+            logger.warning("skipping regex_analysis pattern %r: %s", kind, e)
+            continue
+        specs.append(PatternSpec(
+            kind=str(kind),
+            pattern=pattern,
+            ignore_case=bool(entry.get("ignore_case", False)),
+            value_group=1 if groups else 0,
+            required=bool(entry.get("required", False)),
+            source="config",
+        ))
+    return specs
+
+
+class ScanResult:
+    """
+    Typed candidates of one text, in position order.
+    """
+
+    def __init__(self, text: str, candidates: List[Candidate], required: Iterable[str] = ()):
+        self.text = text
+        self.candidates = candidates
+        self._required = tuple(required)
+        self._by_line: Optional[Dict[int, List[Candidate]]] = None
+
+    def of(self, kind: str, source: Optional[str] = None) -> List[Candidate]:
+        return [c for c in self.candidates if c.kind == kind and (source is None or c.source == source)]
+
+    def first(self, kind: str, source: Optional[str] = None, lines: Optional[Iterable[int]] = None) -> Optional[Candidate]:
+        pool = self.candidates if lines is None else self.on_lines(lines)
+        for c in pool:
+            if c.kind == kind and (source is None or c.source == source):
+                return c
+        return None
+
+    def on_lines(self, lines: Iterable[int]) -> List[Candidate]:
+        if self._by_line is None:
+            self._by_line = {}
+            for c in self.candidates:
+                self._by_line.setdefault(c.line, []).append(c)
+        return [c for line in sorted(set(lines)) for c in self._by_line.get(line, [])]
+
+    def has(self, kind: str) -> bool:
+        return any(c.kind == kind for c in self.candidates)
+
+    def missing_required(self) -> List[str]:
+        return [k for k in self._required if not self.has(k)]
+
+    def counts(self) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        for c in self.candidates:
+            out[c.kind] = out.get(c.kind, 0) + 1
+        return out
+
+    def summary(self, limit: int = 5) -> Dict[str, Any]:
+        """
+        Small JSON-friendly view for traces.
+        """
+        by_kind: Dict[str, List[Dict[str, Any]]] = {}
+        for c in self.candidates:
+            items = by_kind.setdefault(c.kind, [])
+            if len(items) < limit:
+                items.append({"value": c.value, "start": c.start, "line": c.line, "source": c.source})
+        return {"counts": self.counts(), "missing_required": self.missing_required(), "candidates": by_kind}
+
+
+class PatternEngine:
+    """
+    All patterns compiled into one regex and applied in a single pass over the text.
+
+    Every pattern sits in its own optional lookahead with a named group, so several
+    kinds can start at the same position (a "TVA" line is both a tax label and a French
+    marker) and overlapping kinds do not hide each other. Candidates start at a word
+    start or a symbol; one that starts inside the previous candidate of the same kind
+    is a suffix of it and is dropped.
+    """
+
+    def __init__(self, specs: List[PatternSpec]):
+        self.specs = list(specs)
+        bodies = [f"(?i:{s.pattern})" if s.ignore_case else f"(?:{s.pattern})" for s in self.specs]
+        # cheap gates first: skip mid-word positions, then positions where no pattern starts
+        gate = r"(?:(?<!\w)|(?=[^\w\s]))"
+        prefilter = "(?=" + "|".join(bodies) + ")"
+        captures = "".join(f"(?:(?=(?P<p{i}>{b}))|)" for i, b in enumerate(bodies))
+        # consuming one char (instead of an empty match) keeps finditer on its fast path
+        self._regex = re.compile(gate + prefilter + captures + "(?s:.)", re.MULTILINE)
+        # (spec, whole-match group, value group): inner groups follow their named wrapper
+        self._groups = []
+        for i, s in enumerate(self.specs):
+            idx = self._regex.groupindex[f"p{i}"]
+            self._groups.append((s, idx, idx + s.value_group))
+
+    @property
+    def required(self) -> List[str]:
+        return [s.kind for s in self.specs if s.required]
+
+    def scan(self, text: str) -> ScanResult:
+        text = text or ""
+        newlines = [m.start() for m in NEWLINE_RE.finditer(text)]
+        last_end: Dict[tuple, int] = {}
+        candidates: List[Candidate] = []
+        for m in self._regex.finditer(text):
+            pos = m.start()
+            for spec, whole, group in self._groups:
+                value = m.group(group)
+                if value is None:
+                    continue
+                key = (spec.kind, spec.source)
+                if pos < last_end.get(key, -1):
+                    continue
+                last_end[key] = m.end(whole)
+                start = m.start(group)
+                candidates.append(Candidate(
+                    kind=spec.kind,
+                    value=value.strip(),
+                    start=start,
+                    end=m.end(group),
+                    line=bisect.bisect_left(newlines, start),
+                    source=spec.source,
+                ))
+        return ScanResult(text, candidates, self.required)
+
+
+@lru_cache(maxsize=1)
+def get_engine() -> PatternEngine:
+    """
+    Process-wide engine: built-in patterns first, then the features.yml patterns.
+    """
+    return PatternEngine(BUILTIN_PATTERNS + load_config_patterns())
+
+
+def scan_text(text: str) -> ScanResult:
+    return get_engine().scan(text)
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
-from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import BaseModel, Field, model_validator
 
 
 class TraceEvent(BaseModel):
@@ -11,9 +11,48 @@ class TraceEvent(BaseModel):
     summary: Optional[str] = None
     data: Optional[Dict[str, Any]] = None
 
+class DocumentLayout(BaseModel):
+    """
+    PDF text lines with their position, columnar: entry i of every list is line i
+    (PyMuPDF order). `line` is its line number in the request text (text.split("\n")),
+    where the line's text is read from. Coordinates in points, origin top left.
+    """
+    pages: List[Tuple[float, float]] = Field(default_factory=list, description="(width, height) per page.")
+    page: List[int] = Field(default_factory=list)
+    block: List[int] = Field(default_factory=list, description="Block number within the page.")
+    line: List[int] = Field(default_factory=list, description="Line number in the request text.")
+    x0: List[float] = Field(default_factory=list)
+    y0: List[float] = Field(default_factory=list)
+    x1: List[float] = Field(default_factory=list)
+    y1: List[float] = Field(default_factory=list)
+    size: List[float] = Field(default_factory=list, description="Largest font size of the line.")
+
+    @model_validator(mode="after")
+    def _same_lengths(self) -> "DocumentLayout":
+        n = len(self.line)
+        if any(len(getattr(self, k)) != n for k in ("page", "block", "x0", "y0", "x1", "y1", "size")):
+            raise ValueError("layout columns must all have one entry per line")
+        return self
+
+    def line_texts(self, text: str) -> List[str]:
+        """
+        Text of every layout line, read from the request text.
+        """
+        lines = text.split("\n")
+        return [lines[i] if 0 <= i < len(lines) else "" for i in self.line]
+
+
 class InvoiceRequest(BaseModel):
     text: str = Field(..., description="Raw invoice text extracted from PDF or OCR.")
+    layout: Optional[DocumentLayout] = Field(None, description="Line boxes and font sizes of the PDF (optional).")
     include_trace: bool = True
+    content_hash: Optional[str] = Field(None, description="sha256 of the source PDF bytes (enables cache hits before preprocessing).")
+    trace_level: Optional[str] = Field(None, description="off | summary (large values as hash+length refs) | full. Defaults to TRACE_LEVEL.")
+
+
+class BatchRequest(BaseModel):
+    items: List[InvoiceRequest] = Field(..., description="Invoices with their own options (trace, hash, ...).")
+    stream: bool = Field(False, description="NDJSON: one line per item as soon as it is done (completion order).")
 
 
 class InvoiceResult(BaseModel):
@@ -47,11 +86,13 @@ class AgentContext(BaseModel):
     """
     raw_text: str
     cleaned_text: str = ""
+    layout: Optional[DocumentLayout] = None
     env: str = "dev"
 
     llm_backend: str = "none"
     llm_model: str = ""
     debug: bool = False
+    trace_level: str = "full"  # off | summary | full
 
     # can store intermediate stuff (like token counts later)
     scratch: Dict[str, Any] = Field(default_factory=dict)
@@ -1,10 +1,35 @@
-from fastapi import FastAPI
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple
+
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from schemas import InvoiceRequest
-from orchestrator import run_pipeline
+from fastapi.responses import StreamingResponse
+from schemas import BatchRequest, InvoiceRequest
+from orchestrator import arun_pipeline, arun_pipeline_batch, extraction_cache
+from agents.invoice_extraction_agent import tier_hit_rates
+from llm.gateway import llm_limiter, response_cache
+from http_client import close_http_clients
+from patterns import get_engine
+from vendor_registry import vendor_registry
+
+logger = logging.getLogger("invoice-mcp")
 
 app = FastAPI(title="Invoice MCP", version="1.1")
 
+# /process/batch: invoices of all batch requests in the pipeline at once (per process),
+# on top of LLM_MAX_CONCURRENCY for the LLM calls themselves
+MCP_BATCH_CONCURRENCY = int(os.getenv("MCP_BATCH_CONCURRENCY", "16"))
+MCP_BATCH_MAX_ITEMS = int(os.getenv("MCP_BATCH_MAX_ITEMS", "256"))
+# invoices of a request run through the pipeline together: one packed extraction level
+# (several invoices per LLM request, EXTRACTION_BATCH_MODE=pack) per group
+MCP_BATCH_PACK_SIZE = int(os.getenv("MCP_BATCH_PACK_SIZE", "8"))
+_batch_slots = asyncio.Semaphore(max(1, MCP_BATCH_CONCURRENCY))
+# a group takes all its slots at once: groups waiting for slots never hold part of them
+_batch_slots_lock = asyncio.Lock()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # tighten later for prod
@@ -13,10 +38,113 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def on_startup():
+    # load config/features.yml patterns and compile the scan regex once
+    get_engine()
+    # open the vendor registry (seed file, past runs) before the first request needs it
+    vendor_registry()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await close_http_clients()
+
 @app.get("/")
 def health():
     return {"service": "mcp", "status": "ok"}
 
 @app.post("/process")
-def process(req: InvoiceRequest):
-    return run_pipeline(req.text,include_trace=req.include_trace).model_dump()
+async def process(req: InvoiceRequest):
+    # async end to end: invoices waiting for the LLM do not hold a threadpool thread
+    result = await arun_pipeline(
+        req.text,
+        include_trace=req.include_trace,
+        content_hash=req.content_hash,
+        trace_level=req.trace_level,
+        layout=req.layout,
+    )
+    return result.model_dump()
+
+async def _process_item(index: int, req: InvoiceRequest) -> Dict[str, Any]:
+    try:
+        result = await arun_pipeline(
+            req.text,
+            include_trace=req.include_trace,
+            content_hash=req.content_hash,
+            trace_level=req.trace_level,
+            layout=req.layout,
+        )
+        return {"index": index, "status": "ok", "result": result.model_dump()}
+    except Exception as e:
+        # one invoice never fails the batch
+        logger.exception("batch item %s failed", index)
+        return {"index": index, "status": "error", "error": str(e)}
+
+async def _process_group(group: List[Tuple[int, InvoiceRequest]]) -> List[Dict[str, Any]]:
+    """
+    Invoices of one group through arun_pipeline_batch, holding one _batch_slots slot each.
+    When the group fails as a whole, its invoices are retried one by one so that only
+    the faulty one ends up as an error.
+    """
+    async with _batch_slots_lock:
+        for _ in group:
+            await _batch_slots.acquire()
+    try:
+        try:
+            results = await arun_pipeline_batch(
+                [req.text for _, req in group],
+                content_hashes=[req.content_hash for _, req in group],
+                layouts=[req.layout for _, req in group],
+                include_traces=[req.include_trace for _, req in group],
+                trace_levels=[req.trace_level for _, req in group],
+            )
+        except Exception:
+            logger.exception("batch group %s failed: retrying its items one by one", [i for i, _ in group])
+            return list(await asyncio.gather(*(_process_item(i, req) for i, req in group)))
+        return [{"index": i, "status": "ok", "result": r.model_dump()} for (i, _), r in zip(group, results)]
+    finally:
+        for _ in group:
+            _batch_slots.release()
+
+@app.post("/process/batch")
+async def process_batch(req: BatchRequest):
+    """
+    Several invoices in one request, run in groups of MCP_BATCH_PACK_SIZE (packed extraction).
+    Items are answered with their input `index` and either `result` or `error`; in input
+    order, or as NDJSON in completion order of their group (stream=true).
+    """
+    if len(req.items) > MCP_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"at most {MCP_BATCH_MAX_ITEMS} items per batch")
+    size = max(1, min(MCP_BATCH_PACK_SIZE, MCP_BATCH_CONCURRENCY))
+    indexed = list(enumerate(req.items))
+    tasks = [asyncio.ensure_future(_process_group(indexed[i:i + size])) for i in range(0, len(indexed), size)]
+
+    if req.stream:
+        async def lines():
+            try:
+                for done in asyncio.as_completed(tasks):
+                    for item in await done:
+                        yield json.dumps(item, default=str) + "\n"
+            finally:
+                for t in tasks:  # client gone: stop the remaining groups
+                    t.cancel()
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    items = [item for group in await asyncio.gather(*tasks) for item in group]
+    ok = sum(1 for it in items if it["status"] == "ok")
+    return {"items": items, "summary": {"total": len(items), "ok": ok, "error": len(items) - ok}}
+
+@app.get("/cache/stats")
+def cache_stats():
+    extraction, llm = extraction_cache(), response_cache()
+    return {
+        "extraction": extraction.stats() if extraction else None,
+        "llm": llm.stats() if llm else None,
+        "llm_concurrency": {
+            "limit": llm_limiter.limit,
+            "in_use": llm_limiter.in_use(),
+            "waiting_max": llm_limiter.waiting_max,
+        },
+        "extraction_tiers": tier_hit_rates(),
+        "vendors": vendor_registry().stats(),
+    }
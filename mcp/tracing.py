@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+TRACE_LEVELS = ("off", "summary", "full")
+# same default as the API (api/blobs.py)
+DEFAULT_TRACE_LEVEL = "summary"
+# trace data values larger than this are shortened to a preview at "summary" level
+TRACE_INLINE_MAX_CHARS = int(os.getenv("TRACE_INLINE_MAX_CHARS", "256"))
+
+
+def trace_level(requested: Optional[str] = None, include_trace: bool = True) -> str:
+    """
+    Effective level of a request: include_trace=False means "off";
+    otherwise the requested level, then TRACE_LEVEL (default "summary").
+    """
+    if not include_trace:
+        return "off"
+    level = (requested or os.getenv("TRACE_LEVEL", DEFAULT_TRACE_LEVEL)).lower()
+    return level if level in TRACE_LEVELS else DEFAULT_TRACE_LEVEL
+
+
+def _encode(value: Any) -> tuple[str, bytes]:
+    if isinstance(value, str):
+        return "text", value.encode("utf-8")
+    return "json", json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+
+
+def preview(value: Any, max_chars: Optional[int] = None) -> Dict[str, Any]:
+    """
+    {"$preview": first max_chars chars, "type": "text"|"json", "len": bytes, "sha256": ...}.
+    MCP keeps no blob store, so it never emits "$blob" refs: the full value is only
+    available at level "full" (which the API requests, storing large values itself).
+    """
+    limit = TRACE_INLINE_MAX_CHARS if max_chars is None else max_chars
+    kind, raw = _encode(value)
+    return {
+        "$preview": raw.decode("utf-8")[:limit],
+        "type": kind,
+        "len": len(raw),
+        "sha256": hashlib.sha256(raw).hexdigest(),
+    }
+
+
+def slim(data: Optional[Dict[str, Any]], max_chars: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Shortens large values of a trace event's data to previews; small values stay inline.
+    """
+    limit = TRACE_INLINE_MAX_CHARS if max_chars is None else max_chars
+    out: Dict[str, Any] = {}
+    for key, value in (data or {}).items():
+        if value is None or isinstance(value, (bool, int, float)):
+            out[key] = value
+            continue
+        _, raw = _encode(value)
+        out[key] = preview(value, limit) if len(raw) > limit else value
+    return out
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import yaml
+
+logger = logging.getLogger("invoice-mcp")
+
+# repo layout: <root>/config/vendors.yml ; in Docker mount it at /config/vendors.yml
+DEFAULT_SEED_PATH = Path(__file__).resolve().parents[1] / "config" / "vendors.yml"
+# a fuzzy match needs at least this trigram (Dice) similarity
+VENDOR_MATCH_THRESHOLD = float(os.getenv("VENDOR_MATCH_THRESHOLD", "0.75"))
+
+LEGAL_SUFFIXES = {
+    "inc", "incorporated", "ltd", "limited", "llc", "llp", "plc", "pbc", "corp", "corporation",
+    "co", "company", "gmbh", "ag", "sa", "sas", "sarl", "bv", "nv", "srl", "spa", "pty", "oy", "ab",
+}
+NON_WORD_RE = re.compile(r"[^\w]+")
+# "L.L.C." / "S.A.S." -> "llc" / "sas" before punctuation is dropped
+DOTTED_RE = re.compile(r"\b((?:\w\.){2,})")
+
+
+def normalize_vendor(name: str) -> str:
+    """
+    Matching key of a vendor name: case and accents folded, punctuation and spaces dropped,
+    legal form suffixes ("Inc.", "L.L.C.", "GmbH"...) removed.
+    """
+    s = unicodedata.normalize("NFKD", name or "")
+    s = "".join(c for c in s if not unicodedata.combining(c)).casefold()
+    s = DOTTED_RE.sub(lambda m: m.group(1).replace(".", ""), s)
+    words = NON_WORD_RE.sub(" ", s).split()
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    return "".join(words)
+
+
+def trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass(frozen=True)
+class VendorMatch:
+    vendor: str      # canonical name
+    alias: str       # registered spelling that matched
+    score: float     # 1.0 = same key
+    exact: bool
+
+
+class VendorRegistry:
+    """
+    Known vendors and their spellings, persisted in SQLite (optional) and indexed in
+    memory: exact key lookups, plus a trigram inverted index for fuzzy ones. A fuzzy lookup
+    counts shared trigrams with one np.bincount over the posting lists of the name's
+    trigrams, so it only touches aliases sharing a trigram with it.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._vendors: Dict[int, str] = {}
+        self._vendor_ids: Dict[str, int] = {}
+        self._aliases: List[Tuple[str, str, int]] = []         # (key, alias, vendor id)
+        self._by_key: Dict[str, int] = {}                      # key -> alias position
+        self._postings: Dict[str, List[int]] = {}              # trigram -> alias positions
+        self._posting_arrays: Dict[str, np.ndarray] = {}       # same, as arrays (built on lookup)
+        self._sizes: List[int] = []                            # trigram count per alias
+        self._sizes_array = np.zeros(0)
+
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.learned = 0
+
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS vendor ("
+                " id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE,"
+                " source TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS vendor_alias ("
+                " key TEXT PRIMARY KEY, alias TEXT NOT NULL,"
+                " vendor_id INTEGER NOT NULL REFERENCES vendor (id), source TEXT NOT NULL)"
+            )
+            self._db.commit()
+            self._load()
+
+    def _load(self) -> None:
+        for vid, name in self._db.execute("SELECT id, name FROM vendor"):
+            self._vendors[vid] = name
+            self._vendor_ids[name] = vid
+        for key, alias, vid in self._db.execute("SELECT key, alias, vendor_id FROM vendor_alias"):
+            self._index(key, alias, vid)
+
+    def _index(self, key: str, alias: str, vid: int) -> None:
+        pos = len(self._aliases)
+        grams = trigrams(key)
+        self._aliases.append((key, alias, vid))
+        self._sizes.append(len(grams))
+        self._by_key[key] = pos
+        for g in grams:
+            self._postings.setdefault(g, []).append(pos)
+            self._posting_arrays.pop(g, None)
+
+    def _posting(self, gram: str) -> Optional[np.ndarray]:
+        arr = self._posting_arrays.get(gram)
+        if arr is None and gram in self._postings:
+            arr = self._posting_arrays[gram] = np.asarray(self._postings[gram], dtype=np.int64)
+        return arr
+
+    # lookups
+
+    def _match(self, name: str) -> Optional[VendorMatch]:
+        key = normalize_vendor(name)
+        if not key:
+            return None
+        pos = self._by_key.get(key)
+        if pos is not None:
+            _, alias, vid = self._aliases[pos]
+            return VendorMatch(self._vendors[vid], alias, 1.0, True)
+
+        grams = trigrams(key)
+        postings = [arr for arr in (self._posting(g) for g in grams) if arr is not None]
+        if not postings:
+            return None
+        if len(self._sizes_array) != len(self._sizes):
+            self._sizes_array = np.asarray(self._sizes, dtype=float)
+        common = np.bincount(np.concatenate(postings), minlength=len(self._sizes))
+        scores = 2 * common / (len(grams) + self._sizes_array)  # Dice coefficient
+        best = int(np.argmax(scores))
+        if scores[best] < VENDOR_MATCH_THRESHOLD:
+            return None
+        _, alias, vid = self._aliases[best]
+        return VendorMatch(self._vendors[vid], alias, round(float(scores[best]), 3), False)
+
+    def lookup(self, name: str) -> Optional[VendorMatch]:
+        """
+        Canonical vendor for a name as printed on an invoice, or None when unseen.
+        """
+        with self._lock:
+            match = self._match(name)
+            if match is None:
+                self.misses += 1
+            elif match.exact:
+                self.hits += 1
+            else:
+                self.fuzzy_hits += 1
+            return match
+
+    # writes
+
+    def _add_vendor(self, name: str, source: str) -> int:
+        vid = self._vendor_ids.get(name)
+        if vid is not None:
+            return vid
+        if self._db is not None:
+            cur = self._db.execute(
+                "INSERT INTO vendor (name, source, created_at) VALUES (?, ?, ?)", (name, source, time.time())
+            )
+            vid = cur.lastrowid
+        else:
+            vid = len(self._vendors) + 1
+        self._vendors[vid] = name
+        self._vendor_ids[name] = vid
+        return vid
+
+    def _add_alias(self, alias: str, vid: int, source: str) -> bool:
+        key = normalize_vendor(alias)
+        if not key or key in self._by_key:
+            return False
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR IGNORE INTO vendor_alias (key, alias, vendor_id, source) VALUES (?, ?, ?, ?)",
+                (key, alias, vid, source),
+            )
+        self._index(key, alias, vid)
+        return True
+
+    def add(self, name: str, aliases: Iterable[str] = (), source: str = "seed") -> None:
+        """
+        Registers a canonical vendor (idempotent) with its own name and `aliases` as spellings.
+        A spelling already known keeps its vendor.
+        """
+        name = (name or "").strip()
+        if not name:
+            return
+        with self._lock:
+            vid = self._add_vendor(name, source)
+            for alias in [name, *aliases]:
+                self._add_alias(alias.strip(), vid, source)
+            if self._db is not None:
+                self._db.commit()
+
+    def learn(self, name: str, canonical: str, source: str = "llm") -> None:
+        """
+        Writes an answer back (LLM normalization): `name` becomes a spelling of `canonical`,
+        or of the known vendor `canonical` itself matches.
+        """
+        canonical = (canonical or "").strip()
+        if not canonical:
+            return
+        with self._lock:
+            known = self._match(canonical)
+            vid = self._vendor_ids[known.vendor] if known else self._add_vendor(canonical, source)
+            self._add_alias(canonical, vid, source)
+            self._add_alias(name.strip(), vid, source)
+            self.learned += 1
+            if self._db is not None:
+                self._db.commit()
+
+    def load_seed(self, path: Optional[Path] = None) -> int:
+        """
+        vendors: [{name, aliases}] from the seed file (see config/vendors.yml). Returns the vendor count.
+        """
+        path = path or Path(os.getenv("VENDOR_SEED_FILE") or DEFAULT_SEED_PATH)
+        if not path.is_file():
+            logger.warning("vendor seed file not found at %s, starting without seed", path)
+            return 0
+        with path.open("r", encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+        entries = data.get("vendors") or []
+        for entry in entries:
+            if isinstance(entry, str):
+                self.add(entry)
+            elif isinstance(entry, dict):
+                self.add(str(entry.get("name") or ""), [str(a) for a in entry.get("aliases") or []])
+        return len(entries)
+
+    def import_runs(self, db_path: str) -> int:
+        """
+        Builds vendors from the Run.vendor values of the API database (SQLite file), most
+        frequent spelling first: a spelling matching a known vendor becomes its alias,
+        any other one a new vendor. Returns the number of distinct values read.
+        """
+        with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+            rows = conn.execute(
+                "SELECT vendor, COUNT(*) AS n FROM run WHERE vendor IS NOT NULL AND vendor != ''"
+                " AND status != 'error' GROUP BY vendor ORDER BY n DESC, vendor"
+            ).fetchall()
+        with self._lock:
+            for name, _ in rows:
+                known = self._match(name)
+                vid = self._vendor_ids[known.vendor] if known else self._add_vendor(name.strip(), "runs")
+                self._add_alias(name.strip(), vid, "runs")
+            if self._db is not None:
+                self._db.commit()
+        return len(rows)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "vendors": len(self._vendors),
+                "aliases": len(self._aliases),
+                "hits": self.hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "misses": self.misses,
+                "learned": self.learned,
+            }
+
+
+_registry: Optional[VendorRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def vendor_registry() -> VendorRegistry:
+    """
+    Process-wide registry (VENDOR_REGISTRY_PATH, "" = memory only), seeded on first use from
+    VENDOR_SEED_FILE and, when VENDOR_RUNS_DB points at the API SQLite file, from past runs.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            registry = VendorRegistry(os.getenv("VENDOR_REGISTRY_PATH", "./data/vendors.db") or None)
+            registry.load_seed()
+            runs_db = os.getenv("VENDOR_RUNS_DB", "")
+            if runs_db and not Path(runs_db).is_file():
+                logger.warning("vendor registry: no runs database at %s, skipping the import", runs_db)
+            elif runs_db:
+                try:
+                    registry.import_runs(runs_db)
+                except sqlite3.Error:
+                    logger.exception("vendor registry: could not import runs from %s", runs_db)
+            logger.info("vendor registry: %s", registry.stats())
+            _registry = registry
+        return _registry
+
+
+def set_vendor_registry(registry: Optional[VendorRegistry]) -> None:
+    """
+    Replaces the process-wide registry (None = rebuild from the environment on next use).
+    """
+    global _registry
+    with _registry_lock:
+        _registry = registry
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger("invoice-http")
+
+# Shared, keep-alive HTTP clients for outbound calls (API -> MCP, MCP -> LLM backends).
+# One module for both services: each image copies shared/ next to its own code.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+HTTP_CONNECT_TIMEOUT_S = float(os.getenv("HTTP_CONNECT_TIMEOUT_S", "5"))
+HTTP_READ_TIMEOUT_S = float(os.getenv("HTTP_READ_TIMEOUT_S", "120"))
+# retries only cover connection failures (request never reached the server)
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF_S = float(os.getenv("HTTP_BACKOFF_S", "0.2"))
+
+_session: Optional[requests.Session] = None
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Exponential backoff with full jitter: avoids retry storms when the server restarts.
+    """
+    return random.uniform(0, HTTP_BACKOFF_S * (2 ** attempt))
+
+
+def http_session() -> requests.Session:
+    """
+    Process-wide requests.Session with a bounded connection pool.
+    pool_block=True gives backpressure: callers wait for a free connection instead of opening more.
+    """
+    global _session
+    if _session is None:
+        retry = Retry(
+            total=None,
+            connect=HTTP_RETRIES,
+            read=0,
+            redirect=0,
+            status=0,
+            other=0,
+            allowed_methods=None,
+            backoff_factor=HTTP_BACKOFF_S,
+            backoff_jitter=HTTP_BACKOFF_S,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=HTTP_POOL_SIZE,
+            pool_block=True,
+            max_retries=retry,
+        )
+        s = requests.Session()
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        _session = s
+    return _session
+
+
+def sync_timeout(read_s: Optional[float] = None) -> tuple[float, float]:
+    return (HTTP_CONNECT_TIMEOUT_S, read_s or HTTP_READ_TIMEOUT_S)
+
+
+def async_timeout(read_s: Optional[float] = None) -> httpx.Timeout:
+    # pool timeout = how long a caller may wait for a free connection (backpressure)
+    return httpx.Timeout(
+        connect=HTTP_CONNECT_TIMEOUT_S,
+        read=read_s or HTTP_READ_TIMEOUT_S,
+        write=HTTP_CONNECT_TIMEOUT_S,
+        pool=read_s or HTTP_READ_TIMEOUT_S,
+    )
+
+
+def async_http_client() -> httpx.AsyncClient:
+    """
+    Process-wide httpx.AsyncClient (keep-alive pool of HTTP_POOL_SIZE connections).
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+            timeout=async_timeout(),
+        )
+    return _async_client
+
+
+async def apost(client: httpx.AsyncClient, url: str, read_timeout_s: Optional[float] = None, **kwargs: Any) -> httpx.Response:
+    """
+    POST with jittered retries on connection errors only (safe: nothing was sent).
+    """
+    for attempt in range(HTTP_RETRIES + 1):
+        try:
+            return await client.post(url, timeout=async_timeout(read_timeout_s), **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            if attempt >= HTTP_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning("POST %s failed (%s), retry %s in %.2fs", url, e, attempt + 1, delay)
+            await asyncio.sleep(delay)
+
+
+@asynccontextmanager
+async def astream_post(
+    client: httpx.AsyncClient, url: str, read_timeout_s: Optional[float] = None, **kwargs: Any
+) -> AsyncIterator[httpx.Response]:
+    """
+    Streaming POST (response body read incrementally), same connection retries as apost.
+    Leaving the block early closes the connection.
+    """
+    for attempt in range(HTTP_RETRIES + 1):
+        cm = client.stream("POST", url, timeout=async_timeout(read_timeout_s), **kwargs)
+        try:
+            resp = await cm.__aenter__()
+            break
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            if attempt >= HTTP_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning("POST %s failed (%s), retry %s in %.2fs", url, e, attempt + 1, delay)
+            await asyncio.sleep(delay)
+    try:
+        yield resp
+    finally:
+        await cm.__aexit__(None, None, None)
+
+
+async def close_http_clients() -> None:
+    global _session, _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _session is not None:
+        _session.close()
+        _session = None
@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# api/ and mcp/ are deployed as flat apps, with shared/ copied next to them (see Dockerfiles):
+# mirror that layout here
+for sub in ("shared", "mcp", "api"):
+    p = str(ROOT / sub)
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+os.environ.setdefault("LLM_BACKEND", "none")
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/test_app.db")
+os.environ.setdefault("JOB_SPOOL_DIR", f"{_tmp}/jobs")
+os.environ.setdefault("EXTRACTION_CACHE_PATH", f"{_tmp}/extraction_cache.db")
+os.environ.setdefault("LLM_CACHE_PATH", f"{_tmp}/llm_cache.db")
+os.environ.setdefault("VENDOR_REGISTRY_PATH", f"{_tmp}/vendors.db")
+os.environ.setdefault("BLOB_DIR", f"{_tmp}/blobs")
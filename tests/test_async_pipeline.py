@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+
+from llm import gateway
+from llm.limiter import ConcurrencyLimiter
+from orchestrator import arun_pipeline, run_pipeline
+
+
+def test_limiter_bounds_threads_and_tasks_together():
+    limiter = ConcurrencyLimiter(3)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def enter():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+
+    def leave():
+        with lock:
+            active[0] -= 1
+
+    def sync_call():
+        with limiter:
+            enter()
+            time.sleep(0.01)
+            leave()
+
+    async def async_call():
+        async with limiter:
+            enter()
+            await asyncio.sleep(0.01)
+            leave()
+
+    async def main():
+        threads = [threading.Thread(target=sync_call) for _ in range(10)]
+        for t in threads:
+            t.start()
+        await asyncio.gather(*(async_call() for _ in range(30)))
+        for t in threads:
+            t.join()
+
+    asyncio.run(main())
+    assert peak[0] == 3
+    assert limiter.in_use() == 0
+
+
+def test_cancelled_waiter_gives_its_slot_back():
+    limiter = ConcurrencyLimiter(1)
+
+    async def main():
+        async with limiter:
+            waiter = asyncio.ensure_future(limiter.aacquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+        await asyncio.wait_for(limiter.aacquire(), timeout=1)
+        limiter.release()
+
+    asyncio.run(main())
+    assert limiter.in_use() == 0
+
+
+def test_async_pipeline_matches_sync_and_respects_llm_limit(monkeypatch):
+    in_flight, peak = [0], [0]
+
+    async def fake_aollama(prompt, expect="object"):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        await asyncio.sleep(0.02)
+        in_flight[0] -= 1
+        return {"vendor": "Slow LLM Ltd", "amount_total": 42.0}
+
+    def fake_ollama(prompt, expect="object"):
+        return {"vendor": "Slow LLM Ltd", "amount_total": 42.0}
+
+    monkeypatch.setenv("LLM_BACKEND", "ollama")
+    monkeypatch.setenv("EXTRACTION_CACHE", "0")
+    monkeypatch.setattr(gateway, "aollama_generate", fake_aollama)
+    monkeypatch.setattr(gateway, "ollama_generate", fake_ollama)
+    monkeypatch.setattr(gateway, "llm_limiter", ConcurrencyLimiter(4))
+    previous = gateway.response_cache()
+    gateway.set_response_cache(None)
+
+    # nothing for the deterministic tier: every invoice waits on the LLM
+    texts = [f"Invoice\nPage {i}" for i in range(40)]
+
+    async def main():
+        return await asyncio.gather(*(arun_pipeline(t) for t in texts))
+
+    try:
+        started = time.perf_counter()
+        results = asyncio.run(main())
+        elapsed = time.perf_counter() - started
+        expected = run_pipeline(texts[0])
+    finally:
+        gateway.set_response_cache(previous)
+
+    assert peak[0] == 4
+    assert elapsed < 40 * 0.02  # the LLM calls overlapped (up to the limit)
+    assert {r.vendor for r in results} == {"Slow LLM Ltd"}
+    dump = lambda r: r.model_dump(exclude={"trace", "meta"})  # noqa: E731
+    assert dump(results[0]) == dump(expected)
+    assert results[0].meta["agents_ran"] == expected.meta["agents_ran"]
+
+
+def test_vendor_and_line_items_agents_await_the_async_gateway(monkeypatch):
+    import vendor_registry
+    from agents.line_items_agent import LineItemsAgent
+    from agents.preprocess_agent import TextPreprocessAgent
+    from agents.vendor_agent import VendorAgent
+    from schemas import AgentContext, InvoiceResult
+
+    calls = []
+
+    async def fake_aollama(prompt, expect="object"):
+        calls.append(expect)
+        if expect == "array":
+            return [{"description": "Odd row", "quantity": 5, "unit_price": 3.4, "amount": 17.0}]
+        return {"vendor_canonical": "ACME"}
+
+    def blocking_ollama(prompt, expect="object"):
+        raise AssertionError("sync gateway used from the event loop path")
+
+    monkeypatch.setenv("LLM_BACKEND", "ollama")
+    monkeypatch.setattr(gateway, "aollama_generate", fake_aollama)
+    monkeypatch.setattr(gateway, "ollama_generate", blocking_ollama)
+    monkeypatch.setattr(vendor_registry, "_registry", vendor_registry.VendorRegistry())
+    previous = gateway.response_cache()
+    gateway.set_response_cache(None)
+
+    text = "ACME Ltd\nDescription Qty Unit price Amount\nWidget A 2 10.00 20.00\nOdd row 5 3.00 17.00\nSubtotal 37.00"
+    ctx = AgentContext(raw_text=text)
+
+    async def main():
+        res = TextPreprocessAgent().run(ctx, InvoiceResult(vendor="ACME Ltd"))
+        res = await LineItemsAgent().arun(ctx, res)
+        return await VendorAgent().arun(ctx, res)
+
+    try:
+        res = asyncio.run(main())
+    finally:
+        gateway.set_response_cache(previous)
+
+    assert calls == ["array", "object"]
+    assert res.vendor == "ACME" and res.line_items[1]["source"] == "llm"
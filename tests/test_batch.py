@@ -0,0 +1,107 @@
+import asyncio
+import io
+import json
+
+import fitz
+import httpx
+from fastapi import UploadFile
+
+from db import init_db, get_session
+from batch import run_batch, summarize
+
+
+def _pdf(text: str) -> bytes:
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), text)
+    return doc.tobytes()
+
+
+def _upload(name: str, text: str) -> UploadFile:
+    return UploadFile(file=io.BytesIO(_pdf(text)), filename=name)
+
+
+def test_batch_keeps_upload_order_and_isolates_errors():
+    init_db()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        text = json.loads(request.content)["text"]
+        if "broken" in text:
+            return httpx.Response(500, text="boom")
+        # answer the first upload last to prove ordering does not depend on completion
+        await asyncio.sleep(0.05 if "first" in text else 0)
+        warnings = ["MISSING_VENDOR"] if "warn" in text else []
+        return httpx.Response(200, json={"vendor": text.strip(), "warnings": warnings, "trace": []})
+
+    files = [_upload("a.pdf", "first"), _upload("b.pdf", "broken"), _upload("c.pdf", "warn")]
+
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            session = get_session()
+            try:
+                return await run_batch(session, files, workers=2, client=client, chunk_size=1)
+            finally:
+                session.close()
+
+    results = asyncio.run(go())
+
+    assert [r["filename"] for r in results] == ["a.pdf", "b.pdf", "c.pdf"]
+    assert [r["status"] for r in results] == ["ok", "error", "warning"]
+    assert "boom" in results[1]["error"]["message"]
+    assert summarize(results) == {"total_files": 3, "ok": 1, "warning": 1, "error": 1}
+
+
+def test_batch_sends_chunks_to_mcp_batch_endpoint():
+    init_db()
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/process/batch"
+        items = json.loads(request.content)["items"]
+        requests.append(len(items))
+        if any("down" in it["text"] for it in items):
+            return httpx.Response(503, text="overloaded")
+        answers = [
+            {"index": i, "status": "error", "error": "bad invoice"} if "bad" in it["text"]
+            else {"index": i, "status": "ok", "result": {"vendor": it["text"].strip(), "trace": []}}
+            for i, it in enumerate(items)
+        ]
+        return httpx.Response(200, json={"items": answers[::-1]})  # order comes from "index"
+
+    names = ["one", "bad", "three", "four", "down", "six"]
+    files = [_upload(f"{n}.pdf", n) for n in names]
+
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            session = get_session()
+            try:
+                return await run_batch(session, files, workers=2, client=client, chunk_size=3)
+            finally:
+                session.close()
+
+    results = asyncio.run(go())
+
+    assert sorted(requests) == [3, 3]
+    assert [r["status"] for r in results] == ["ok", "error", "ok", "error", "error", "error"]
+    assert [r["result"]["vendor"] for r in results if r["status"] == "ok"] == ["one", "three"]
+    assert "bad invoice" in results[1]["error"]["message"]
+    assert "overloaded" in results[3]["error"]["message"]
+
+
+def test_async_post_retries_connection_errors(monkeypatch):
+    import http_client
+
+    monkeypatch.setattr(http_client, "HTTP_BACKOFF_S", 0.001)
+    attempts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        attempts.append(request)
+        if len(attempts) < 3:
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, json={"ok": True})
+
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await http_client.apost(client, "http://mcp/process", json={})
+
+    assert asyncio.run(go()).json() == {"ok": True}
+    assert len(attempts) == 3
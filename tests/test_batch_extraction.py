@@ -0,0 +1,92 @@
+import asyncio
+
+import vendor_registry
+from agents.invoice_extraction_agent import _valid_entry
+from llm import gateway
+from orchestrator import arun_pipeline_batch, run_pipeline_batch, extraction_cache
+from vendor_registry import VendorRegistry
+
+
+def _known_vendors(monkeypatch, *names):
+    # known vendors: the registry answers, no normalization call
+    registry = VendorRegistry()
+    for name in names:
+        registry.add(name)
+    monkeypatch.setattr(vendor_registry, "_registry", registry)
+
+
+def test_packed_extraction_maps_answers_and_falls_back(monkeypatch):
+    calls = []
+
+    def fake_ollama(prompt, expect="object"):
+        calls.append(expect)
+        if expect == "array":
+            # id=1 is missing: that invoice must be retried on its own
+            return [
+                {"id": 0, "vendor": "Alpha SA", "amount_total": 10.0},
+                {"id": 2, "vendor": "Gamma Ltd", "amount_total": 30.0},
+            ]
+        return {"vendor": "Beta GmbH", "amount_total": 20.0}
+
+    monkeypatch.setenv("LLM_BACKEND", "ollama")
+    monkeypatch.setattr(gateway, "ollama_generate", fake_ollama)
+    _known_vendors(monkeypatch, "Alpha SA", "Beta GmbH", "Gamma Ltd")
+    previous = gateway.response_cache()
+    gateway.set_response_cache(None)
+    extraction_cache().clear()
+
+    try:
+        # nothing usable for the deterministic tier: every invoice needs the LLM
+        texts = [f"Invoice\nPage {i}" for i in range(3)]
+        results = run_pipeline_batch(texts)
+    finally:
+        gateway.set_response_cache(previous)
+
+    assert [r.vendor for r in results] == ["Alpha SA", "Beta GmbH", "Gamma Ltd"]
+    assert [r.amount_total for r in results] == [10.0, 20.0, 30.0]
+    assert results[0].meta["extraction_mode"] == "batched(3)"
+    assert results[1].meta["extraction_mode"] == "single"
+    assert calls == ["array", "object"]
+
+
+def test_packed_entries_must_match_the_schema():
+    assert _valid_entry({"id": 0, "vendor": "Alpha SA", "amount_total": "1,480.00", "invoice_date": "2025-01-31"})
+    assert not _valid_entry({"id": 0})  # no field at all
+    assert not _valid_entry({"id": "0", "vendor": "Alpha SA"})
+    assert not _valid_entry({"vendor": ["Alpha SA"]})
+    assert not _valid_entry({"amount_total": "unknown"})
+    assert not _valid_entry({"amount_total": -5.0})
+    assert not _valid_entry({"invoice_date": "last Tuesday"})
+    assert not _valid_entry({"currency": "Euros"})
+
+
+def test_async_batch_packs_the_extraction_level(monkeypatch):
+    calls = []
+
+    async def fake_aollama(prompt, expect="object"):
+        calls.append(expect)
+        if expect == "array":
+            return [
+                {"id": 0, "vendor": "Alpha SA", "amount_total": 10.0},
+                {"id": 1, "vendor": "Beta GmbH", "amount_total": "twenty"},  # malformed: single call
+            ]
+        return {"vendor": "Beta GmbH", "amount_total": 20.0}
+
+    monkeypatch.setenv("LLM_BACKEND", "ollama")
+    monkeypatch.setattr(gateway, "aollama_generate", fake_aollama)
+    _known_vendors(monkeypatch, "Alpha SA", "Beta GmbH")
+    previous = gateway.response_cache()
+    gateway.set_response_cache(None)
+    extraction_cache().clear()
+
+    try:
+        results = asyncio.run(arun_pipeline_batch(
+            ["Invoice\nPage 10", "Invoice\nPage 11"], include_traces=[True, False],
+        ))
+    finally:
+        gateway.set_response_cache(previous)
+
+    assert [(r.vendor, r.amount_total) for r in results] == [("Alpha SA", 10.0), ("Beta GmbH", 20.0)]
+    assert [r.meta["extraction_mode"] for r in results] == ["batched(2)", "single"]
+    assert calls == ["array", "object"]
+    assert results[0].trace and results[1].trace == []
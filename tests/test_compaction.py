@@ -0,0 +1,64 @@
+import vendor_registry
+from agents.compaction_agent import compact_text
+from agents.invoice_extraction_agent import _estimate_tokens
+from llm import gateway
+from orchestrator import extraction_cache, run_pipeline
+from patterns import scan_text
+from vendor_registry import VendorRegistry
+
+HEADER = "Northwind Traders Ltd\n12 Harbour Road, Leeds\nInvoice number: INV-2031\nInvoice date: 2025-04-02"
+TOTALS = "Subtotal 1,000.00\nVAT 200.00\nTotal EUR 1,200.00"
+TERMS = (
+    "Terms and conditions. The supplier shall not be liable for any indirect or consequential loss "
+    "arising out of or in connection with the supply of goods or services under this agreement."
+)
+
+
+def _long_invoice(pages: int = 30) -> str:
+    boilerplate = "\n\n".join(TERMS for _ in range(pages))
+    return f"{HEADER}\n\n{boilerplate}\n\n{TOTALS}\n\n{boilerplate}"
+
+
+def test_compaction_keeps_header_and_totals_within_budget():
+    text = _long_invoice()
+    compacted, stats = compact_text(text, scan_text(text), budget=200)
+
+    assert stats["original_tokens"] > 1000
+    assert stats["compacted_tokens"] <= 200
+    assert "Northwind Traders Ltd" in compacted and "INV-2031" in compacted
+    assert "Total EUR 1,200.00" in compacted and "VAT 200.00" in compacted
+    assert "[...]" in compacted
+
+    short = f"{HEADER}\n\n{TOTALS}"
+    assert compact_text(short, scan_text(short), budget=200) == (short, {
+        "original_tokens": _estimate_tokens(short), "compacted_tokens": _estimate_tokens(short),
+        "blocks": 0, "kept_blocks": 0,
+    })
+
+
+def test_llm_prompt_uses_compacted_text(monkeypatch):
+    prompts = []
+
+    def fake_ollama(prompt, expect="object"):
+        prompts.append(prompt)
+        return {"vendor": "Northwind Traders Ltd"}
+
+    monkeypatch.setenv("LLM_BACKEND", "ollama")
+    monkeypatch.setattr(gateway, "ollama_generate", fake_ollama)
+    registry = VendorRegistry()
+    registry.add("Northwind Traders Ltd")
+    monkeypatch.setattr(vendor_registry, "_registry", registry)
+    previous = gateway.response_cache()
+    gateway.set_response_cache(None)
+    extraction_cache().clear()
+    try:
+        # no date: the deterministic tier is not enough, the LLM is asked
+        res = run_pipeline(_long_invoice().replace("Invoice date: 2025-04-02", "Issued soon"))
+    finally:
+        gateway.set_response_cache(previous)
+
+    assert len(prompts) == 1
+    assert prompts[0].count("Terms and conditions") < 30
+    stats = res.meta["prompt_compaction"]
+    assert stats["compacted_tokens"] < stats["original_tokens"]
+    assert any(e.agent == "compact" for e in res.trace)
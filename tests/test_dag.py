@@ -0,0 +1,76 @@
+import time
+
+import dag
+from agent_base import Agent
+from dag import plan_levels
+from orchestrator import AGENTS, run_pipeline, run_pipeline_batch
+
+TABLE_INVOICE = "Invoice\nACME Corp\nDate: 2025-03-01\nDescription Qty Amount\nSubtotal 10.00\nVAT 2.00\nTotal EUR 12.00"
+
+
+def test_routed_pipeline_levels():
+    pipeline = ["compaction", "invoice_extraction", "line_items", "vendor", "validation"]
+    # line_items only reads the text: it runs next to compaction; vendor reads what extraction writes
+    assert plan_levels(pipeline, AGENTS) == [
+        ["compaction", "line_items"], ["invoice_extraction"], ["vendor"], ["validation"],
+    ]
+
+    class Opaque(Agent):
+        name = "opaque"  # no declarations: runs alone
+
+        def run(self, ctx, result):
+            return result
+
+    agents = {**AGENTS, "opaque": Opaque()}
+    assert plan_levels(["line_items", "opaque", "vendor"], agents) == [["line_items"], ["opaque"], ["vendor"]]
+
+
+def test_parallel_run_matches_sequential(monkeypatch):
+    monkeypatch.setenv("EXTRACTION_CACHE", "0")
+
+    def outcome():
+        results = run_pipeline_batch([TABLE_INVOICE, TABLE_INVOICE.replace("ACME", "Beta")])
+        return [
+            (r.model_dump(exclude={"trace", "meta"}), r.meta["agents_ran"], [(e.agent, e.action) for e in r.trace])
+            for r in results
+        ]
+
+    monkeypatch.setattr(dag, "AGENT_WORKERS", 1)
+    sequential = outcome()
+    monkeypatch.setattr(dag, "AGENT_WORKERS", 4)
+    assert outcome() == sequential
+    assert sequential[0][1][-5:] == ["compact", "line_items", "extract", "vendor", "validate"]
+
+
+def test_independent_agents_overlap(monkeypatch):
+    monkeypatch.setenv("EXTRACTION_CACHE", "0")
+
+    class Slow(Agent):
+        inputs = ("text",)
+
+        def __init__(self, name, field):
+            self.name, self.outputs = name, (field,)
+
+        def run(self, ctx, result):
+            time.sleep(0.3)  # stands for one LLM round trip
+            setattr(result, self.outputs[0], self.name)
+            result.meta.setdefault("agents_ran", []).append(self.name)
+            return result
+
+    class Route(Agent):
+        name = "router"
+
+        def run(self, ctx, result):
+            ctx.meta["pipeline"] = ["slow_a", "slow_b"]
+            return result
+
+    monkeypatch.setitem(AGENTS, "slow_a", Slow("slow_a", "invoice_number"))
+    monkeypatch.setitem(AGENTS, "slow_b", Slow("slow_b", "due_date"))
+    monkeypatch.setitem(AGENTS, "router", Route())
+    monkeypatch.setattr(dag, "AGENT_WORKERS", 4)
+
+    start = time.perf_counter()
+    res = run_pipeline(TABLE_INVOICE)
+    assert time.perf_counter() - start < 0.55
+    assert (res.invoice_number, res.due_date) == ("slow_a", "slow_b")
+    assert res.meta["agents_ran"][-2:] == ["slow_a", "slow_b"]
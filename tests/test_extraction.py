@@ -1,7 +1,12 @@
 """Tests for invoice extraction functionality."""
 
+import json
 import unittest
 from pathlib import Path
+from unittest import mock
+
+from agents.invoice_extraction_agent import InvoiceExtractionAgent, _regex_fallback
+from schemas import AgentContext, InvoiceResult
 
 
 class TestInvoiceExtraction(unittest.TestCase):
@@ -30,6 +35,50 @@ class TestInvoiceExtraction(unittest.TestCase):
         sample_text = "Invoice #12345 Date: 01/15/2025 Amount: $100.00"
         self.assertIsNotNone(sample_text)
 
+    def test_deterministic_tier_matches_eval_set(self):
+        """The first (regex) tier alone gets the eval set's key fields right."""
+        eval_dir = self.test_dir.parent / "data" / "eval"
+        for txt in sorted(eval_dir.glob("*.txt")):
+            gold = json.loads(txt.with_suffix("").with_suffix(".expected.json").read_text(encoding="utf-8"))
+            got = _regex_fallback(txt.read_text(encoding="utf-8"))
+            for field in ("vendor", "invoice_date", "amount_total", "currency"):
+                self.assertEqual(got[field], gold[field], f"{txt.name}: {field}")
+
+    def _extract(self, text, llm_answer):
+        ctx = AgentContext(raw_text=text, cleaned_text=text)
+        with mock.patch("agents.invoice_extraction_agent.generate_json", return_value=llm_answer) as llm:
+            result = InvoiceExtractionAgent().run(ctx, InvoiceResult())
+        return result, llm
+
+    def test_high_confidence_invoice_skips_llm(self):
+        """Vendor, date and consistent totals found: no LLM call."""
+        text = "Invoice\nOpenAI, L.L.C.\nInvoice Date: November 2, 2025\nSubtotal: £20.00\nTax: £4.00\nTotal: £24.00"
+        result, llm = self._extract(text, {})
+        llm.assert_not_called()
+        self.assertEqual(result.meta["extraction_tier"], "deterministic")
+        self.assertEqual(result.amount_total, 24.0)
+        self.assertEqual(result.invoice_date, "2025-11-02")
+
+    def test_total_without_subtotal_is_rechecked_by_llm(self):
+        """A total nothing reconciles (no subtotal) does not skip the LLM; its amounts win."""
+        text = "Reference copy\nInvoice date: 2025-05-01\nSubtotal\nTax\nTotal\n100.00\n20.00\n120.00 EUR"
+        result, llm = self._extract(text, {"subtotal": 100.0, "amount_tax": 20.0, "amount_total": 120.0})
+        llm.assert_called_once()
+        self.assertEqual(result.meta["extraction_tier"], "llm_partial")
+        self.assertNotIn("tier_hit_rates", result.meta)
+        self.assertEqual((result.subtotal, result.amount_tax, result.amount_total), (100.0, 20.0, 120.0))
+
+    def test_llm_is_asked_only_for_missing_fields(self):
+        """No date found: the LLM prompt only carries the missing fields."""
+        text = "Invoice\nACME Corp\nTotal: $10.00"
+        result, llm = self._extract(text, {"invoice_date": "2025-01-31", "vendor": "Ignored"})
+        prompt = llm.call_args[0][0]
+        self.assertIn('"invoice_date"', prompt)
+        self.assertNotIn('"vendor"', prompt)
+        self.assertEqual(result.meta["extraction_tier"], "llm_partial")
+        self.assertEqual(result.vendor, "ACME Corp")
+        self.assertEqual(result.invoice_date, "2025-01-31")
+
 
 if __name__ == "__main__":
     unittest.main()
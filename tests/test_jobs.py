@@ -0,0 +1,39 @@
+import asyncio
+
+import httpx
+
+from db import init_db, get_session
+from jobs import enqueue, claim_next, process_job, batch_status
+from pdf import SpooledUpload
+from tests.test_batch import _pdf
+
+
+def test_submitted_job_is_claimed_once_and_reported(tmp_path):
+    init_db()
+    pdf_path = tmp_path / "a.pdf"
+    pdf_path.write_bytes(_pdf("ACME invoice"))
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"vendor": "ACME", "warnings": [], "trace": []})
+
+    session = get_session()
+    try:
+        run = enqueue(session, "b_test", "a.pdf", SpooledUpload(str(pdf_path), 0, "h"))
+        assert batch_status(session, "b_test")["summary"]["queued"] == 1
+
+        job = claim_next(session)
+        assert job is not None and job.run_id == run.id
+        assert claim_next(session) is None  # nothing left to hand out
+
+        async def go():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+                await process_job(session, client, job)
+
+        asyncio.run(go())
+
+        status = batch_status(session, "b_test")
+        assert status["done"] is True
+        assert status["results"][0]["status"] == "ok"
+        assert status["summary"]["ok"] == 1
+    finally:
+        session.close()
@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+import httpx
+
+from llm import ollama
+from llm.json_stream import JsonStreamScanner, field_listener
+
+
+def _tokens(text, size=3):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_scanner_stops_at_first_complete_object_and_reports_fields():
+    fields = []
+    scanner = JsonStreamScanner("object", on_field=lambda k, v: fields.append((k, v)))
+    answer = 'Sure! {"vendor": "A {b} \\"c\\"", "lines": [1, {"x": 2}], "amount_total": 12.5} Hope this helps {"x": 1}'
+
+    value = None
+    consumed = 0
+    for tok in _tokens(answer):
+        consumed += 1
+        value = scanner.feed(tok)
+        if value is not None:
+            break
+
+    assert value == {"vendor": 'A {b} "c"', "lines": [1, {"x": 2}], "amount_total": 12.5}
+    assert fields == [("vendor", 'A {b} "c"'), ("lines", [1, {"x": 2}]), ("amount_total", 12.5)]
+    assert consumed < len(_tokens(answer))  # the trailing ramble is never read
+
+
+def test_scanner_skips_invalid_candidates_and_handles_arrays():
+    scanner = JsonStreamScanner("object")
+    assert scanner.feed("{not json} then {\"a\": 1}") == {"a": 1}
+
+    items = []
+    scanner = JsonStreamScanner("array", on_field=lambda k, v: items.append((k, v)))
+    assert scanner.feed('[{"id": 0}, {"id": 1}]') == [{"id": 0}, {"id": 1}]
+    assert items == [("0", {"id": 0}), ("1", {"id": 1})]
+
+
+def _ndjson(answer):
+    return [json.dumps({"response": tok, "done": False}) for tok in _tokens(answer)] + [json.dumps({"response": "", "done": True})]
+
+
+def test_sync_stream_hangs_up_after_the_object(monkeypatch):
+    lines = _ndjson('{"vendor": "ACME", "amount_total": 3} and some more words ' * 3)
+    read = []
+
+    class FakeResponse:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def raise_for_status(self):
+            pass
+
+        def iter_lines(self, decode_unicode=True):
+            for line in lines:
+                read.append(line)
+                yield line
+
+    class FakeSession:
+        def post(self, url, json, timeout, stream):
+            assert json["stream"] is True and stream is True
+            return FakeResponse()
+
+    monkeypatch.setattr(ollama, "OLLAMA_STREAM", True)
+    monkeypatch.setattr(ollama, "http_session", lambda: FakeSession())
+    fields = []
+    with field_listener(lambda k, v: fields.append(k)):
+        assert ollama.ollama_generate("prompt") == {"vendor": "ACME", "amount_total": 3}
+    assert fields == ["vendor", "amount_total"]
+    assert len(read) < len(lines)
+
+
+def test_async_stream_parses_ndjson(monkeypatch):
+    body = "\n".join(_ndjson('Here: {"vendor": "Beta"}')).encode()
+
+    def handler(request):
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(200, content=body)
+
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            monkeypatch.setattr(ollama, "async_http_client", lambda: client)
+            return await ollama.aollama_generate("prompt")
+
+    monkeypatch.setattr(ollama, "OLLAMA_STREAM", True)
+    assert asyncio.run(go()) == {"vendor": "Beta"}
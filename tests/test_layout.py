@@ -0,0 +1,81 @@
+import fitz
+
+from agents.line_items_agent import LineItemsAgent
+from agents.preprocess_agent import TextPreprocessAgent
+from orchestrator import run_pipeline
+from pdf import extract_document_from_path
+from schemas import AgentContext, DocumentLayout, InvoiceResult
+
+ITEMS = [("Paper A4", "3", "5.00", "15.00"), ("Toner", "2", "42.50", "85.00")]
+
+
+def _invoice_pdf(path):
+    """
+    Written column by column: in text order labels and values (and cells of a row) are far apart.
+    """
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 40), "Reference copy", fontsize=8)
+    page.insert_text((72, 70), "Northwind Traders", fontsize=20)
+    page.insert_text((72, 100), "Invoice number: INV-7")
+    page.insert_text((72, 115), "Invoice date: 2025-05-01")
+    for x, header in zip((72, 250, 320, 420), ("Description", "Qty", "Unit price", "Amount")):
+        page.insert_text((x, 160), header)
+    for col, x in enumerate((72, 250, 320, 420)):
+        for row, item in enumerate(ITEMS):
+            page.insert_text((x, 180 + 15 * row), item[col])
+    for row, label in enumerate(("Subtotal", "Tax", "Total")):
+        page.insert_text((320, 260 + 15 * row), label)
+    for row, value in enumerate(("100.00", "20.00", "120.00 EUR")):
+        page.insert_text((420, 260 + 15 * row), value)
+    doc.save(str(path))
+
+
+def test_totals_and_letterhead_are_read_from_the_geometry(tmp_path):
+    path = tmp_path / "invoice.pdf"
+    _invoice_pdf(path)
+    content = extract_document_from_path(str(path), layout=True)
+    layout = DocumentLayout(**content.layout)
+
+    text_only = run_pipeline(content.text)
+    assert text_only.amount_total == 100.0  # the value printed after "Total" in text order
+    assert text_only.vendor == "Reference copy"
+
+    res = run_pipeline(content.text, layout=layout)
+    assert "text" not in content.layout and layout.line_texts(content.text)[1] == "Northwind Traders"
+    assert (res.subtotal, res.amount_tax, res.amount_total) == (100.0, 20.0, 120.0)
+    assert res.vendor == "Northwind Traders"
+    assert [(i["description"], i["quantity"], i["amount"], i["checked"]) for i in res.line_items] == [
+        ("Paper A4", 3.0, 15.0, True), ("Toner", 2.0, 85.0, True),
+    ]
+    assert res.meta["line_items_check"]["matches"] is True
+
+
+def test_layout_rows_keep_the_cells_of_an_item_together(tmp_path):
+    path = tmp_path / "invoice.pdf"
+    _invoice_pdf(path)
+    content = extract_document_from_path(str(path), layout=True)
+
+    # text order: both descriptions, then the values column by column -> one merged row
+    ctx = AgentContext(raw_text=content.text)
+    res = LineItemsAgent().run(ctx, TextPreprocessAgent().run(ctx, InvoiceResult()))
+    assert [i["description"] for i in res.line_items] == ["Paper A4 Toner"]
+
+    ctx = AgentContext(raw_text=content.text, layout=DocumentLayout(**content.layout))
+    res = LineItemsAgent().run(ctx, TextPreprocessAgent().run(ctx, InvoiceResult()))
+    assert [i["checked"] for i in res.line_items] == [True, True]
+
+
+def test_pdf_cache_key_tells_layout_requests_apart(tmp_path):
+    from orchestrator import extraction_cache
+
+    path = tmp_path / "invoice.pdf"
+    _invoice_pdf(path)
+    content = extract_document_from_path(str(path), layout=True)
+    extraction_cache().clear()
+
+    assert run_pipeline(content.text, content_hash="layout-pdf").amount_total == 100.0
+    res = run_pipeline(content.text, content_hash="layout-pdf", layout=DocumentLayout(**content.layout))
+    assert res.meta["cache"] == {"hit": False} and res.amount_total == 120.0
+    again = run_pipeline("ignored", content_hash="layout-pdf", layout=DocumentLayout(**content.layout))
+    assert again.meta["cache"]["key"] == "pdf" and again.amount_total == 120.0
@@ -0,0 +1,98 @@
+from agents.line_items_agent import LineItemsAgent
+from agents.preprocess_agent import TextPreprocessAgent
+from agents.validation_agent import ValidationAgent
+from llm import gateway
+from schemas import AgentContext, InvoiceResult
+
+# PyMuPDF text of a table with one cell per line (data/eval/011.pdf, shortened)
+CELLS = """Invoice No: 90001779
+Description /
+Country Of Origin
+Net
+(excl Tax)
+Qty/UOM
+Unit Price
+80000851
+1010050
+FORTAN EXTRA 13 CUSTOMER
+SPECIAL
+9,240.00
+924.00
+12,000 KG
+0.77
+1000312
+ANFO CUSTOMER SPECIAL
+3,600.00
+360.00
+6,000 KG
+0.60
+3055750
+Freight
+400.00
+40.00
+1 PC
+400.00
+Sub Total(Net Excl. Tax)
+13,240.00 AUD
+Total 14,564.00 AUD"""
+
+LINES = """ACME Ltd
+Description Qty Unit price Amount
+Widget A 2 10.00 20.00
+Pack of 12 PC 3 4.00 12.00
+Odd row 5 3.00 17.00
+Subtotal 49.00
+Total 58.80"""
+
+
+def _run(text: str) -> InvoiceResult:
+    ctx = AgentContext(raw_text=text)
+    res = TextPreprocessAgent().run(ctx, InvoiceResult())
+    return LineItemsAgent().run(ctx, res)
+
+
+def test_cell_table_columns_are_found_from_the_arithmetic():
+    res = _run(CELLS)
+
+    assert [(i["description"], i["quantity"], i["unit_price"], i["amount"]) for i in res.line_items] == [
+        ("FORTAN EXTRA 13 CUSTOMER SPECIAL", 12000.0, 0.77, 9240.0),
+        ("ANFO CUSTOMER SPECIAL", 6000.0, 0.6, 3600.0),
+        ("Freight", 1.0, 400.0, 400.0),
+    ]
+    assert all(i["checked"] for i in res.line_items)
+    check = res.meta["line_items_check"]
+    assert check["matches"] is True and check["sum"] == check["subtotal"] == 13240.0
+
+
+def test_only_failed_rows_go_to_the_llm(monkeypatch):
+    prompts = []
+
+    def fake_ollama(prompt, expect="object"):
+        prompts.append((prompt, expect))
+        return [{"description": "Odd row", "quantity": 5, "unit_price": 3.4, "amount": 17.0}]
+
+    monkeypatch.setenv("LLM_BACKEND", "ollama")
+    monkeypatch.setattr(gateway, "ollama_generate", fake_ollama)
+    previous = gateway.response_cache()
+    gateway.set_response_cache(None)
+    try:
+        res = _run(LINES)
+    finally:
+        gateway.set_response_cache(previous)
+
+    assert len(prompts) == 1 and prompts[0][1] == "array"
+    assert "Odd row" in prompts[0][0] and "Widget A" not in prompts[0][0]
+    assert res.line_items[1]["description"] == "Pack of 12 PC"
+    assert res.line_items[2] == {"description": "Odd row", "quantity": 5.0, "unit_price": 3.4,
+                                 "amount": 17.0, "checked": True, "source": "llm"}
+    assert res.meta["line_items_check"]["matches"] is True
+
+
+def test_unchecked_rows_and_sum_mismatch_are_warnings():
+    res = _run(LINES.replace("Subtotal 49.00", "Subtotal 60.00"))  # LLM_BACKEND=none: the odd row stays unchecked
+
+    assert res.line_items[2]["checked"] is False and res.line_items[2]["amount"] == 17.0
+    res = ValidationAgent().run(AgentContext(raw_text=""), res)
+    assert "LINE_ITEMS_UNCHECKED" in res.warnings and "LINE_ITEMS_MISMATCH_SUBTOTAL" in res.warnings
+
+    assert _run("Invoice\nSubtotal: 20.00\nTotal: 24.00").meta["line_items_check"]["matches"] is None
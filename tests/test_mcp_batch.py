@@ -0,0 +1,70 @@
+import json
+
+from fastapi.testclient import TestClient
+
+import server
+from orchestrator import extraction_cache
+
+INVOICE = "Invoice\nACME Corp\nDate: 2025-03-01\nSubtotal 10.00\nVAT 2.00\nTotal EUR 12.00"
+
+
+def test_process_batch_returns_items_in_order_and_isolates_errors(monkeypatch):
+    extraction_cache().clear()
+    real, real_batch = server.arun_pipeline, server.arun_pipeline_batch
+    groups = []
+
+    async def flaky(text, **kwargs):
+        if "boom" in text:
+            raise ValueError("cannot parse")
+        return await real(text, **kwargs)
+
+    async def flaky_batch(texts, **kwargs):
+        groups.append(len(texts))
+        if any("boom" in t for t in texts):
+            raise ValueError("cannot parse")
+        return await real_batch(texts, **kwargs)
+
+    # the group fails as a whole, then its items are retried one by one
+    monkeypatch.setattr(server, "arun_pipeline", flaky)
+    monkeypatch.setattr(server, "arun_pipeline_batch", flaky_batch)
+    client = TestClient(server.app)
+    items = [{"text": INVOICE}, {"text": "boom"}, {"text": INVOICE.replace("ACME", "Beta"), "include_trace": False}]
+
+    body = client.post("/process/batch", json={"items": items}).json()
+    assert [it["index"] for it in body["items"]] == [0, 1, 2]
+    assert [it["status"] for it in body["items"]] == ["ok", "error", "ok"]
+    assert body["items"][0]["result"]["amount_total"] == 12.0
+    assert body["items"][0]["result"]["trace"] and body["items"][2]["result"]["trace"] == []
+    assert body["items"][1]["error"] == "cannot parse"
+    assert body["summary"] == {"total": 3, "ok": 2, "error": 1}
+    assert groups == [3]
+
+    resp = client.post("/process/batch", json={"items": items, "stream": True})
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert sorted(line["index"] for line in lines) == [0, 1, 2]
+
+
+def test_process_batch_rejects_oversized_batches(monkeypatch):
+    monkeypatch.setattr(server, "MCP_BATCH_MAX_ITEMS", 1)
+    resp = TestClient(server.app).post("/process/batch", json={"items": [{"text": "a"}, {"text": "b"}]})
+    assert resp.status_code == 413
+
+
+def test_process_batch_runs_groups_through_the_packed_pipeline(monkeypatch):
+    extraction_cache().clear()
+    real_batch = server.arun_pipeline_batch
+    groups = []
+
+    async def spy(texts, **kwargs):
+        groups.append(len(texts))
+        return await real_batch(texts, **kwargs)
+
+    monkeypatch.setattr(server, "arun_pipeline_batch", spy)
+    monkeypatch.setattr(server, "MCP_BATCH_PACK_SIZE", 2)
+    items = [{"text": INVOICE.replace("ACME", f"Vendor {i}")} for i in range(5)]
+
+    body = TestClient(server.app).post("/process/batch", json={"items": items}).json()
+    assert sorted(groups) == [1, 2, 2]
+    assert [it["index"] for it in body["items"]] == [0, 1, 2, 3, 4]
+    assert body["summary"]["ok"] == 5
@@ -0,0 +1,88 @@
+import json
+import sqlite3
+
+from sqlalchemy import event
+from sqlmodel import SQLModel, create_engine
+
+import models  # noqa: F401  (registers the tables)
+from migrations import migrate
+
+
+def _legacy_db(path):
+    con = sqlite3.connect(path)
+    con.execute(
+        "CREATE TABLE run (id VARCHAR PRIMARY KEY, created_at DATETIME, status VARCHAR, error_message VARCHAR,"
+        " source_filename VARCHAR, vendor VARCHAR, invoice_date VARCHAR, amount_total VARCHAR,"
+        " result_json JSON, trace_json JSON)"
+    )
+    rows = [
+        ("r1", "ok", "2025-11-02", "24.0", {"vendor": "ACME", "currency": "eur", "warnings": ["totals mismatch"]}, {"trace": [{"agent": "extract"}]}),
+        ("r2", "ok", "Nov 2, 2025", "n/a", {"vendor": "Beta", "warnings": []}, {"trace": []}),
+        ("r3", "error", None, None, {}, {}),
+    ]
+    for run_id, status, invoice_date, amount, result, trace in rows:
+        con.execute(
+            "INSERT INTO run (id, created_at, status, invoice_date, amount_total, result_json, trace_json)"
+            " VALUES (?, '2025-01-01 00:00:00', ?, ?, ?, ?, ?)",
+            (run_id, status, invoice_date, amount, json.dumps(result), json.dumps(trace)),
+        )
+    con.commit()
+    con.close()
+
+
+def test_split_run_payload_migration(tmp_path):
+    path = tmp_path / "app.db"
+    _legacy_db(path)
+    engine = create_engine(f"sqlite:///{path}")
+
+    SQLModel.metadata.create_all(engine)
+    assert migrate(engine) >= 1
+    assert migrate(engine) >= 1  # idempotent
+
+    con = sqlite3.connect(path)
+    cols = {row[1] for row in con.execute("PRAGMA table_info(run)")}
+    assert "result_json" not in cols and "warning_count" in cols
+
+    payloads = dict(con.execute("SELECT run_id, result_json FROM runpayload").fetchall())
+    assert set(payloads) == {"r1", "r2"}
+    assert json.loads(payloads["r1"])["vendor"] == "ACME"
+    assert dict(con.execute("SELECT id, warning_count FROM run").fetchall()) == {"r1": 1, "r2": 0, "r3": 0}
+
+    # typed columns: ISO dates and numbers survive, raw values become NULL
+    typed = {r[0]: r[1:] for r in con.execute("SELECT id, invoice_date, amount_total FROM run")}
+    assert typed == {"r1": ("2025-11-02", 24.0), "r2": (None, None), "r3": (None, None)}
+
+    # v4: currency copied from the payload, aggregates rebuilt from the ok runs
+    assert dict(con.execute("SELECT id, currency FROM run").fetchall()) == {"r1": "EUR", "r2": None, "r3": None}
+    aggregates = con.execute(
+        "SELECT currency, month, run_count, amount_total, warning_runs FROM runaggregate ORDER BY currency"
+    ).fetchall()
+    assert aggregates == [("", "", 1, 0, 0), ("EUR", "2025-11", 1, 24.0, 1)]
+
+
+def test_migrations_without_drop_column(tmp_path):
+    # SQLite < 3.35 has no ALTER TABLE ... DROP COLUMN
+    path = tmp_path / "app.db"
+    _legacy_db(path)
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _old_sqlite(conn, cursor, statement, *args):
+        if "DROP COLUMN" in statement:
+            raise sqlite3.OperationalError('near "DROP": syntax error')
+
+    SQLModel.metadata.create_all(engine)
+    assert migrate(engine) >= 3
+
+    con = sqlite3.connect(path)
+    declared = {row[1]: row[2] for row in con.execute("PRAGMA table_info(run)")}
+    assert declared["amount_total"].startswith("NUMERIC") and "amount_total_num" not in declared
+    assert con.execute("SELECT COUNT(*) FROM run WHERE result_json IS NOT NULL").fetchone() == (0,)
+    typed = {r[0]: r[1:] for r in con.execute("SELECT id, invoice_date, amount_total FROM run")}
+    assert typed == {"r1": ("2025-11-02", 24.0), "r2": (None, None), "r3": (None, None)}
+
+    indexes = {row[1] for row in con.execute("PRAGMA index_list(run)")}
+    assert {"ix_run_amount_total", "ix_run_created_id", "ix_run_vendor_created"} <= indexes
+    assert con.execute(
+        "SELECT COUNT(*) FROM runpayload p JOIN run r ON r.id = p.run_id"
+    ).fetchone() == (2,)
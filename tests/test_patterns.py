@@ -0,0 +1,45 @@
+from patterns import BUILTIN_PATTERNS, PatternEngine, load_config_patterns, scan_text
+
+
+def test_scan_returns_typed_candidates_with_positions():
+    text = "ACME Corp\nInvoice number: INV-7\nDate: 03/02/2025\nTVA: 20%\nTotal: 24,00 €"
+    scan = scan_text(text)
+
+    number = scan.first("invoice_number", source="builtin")
+    assert (number.value, number.line) == ("INV-7", 1)
+    assert text[number.start:number.end] == "INV-7"
+
+    assert scan.first("date", source="builtin", lines=[2]).value == "03/02/2025"
+    # overlapping kinds at the same position are all reported
+    assert scan.first("tax_label").line == 3
+    assert scan.first("fr_marker").value == "TVA"
+    assert scan.first("currency_symbol", lines=[4]).value == "€"
+
+
+def test_same_kind_suffixes_are_dropped():
+    engine = PatternEngine(load_config_patterns())
+    amounts = [c.value for c in engine.scan("Paid 1480.00 and 99.90").of("amount")]
+    assert amounts == ["1480.00", "99.90"]
+
+
+def test_config_patterns_loaded_and_invalid_ones_skipped(tmp_path):
+    cfg = tmp_path / "features.yml"
+    cfg.write_text(
+        "features:\n"
+        "  regex_analysis:\n"
+        "    enabled: true\n"
+        "    patterns:\n"
+        "      iban:\n"
+        "        pattern: 'IBAN:?\\s*([A-Z]{2}\\d{2}[A-Z0-9 ]+)'\n"
+        "        required: true\n"
+        "      broken:\n"
+        "        pattern: '([a-z'\n",
+        encoding="utf-8",
+    )
+    specs = load_config_patterns(cfg)
+    assert [s.kind for s in specs] == ["iban"]
+
+    engine = PatternEngine(BUILTIN_PATTERNS + specs)
+    scan = engine.scan("IBAN: FR76 3000")
+    assert scan.first("iban").value == "FR76 3000"
+    assert engine.scan("no bank details").missing_required() == ["iban"]
@@ -0,0 +1,103 @@
+import asyncio
+import io
+import os
+
+import fitz
+import pytest
+from fastapi import UploadFile
+
+from pdf import FileTooLarge, extract_text_from_path, spool_upload
+
+
+def _multi_page_pdf(path, pages):
+    doc = fitz.open()
+    for text in pages:
+        doc.new_page().insert_text((72, 72), text)
+    doc.save(str(path))
+
+
+def test_extraction_stops_after_totals_page(tmp_path):
+    path = tmp_path / "statement.pdf"
+    _multi_page_pdf(path, ["Invoice ACME", "Subtotal 10.00\nTotal 12.00 EUR", "Terms and conditions", "Annex"])
+
+    text = extract_text_from_path(str(path), stop_at_totals=True)
+    assert "Total 12.00" in text
+    assert "Terms" not in text
+
+    assert "Annex" in extract_text_from_path(str(path), stop_at_totals=False)
+    assert extract_text_from_path(str(path), max_pages=1, stop_at_totals=False).strip() == "Invoice ACME"
+
+
+def test_spool_upload_enforces_size_limit(tmp_path):
+    upload = UploadFile(file=io.BytesIO(b"x" * 2048), filename="big.pdf")
+    with pytest.raises(FileTooLarge):
+        asyncio.run(spool_upload(upload, max_bytes=1024))
+
+    spooled = asyncio.run(spool_upload(UploadFile(file=io.BytesIO(b"%PDF"), filename="ok.pdf")))
+    assert spooled.size == 4
+    with open(spooled.path, "rb") as fh:
+        assert fh.read() == b"%PDF"
+    os.unlink(spooled.path)
+
+
+def test_sharded_extraction_matches_serial(tmp_path, monkeypatch):
+    import pdf
+
+    path = tmp_path / "statement.pdf"
+    _multi_page_pdf(path, [f"Page {i} line items" for i in range(7)])
+    monkeypatch.setattr(pdf, "PDF_PARALLEL_MIN_PAGES", 4)
+    monkeypatch.setattr(pdf, "PDF_PAGES_PER_SHARD", 2)
+
+    sharded = asyncio.run(pdf.extract_text_async(str(path)))
+    assert sharded == extract_text_from_path(str(path))
+    assert [line for line in sharded.splitlines() if line] == [f"Page {i} line items" for i in range(7)]
+
+
+def test_sharded_extraction_stops_after_the_totals(tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    import pdf
+
+    path = tmp_path / "statement.pdf"
+    _multi_page_pdf(path, [f"Page {i}\nTotal due 9.00" if i == 2 else f"Page {i} annex" for i in range(12)])
+    started = []
+    real = pdf.extract_page_range
+
+    def spy(path, start, stop, with_layout=False):
+        started.append(start)
+        return real(path, start, stop, with_layout)
+
+    monkeypatch.setattr(pdf, "extract_page_range", spy)
+    monkeypatch.setattr(pdf, "get_pdf_pool", lambda: ThreadPoolExecutor(1))
+    monkeypatch.setattr(pdf, "PDF_WORKERS", 2)
+    monkeypatch.setattr(pdf, "PDF_PARALLEL_MIN_PAGES", 4)
+    monkeypatch.setattr(pdf, "PDF_PAGES_PER_SHARD", 2)
+
+    text = asyncio.run(pdf.extract_text_async(str(path)))
+    assert text == extract_text_from_path(str(path))
+    assert "Total due" in text and "Page 3" not in text
+    # shard [2, 4) holds the totals: at most the one shard already queued behind it was started
+    assert started[:2] == [0, 2] and set(started) <= {0, 2, 4}
+
+
+def test_layout_comes_from_the_same_pass(tmp_path, monkeypatch):
+    import pdf
+
+    path = tmp_path / "statement.pdf"
+    _multi_page_pdf(path, [f"Page {i}\nTotal due {i}.00" if i == 5 else f"Page {i} line items" for i in range(7)])
+    content = pdf.extract_document_from_path(str(path), layout=True, stop_at_totals=False)
+
+    assert content.text == extract_text_from_path(str(path), stop_at_totals=False)
+    layout = content.layout
+    lines = content.text.split("\n")
+    assert "text" not in layout  # MCP reads the line texts from the request text
+    assert [lines[i] for i in layout["line"]] == [line for line in lines if line]
+    assert len(layout["pages"]) == 7 and layout["page"][-1] == 6
+    assert all(len(layout[k]) == len(layout["line"]) for k in pdf.LAYOUT_COLUMNS)
+    assert layout["size"][0] == 11.0 and layout["y0"][0] < layout["y1"][0]
+
+    monkeypatch.setattr(pdf, "PDF_PARALLEL_MIN_PAGES", 4)
+    monkeypatch.setattr(pdf, "PDF_PAGES_PER_SHARD", 2)
+    monkeypatch.setattr(pdf, "PDF_STOP_AT_TOTALS", False)
+    sharded = asyncio.run(pdf.extract_document_async(str(path), layout=True))
+    assert sharded == content
@@ -0,0 +1,55 @@
+import os
+import time
+
+from blobs import BLOB_DIR, put_blob, resolve_trace, sweep_blobs, trace_for_storage
+from orchestrator import run_pipeline
+
+TEXT = "ACME Corp\nInvoice Date: 2025-01-31\n" + "Consulting services line\n" * 40 + "Total: $10.00"
+
+
+def test_mcp_summary_level_shortens_large_values_to_previews(monkeypatch):
+    monkeypatch.setenv("EXTRACTION_CACHE", "0")
+    full = run_pipeline(TEXT, trace_level="full").trace
+    summary = run_pipeline(TEXT, trace_level="summary").trace
+    assert [e.agent for e in summary] == [e.agent for e in full]
+
+    pre = next(e for e in summary if e.agent == "preprocess")
+    # MCP has no blob store: no "$blob" ref that nothing could resolve, a preview instead
+    assert "$blob" not in pre.data["raw_text"] and pre.data["raw_text"]["len"] == len(TEXT.encode())
+    assert TEXT.startswith(pre.data["raw_text"]["$preview"])
+    assert run_pipeline(TEXT).trace[0].data == pre.data  # same default level as the API
+    assert run_pipeline(TEXT, trace_level="off").trace == []
+
+
+def test_api_summary_storage_round_trips_through_blob_store():
+    trace = {"trace": [
+        {"agent": "preprocess", "action": "clean text", "data": {"raw_text": TEXT, "chars": len(TEXT)}},
+        {"agent": "extract", "action": "invoice extraction", "data": {"tier": "deterministic"}},
+    ]}
+    stored = trace_for_storage(trace, level="summary")
+    ref = stored["trace"][0]["data"]["raw_text"]
+    assert ref["type"] == "text" and ref["len"] == len(TEXT.encode())
+    assert stored["trace"][0]["data"]["chars"] == len(TEXT)
+    assert stored["trace"][1] == trace["trace"][1]
+
+    # content addressed: storing the same trace again adds no blob
+    n_blobs = len(list(BLOB_DIR.rglob("*.z")))
+    trace_for_storage(trace, level="summary")
+    assert len(list(BLOB_DIR.rglob("*.z"))) == n_blobs
+
+    assert resolve_trace(stored) == trace
+    assert trace_for_storage(trace, level="off") == {}
+
+
+def test_sweep_removes_blobs_past_retention_only():
+    old, fresh = put_blob(b"old trace value" * 50), put_blob(b"fresh trace value" * 50)
+    old_path = BLOB_DIR / old[:2] / f"{old}.z"
+    past = time.time() - 3600
+    os.utime(old_path, (past, past))
+
+    assert sweep_blobs(max_age_s=600) >= 1
+    assert not old_path.exists() and (BLOB_DIR / fresh[:2] / f"{fresh}.z").exists()
+
+    # referencing a blob again refreshes it
+    put_blob(b"fresh trace value" * 50)
+    assert sweep_blobs(max_age_s=600) == 0
@@ -0,0 +1,91 @@
+from datetime import datetime
+
+from sqlmodel import Session, SQLModel, create_engine
+
+import vendor_registry
+from agents.vendor_agent import VendorAgent
+from llm import gateway
+from models import Run
+from schemas import AgentContext, InvoiceResult
+from vendor_registry import VendorRegistry, normalize_vendor
+
+
+def test_lookup_exact_alias_and_fuzzy():
+    registry = VendorRegistry()
+    registry.add("OpenAI, L.L.C.", ["OpenAI Ireland"])
+    registry.add("Northwind Traders Ltd")
+
+    assert normalize_vendor("Open AI, L.L.C.") == normalize_vendor("OPENAI LLC") == "openai"
+    assert registry.lookup("OpenAI LLC").vendor == "OpenAI, L.L.C."
+    assert registry.lookup("OpenAI Ireland Limited").alias == "OpenAI Ireland"
+
+    typo = registry.lookup("Nortwind Traders")
+    assert typo.vendor == "Northwind Traders Ltd" and not typo.exact and typo.score >= 0.75
+    assert registry.lookup("Globex Corporation") is None
+    assert registry.stats()["fuzzy_hits"] == 1 and registry.stats()["misses"] == 1
+
+
+def test_registry_persists_and_imports_runs(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        for vendor, status in [("ACME Corp", "ok"), ("ACME Corp", "ok"), ("Acme Corp.", "ok"),
+                               ("Initech", "ok"), ("Broken Inc", "error")]:
+            session.add(Run(vendor=vendor, status=status, created_at=datetime(2025, 1, 1)))
+        session.commit()
+
+    path = str(tmp_path / "vendors.db")
+    registry = VendorRegistry(path)
+    assert registry.import_runs(str(tmp_path / "app.db")) == 3
+    registry.learn("Globex Intl", "Globex Corporation")
+
+    reopened = VendorRegistry(path)
+    assert reopened.stats()["vendors"] == 3  # ACME Corp (+ Acme Corp.), Initech, Globex Corporation
+    assert reopened.lookup("acme corp").vendor == "ACME Corp"  # most frequent spelling is canonical
+    assert reopened.lookup("Globex Intl").vendor == "Globex Corporation"
+    assert reopened.lookup("Broken Inc") is None
+
+
+def test_vendor_agent_asks_the_llm_only_for_unseen_names(monkeypatch):
+    prompts = []
+
+    def fake_ollama(prompt, expect="object"):
+        prompts.append(prompt)
+        return {"vendor_canonical": "Initech"}
+
+    monkeypatch.setenv("LLM_BACKEND", "ollama")
+    monkeypatch.setattr(gateway, "ollama_generate", fake_ollama)
+    monkeypatch.setattr(vendor_registry, "_registry", VendorRegistry())
+    previous = gateway.response_cache()
+    gateway.set_response_cache(None)
+    try:
+        first = VendorAgent().run(AgentContext(raw_text=""), InvoiceResult(vendor="Initech Solutions  Ltd"))
+        ctx = AgentContext(raw_text="")
+        again = VendorAgent().run(ctx, InvoiceResult(vendor="INITECH SOLUTIONS"))
+        empty = VendorAgent().run(AgentContext(raw_text=""), InvoiceResult())
+    finally:
+        gateway.set_response_cache(previous)
+
+    assert len(prompts) == 1 and "Initech Solutions Ltd" in prompts[0]
+    assert first.vendor == again.vendor == "Initech"
+    assert ctx.trace[-1].data["source"] == "registry"
+    assert empty.vendor == "" and vendor_registry.vendor_registry().stats()["learned"] == 1
+
+
+def test_process_registry_is_built_from_seed_file_and_runs(tmp_path, monkeypatch):
+    seed = tmp_path / "vendors.yml"
+    seed.write_text("vendors:\n  - name: OpenAI, L.L.C.\n    aliases: [OpenAI Ireland]\n", encoding="utf-8")
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(Run(vendor="Initech", status="ok", created_at=datetime(2025, 1, 1)))
+        session.commit()
+
+    monkeypatch.setenv("VENDOR_REGISTRY_PATH", str(tmp_path / "vendors.db"))
+    monkeypatch.setenv("VENDOR_SEED_FILE", str(seed))
+    monkeypatch.setenv("VENDOR_RUNS_DB", str(tmp_path / "app.db"))
+    monkeypatch.setattr(vendor_registry, "_registry", None)  # rebuilt from the environment
+
+    registry = vendor_registry.vendor_registry()
+    assert registry.lookup("openai ireland ltd").vendor == "OpenAI, L.L.C."
+    assert registry.lookup("INITECH").vendor == "Initech"
@@ -258,7 +258,7 @@ async function refreshHistory() {
 
       row.onclick = async () => {
         setStatus("Loading run…", true);
-        const details = await apiGet(`/runs/${r.id}`);
+        const details = await apiGet(`/runs/${r.id}?trace=full`);
         setSelectedRun(details.id, details.result, details.trace, details.status || r.status || "ok");
         setStatus("Ready.", false);
       };
@@ -374,6 +374,10 @@ function init() {
   });
 
   el("refreshHistoryBtn").addEventListener("click", refreshHistory);
+  // full history is exported (streamed) by the API, not rebuilt from what the page has fetched
+  el("exportHistoryCsvBtn").addEventListener("click", () => {
+    window.location.href = `${API_BASE}/runs/export?format=csv`;
+  });
   el("testMcpBtn").addEventListener("click", testMcpClick);
 
   el("copyJsonBtn").addEventListener("click", async () => {